@@ -0,0 +1,45 @@
+"""Permission checks of one page render: uncached vs the authorization cache.
+
+The write page checks can_edit/can_view once per section and rerun. Before,
+every check queried the registry (the session_state cache never hit); now
+checks are answered from the cache until the registry changes.
+
+    PYTHONPATH=. python benchmarks/bench_authz.py
+"""
+import os
+import time
+import tempfile
+
+from src.core.registry import DocumentRegistry
+
+USERS = 50
+CHECKS_PER_SECTION = 3  # can_view, can_edit and the lock owner check
+
+def build(path: str, documents: int) -> DocumentRegistry:
+    registry = DocumentRegistry(path, legacy_yaml=os.path.join(os.path.dirname(path), 'none.yaml'))
+    registry.put_documents({f'doc{i}.md': {
+        'creator': 'user0',
+        'users': [{'name': f'user{u}', 'permission': 'editor' if u else 'creator'} for u in range(0, USERS, 1 + i % 5)],
+    } for i in range(documents)})
+    return registry
+
+def render(check, sections: int, renders: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(renders):
+        for _ in range(sections * CHECKS_PER_SECTION):
+            check('doc1.md', 'user2')
+    return (time.perf_counter() - start) / renders * 1000
+
+def main():
+    print(f"{'documents':>10} {'sections':>9} {'uncached ms':>12} {'cached ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for documents in (100, 1_000, 10_000):
+            registry = build(os.path.join(tmp, f'registry{documents}.db'), documents)
+            for sections in (10, 100, 500):
+                uncached = render(registry.permission, sections)
+                cached = render(registry.cached_permission, sections)
+                print(f"{documents:>10} {sections:>9} {uncached:>12.2f} {cached:>10.2f}")
+            registry.close()
+
+if __name__ == '__main__':
+    main()
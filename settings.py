@@ -11,6 +11,38 @@ class Settings(BaseSettings):
     llm_provider: str = "openai"
     llm_model: str = "gpt-4o"
 
+    # Cache of LLM responses to identical prompts (see src/core/llm_cache.py)
+    llm_cache_ttl_hours: float = 24  # 0 disables the cache
+    llm_cache_max_entries: int = 2000
+
+    # Sections analysed at once, and provider requests allowed per minute (0: no limit)
+    llm_concurrency: int = 4
+    llm_requests_per_minute: float = 60
+
+    # Version retention (see src/core/versioning.py)
+    version_keep_all_days: int = 7
+    version_hourly_days: int = 30
+    version_daily_days: int = 180
+    version_min_per_section: int = 5
+    version_gc_interval: int = 3600  # seconds, 0 disables the background job
+    version_write_behind: bool = False  # persist versions from a background writer
+    version_coalesce_seconds: int = 0  # same user saving the same section again within this window replaces the version
+
+    # Section locks are leases renewed while the editor is open (see src/core/locks.py)
+    lock_ttl_seconds: int = 300
+    lock_heartbeat_seconds: int = 60
+    lock_wait_timeout: float = 1.0  # seconds a save waits for another user's lock to go away
+    lock_idle_seconds: int = 900  # locks not renewed for this long, outside a live session, are reclaimed
+    lock_sweep_interval: int = 30  # seconds, 0 disables the background sweeper
+    lock_free_editing: bool = False  # edit without locking, concurrent saves are merged (see save_section)
+
+    # Unsaved editor drafts (see src/core/drafts.py)
+    draft_ttl_hours: int = 72
+
+    # Signed login tokens in a cookie (see src/core/session_tokens.py)
+    session_secret: str = ""  # empty: a random key kept in .session_secret
+    session_ttl_hours: float = 12
+
     class Config:
         # Loads variables from a .env file in the current directory
         env_file = ".env"
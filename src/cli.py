@@ -1,7 +1,39 @@
 import argparse
+import json
 import src.core as scraibe
 import sys
 
+def add_history_filters(subparser):
+    subparser.add_argument('--limit', type=int, help='Maximum number of versions to show')
+    subparser.add_argument('--since', type=str, help='Only versions at or after this timestamp (YYYYmmddHHMMSS, or a prefix of it)')
+    subparser.add_argument('--until', type=str, help='Only versions at or before this timestamp')
+    subparser.add_argument('--user', type=str, help='Only versions saved by this user')
+    subparser.add_argument('--cursor', type=str, help='Continue after the cursor printed by a previous page')
+    subparser.add_argument('--json', action='store_true', help='Print one JSON object per line')
+
+def print_history(args, line_format):
+    """Streams the history of a section; returns the number of versions printed."""
+    history = scraibe.iter_version_history(
+        args.filename, args.section, user=args.user, since=args.since, until=args.until,
+        limit=args.limit + 1 if args.limit else None, cursor=args.cursor)
+    count = 0
+    last = None
+    for version in history:
+        if args.limit and count == args.limit:
+            # There is at least one more version, print where to continue
+            cursor = scraibe.version_cursor(last)
+            if args.json:
+                print(json.dumps({"next_cursor": cursor}))
+            else:
+                print(f"More versions: --cursor {cursor}", file=sys.stderr)
+            break
+        if count == 0 and not args.json and args.verbose:
+            print(f'Previous versions of section {args.section}:')
+        print(json.dumps(version) if args.json else line_format.format(**version))
+        count += 1
+        last = version
+    return count
+
 def main():
     parser = argparse.ArgumentParser(description='the scrAIbe - AI-assisted document writing')
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
@@ -29,6 +61,7 @@ def main():
     parser_list_versions = subparsers.add_parser('list-versions', help='List previous versions of a section')
     parser_list_versions.add_argument('filename', type=str, help='Document name')
     parser_list_versions.add_argument('section', type=str, help='Section ID')
+    add_history_filters(parser_list_versions)
 
     # Lock Section
     parser_lock = subparsers.add_parser('lock', help='Lock a section for editing')
@@ -42,6 +75,7 @@ def main():
     parser_rollback.add_argument('section', type=str, help='Section ID')
     parser_rollback.add_argument('timestamp', type=str, help='Timestamp of the version to rollback')
     parser_rollback.add_argument('user', type=str, help='User requesting rollback')
+    parser_rollback.add_argument('--author', type=str, help='User who saved the version, the requesting user by default')
 
     # Save Section Version
     parser_save = subparsers.add_parser('save-section', help='Save a version of a section')
@@ -49,6 +83,7 @@ def main():
     parser_save.add_argument('section', type=str, help='Section ID')
     parser_save.add_argument('user', type=str, help='User saving the section')
     parser_save.add_argument('content', type=str, help='New content of the section')
+    parser_save.add_argument('--base-hash', type=str, help='Hash of the text the edit started from: merge instead of waiting for locks')
 
     # Unlock Section
     parser_unlock = subparsers.add_parser('unlock', help='Unlock a section after editing')
@@ -64,7 +99,40 @@ def main():
     parser_version_history = subparsers.add_parser('version-history', help='Show version history of a section')
     parser_version_history.add_argument('filename', type=str, help='Document name')
     parser_version_history.add_argument('section', type=str, help='Section ID')
+    add_history_filters(parser_version_history)
     
+    # Blame
+    parser_blame = subparsers.add_parser('blame', help='Show who wrote each line of a section')
+    parser_blame.add_argument('filename', type=str, help='Document name')
+    parser_blame.add_argument('section', type=str, help='Section ID')
+
+    # Show Document
+    parser_show = subparsers.add_parser('show', help='Print a document, optionally as it was at a given time')
+    parser_show.add_argument('filename', type=str, help='Document name')
+    parser_show.add_argument('--at', type=str, help='Timestamp (YYYYmmddHHMMSS, or a prefix of it)')
+    parser_show.add_argument('--labels', action='store_true', help='Keep the section ID labels')
+
+    # Garbage collect versions
+    parser_gc = subparsers.add_parser('gc', help='Thin old versions following the retention policy')
+    parser_gc.add_argument('filename', type=str, nargs='?', help='Document name (all documents if omitted)')
+    parser_gc.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting it')
+
+    # Backup and restore
+    parser_backup = subparsers.add_parser('backup', help='Stream documents, versions, locks and metadata into a tar.gz')
+    parser_backup.add_argument('output', type=str, help='Archive path, or - for stdout')
+    parser_backup.add_argument('--incremental', action='store_true', help='Only what changed since the last backup')
+    parser_backup.add_argument('--since', type=str, help='Only what changed after this timestamp (YYYYmmddHHMMSS)')
+
+    parser_restore = subparsers.add_parser('restore', help='Restore a backup archive')
+    parser_restore.add_argument('archive', type=str, help='Archive path, or - for stdin')
+    parser_restore.add_argument('--document', type=str, help='Restore only this document')
+    parser_restore.add_argument('--workers', type=int, default=8, help='Parallel writers')
+
+    # Lock statistics
+    parser_lock_stats = subparsers.add_parser('lock-stats', help='Show lock contention, wait and hold times per document')
+    parser_lock_stats.add_argument('filename', type=str, nargs='?', help='Document name (all documents if omitted)')
+    parser_lock_stats.add_argument('--json', action='store_true', help='Print the raw statistics as JSON')
+
     # Delete Document
     parser_delete = subparsers.add_parser('delete', help='Delete a document, versions and locks')
     parser_delete.add_argument('filename', type=str, help='Document name')
@@ -100,22 +168,22 @@ def main():
             sys.exit(1)
 
     elif args.command == 'save-section':
-        version = scraibe.save_section(args.filename, args.section, args.user, args.content)
+        try:
+            version = scraibe.save_section(args.filename, args.section, args.user, args.content, base_hash=args.base_hash)
+        except scraibe.SectionConflictError as e:
+            print(str(e))
+            print(e.merged)
+            sys.exit(1)
         verbose_print(args.verbose, f'Section {args.section} saved as new version:')
         print(version)
 
     elif args.command == 'list-versions':
-        history = scraibe.get_version_history(args.filename, args.section)
-        if history:
-            verbose_print(args.verbose, f'Previous versions of section {args.section}:')
-            for version in history:
-                print(f"{version['timestamp']} {version['user']}")
-        else:
-            verbose_print(args.verbose, f'No previous versions found for section {args.section}.')
+        if not print_history(args, "{timestamp} {user}"):
+            verbose_print(args.verbose and not args.json, f'No previous versions found for section {args.section}.')
 
     elif args.command == 'rollback-section':
         try:
-            content = scraibe.rollback_section(args.filename, args.section, args.timestamp, args.user)
+            content = scraibe.rollback_section(args.filename, args.section, args.timestamp, args.author or args.user, args.user)
             print(f'Section {args.section} rolled back to version {args.timestamp}.')
             verbose_print(args.verbose, 'Content:')
             verbose_print(args.verbose, content)
@@ -152,13 +220,8 @@ def main():
             sys.exit(1)
             
     elif args.command == 'version-history':
-        history = scraibe.get_version_history(args.filename, args.section)
-        if history:
-            verbose_print(args.verbose, f'Previous versions of section {args.section}:')
-            for version in history:
-                print(f"{version['timestamp']} by {version['user']}")
-        else:
-            verbose_print(args.verbose, f'No previous versions found for section {args.section}.')
+        if not print_history(args, "{timestamp} by {user}"):
+            verbose_print(args.verbose and not args.json, f'No previous versions found for section {args.section}.')
 
     elif args.command == 'add-labels':
         content = scraibe.load_document(args.filename)
@@ -171,6 +234,67 @@ def main():
         result = scraibe.save_document(args.filename, lbl1)
         verbose_print(args.verbose, f"Document {args.filename} labelled.")
 
+    elif args.command == 'blame':
+        try:
+            annotated = scraibe.blame(args.filename, args.section)
+        except (FileNotFoundError, ValueError) as e:
+            print(str(e))
+            sys.exit(1)
+        width = max([len(entry['user'] or '') for entry in annotated] + [8])
+        for entry in annotated:
+            print(f"{entry['timestamp'] or '-' * 14} {(entry['user'] or 'original').ljust(width)} | {entry['line']}")
+
+    elif args.command == 'show':
+        try:
+            if args.at:
+                content = scraibe.load_document_at(args.filename, args.at)
+            else:
+                content = scraibe.load_document(args.filename)
+        except (FileNotFoundError, ValueError) as e:
+            print(str(e))
+            sys.exit(1)
+        print(content if args.labels else scraibe.remove_section_markers(content))
+
+    elif args.command == 'gc':
+        report = scraibe.gc_versions(args.filename, dry_run=args.dry_run)
+        for document, stats in report['documents'].items():
+            verbose_print(args.verbose, f"{document}: {stats['deleted']} of {stats['examined']} versions, {stats['reclaimed_bytes']} bytes")
+        action = 'Would delete' if args.dry_run else 'Deleted'
+        print(f"{action} {report['deleted']} of {report['examined']} versions, {report['reclaimed_bytes']} bytes reclaimed.")
+        if not args.dry_run:
+            verbose_print(args.verbose, f"Removed {scraibe.purge_expired_drafts()} expired drafts.")
+
+    elif args.command == 'backup':
+        output = sys.stdout.buffer if args.output == '-' else args.output
+        manifest = scraibe.backup(output, incremental=args.incremental, since=args.since)
+        counts = manifest['counts']
+        print(f"Backup up to {manifest['watermark']}: {counts['documents']} documents, {counts['versions']} versions, "
+              f"{counts['locks']} locks, {counts['metadata']} metadata files.", file=sys.stderr if args.output == '-' else sys.stdout)
+
+    elif args.command == 'restore':
+        archive = sys.stdin.buffer if args.archive == '-' else args.archive
+        try:
+            report = scraibe.restore(archive, document=args.document, workers=args.workers)
+        except FileNotFoundError as e:
+            print(str(e))
+            sys.exit(1)
+        print(f"Restored {report['files']} files" + (f" of {args.document}." if args.document else "."))
+
+    elif args.command == 'lock-stats':
+        stats = scraibe.lock_stats(args.filename)
+        if args.json:
+            print(json.dumps(stats, indent=2))
+        elif not stats:
+            print('No lock statistics recorded yet.')
+        for document, counters in ({} if args.json else stats).items():
+            print(f"{document}: {counters['acquisitions']} acquisitions, {counters['conflicts']} conflicts, "
+                  f"{counters['wait_timeouts']} wait timeouts, {counters['reclaims']} reclaimed")
+            for name, label in [('wait_seconds', 'waits'), ('hold_seconds', 'holds')]:
+                histogram = counters[name]
+                if histogram['count']:
+                    print(f"  {label}: {histogram['count']}, mean {histogram['sum'] / histogram['count']:.2f}s, "
+                          f"p50 <= {histogram['p50']}s, p95 <= {histogram['p95']}s, max {histogram['max']:.2f}s")
+
     elif args.command == 'delete':
         scraibe.delete_document(args.filename)
         verbose_print(args.verbose, f'Document {args.filename} has been deleted.')
@@ -1,5 +1,16 @@
+from .yaml_store import *
 from .markdown_handler import *
 from .versioning import *
+from .drafts import *
+from .blame import *
+from .merge import *
+from .crdt import *
 from .locks import *
 from .formats import *
+from .registry import *
+from .users import *
+from .session_tokens import *
+from .backup import *
+from .llm_cache import *
+from .rate_limit import *
 from .llm import llm
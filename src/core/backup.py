@@ -0,0 +1,254 @@
+import os
+import io
+import json
+import time
+import sqlite3
+import tarfile
+import tempfile
+import datetime
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+
+from src.core.markdown_handler import DOCUMENT_PATH, validate_markdown_syntax
+from src.core.versioning import VERSION_DIR, VERSION_FILE_RE, flush_versions, last_edited_path
+from src.core.locks import LOCKS_DIR
+from src.core.registry import registry, DocumentRegistry, REGISTRY_DB
+from src.core.yaml_store import read_yaml, write_yaml, flush_yaml_stores
+
+# Metadata kept next to the data directories (see src/st_include)
+METADATA_FILES = ['documents.yaml', 'users.yaml', REGISTRY_DB]
+
+# Remembers the watermark of the last backup, for incremental backups (next to the data directories)
+BACKUP_STATE = '.backup_state.yaml'
+
+MANIFEST = 'manifest.json'
+
+def backup(out, incremental: bool = False, since: str = None) -> dict:
+    """Streams a snapshot of documents, versions, locks and metadata into a tar.gz.
+
+    `out` is a path or a binary file object (e.g. stdout). Documents are
+    read whole, and re-read if caught mid-write, before the versions: a save
+    writes its version before the document, so every archived document text
+    comes with its version. Versions are immutable and named by timestamp.
+    An incremental backup only carries the versions and documents changed
+    after the watermark of the previous backup (or `since`), taken when it
+    started; what was saved during that backup is carried again.
+
+    Writers are not stopped, so documents are each read at a different
+    moment; take backups while nobody saves for an exact copy. Incremental
+    archives only add files: documents and versions deleted since the
+    previous backup come back when the archives are restored on top of
+    each other.
+
+    Returns the manifest written as the first member of the archive.
+    """
+    if not flush_versions():
+        raise TimeoutError("Error: Queued versions are still being written, backup not started.")
+    flush_yaml_stores()
+    if incremental and not since:
+        since = _load_state().get('watermark')
+    watermark = (datetime.datetime.now() - datetime.timedelta(seconds=1)).strftime('%Y%m%d%H%M%S')
+    since_epoch = time.mktime(time.strptime(since, '%Y%m%d%H%M%S')) if since else None
+
+    documents = sorted(os.listdir(DOCUMENT_PATH)) if os.path.isdir(DOCUMENT_PATH) else []
+    manifest = {
+        'created_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'watermark': watermark,
+        'since': since,
+        'documents': documents,
+        'counts': {'documents': 0, 'versions': 0, 'locks': 0, 'metadata': 0},
+    }
+
+    # The manifest goes first, but its counts are only known at the end:
+    # they are written again as the last member.
+    tar = tarfile.open(fileobj=out, mode='w|gz') if hasattr(out, 'write') else tarfile.open(out, mode='w|gz')
+    with tar:
+        _add_bytes(tar, MANIFEST, json.dumps(manifest, indent=2).encode('utf-8'))
+
+        for filename in documents:
+            path = os.path.join(DOCUMENT_PATH, filename)
+            if since_epoch and os.path.getmtime(path) < since_epoch:
+                continue
+            _add_bytes(tar, path, _read_document_consistently(path))
+            manifest['counts']['documents'] += 1
+
+        if os.path.isdir(VERSION_DIR):
+            for filename in sorted(os.listdir(VERSION_DIR)):
+                versions_path = os.path.join(VERSION_DIR, filename)
+                if not os.path.isdir(versions_path):
+                    continue  # Write-behind journals, already flushed
+                with os.scandir(versions_path) as entries:
+                    for entry in entries:
+                        match = VERSION_FILE_RE.match(entry.name)
+                        if not match:
+                            continue
+                        if since and match.group('timestamp') <= since:
+                            continue
+                        tar.add(entry.path, recursive=False)
+                        manifest['counts']['versions'] += 1
+                if os.path.exists(last_edited_path(filename)):
+                    tar.add(last_edited_path(filename), recursive=False)
+
+        if os.path.isdir(LOCKS_DIR):
+            for dirpath, _, filenames in os.walk(LOCKS_DIR):
+                for name in filenames:
+                    tar.add(os.path.join(dirpath, name), recursive=False)
+                    manifest['counts']['locks'] += 1
+
+        for path in METADATA_FILES:
+            if os.path.exists(path):
+                if path == REGISTRY_DB:
+                    _add_bytes(tar, path, _snapshot_registry())
+                else:
+                    with open(path, 'rb') as f:
+                        _add_bytes(tar, path, f.read())
+                manifest['counts']['metadata'] += 1
+
+        _add_bytes(tar, MANIFEST, json.dumps(manifest, indent=2).encode('utf-8'))
+
+    _save_state({'watermark': watermark})
+    return manifest
+
+def restore(archive, document: str = None, workers: int = 8, root: str = '.') -> dict:
+    """Restores a backup made by backup(), writing files from a thread pool.
+
+    With `document`, only that document, its versions and locks are
+    restored, and its entry is merged back into documents.yaml. Restoring an
+    incremental archive on top of its full backup brings the tree up to date,
+    except for deletions (see backup()).
+    """
+    document = os.path.basename(document) if document else None
+    flush_yaml_stores()  # A pending save would overwrite the restored file
+    report = {'files': 0, 'skipped': 0, 'manifest': None}
+
+    tar = tarfile.open(fileobj=archive, mode='r|gz') if hasattr(archive, 'read') else tarfile.open(archive, mode='r|gz')
+    with tar, ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = []
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = os.path.normpath(member.name)
+            if name == MANIFEST:
+                report['manifest'] = json.load(tar.extractfile(member))
+                continue
+            if not _is_restorable(name, document):
+                report['skipped'] += 1
+                continue
+
+            data = tar.extractfile(member).read()
+            if document and name == 'documents.yaml':
+                in_flight.append(pool.submit(_merge_document_metadata, os.path.join(root, name), data, document))
+            elif name == REGISTRY_DB:
+                _restore_registry(os.path.join(root, name), data, document)
+            else:
+                in_flight.append(pool.submit(_write_file, os.path.join(root, name), data))
+            report['files'] += 1
+
+            # Keep memory bounded on archives with millions of entries
+            if len(in_flight) >= workers * 64:
+                for future in in_flight:
+                    future.result()
+                in_flight = []
+
+        for future in in_flight:
+            future.result()
+
+    return report
+
+def _is_restorable(name: str, document: str) -> bool:
+    parts = name.split(os.sep)
+    if os.path.isabs(name) or '..' in parts:
+        return False  # Never write outside the data directories
+    if len(parts) > 1 and parts[0] in (DOCUMENT_PATH, VERSION_DIR, LOCKS_DIR):
+        if document is None:
+            return True
+        return parts[1] == document
+    if name in METADATA_FILES:
+        return document is None or name in ('documents.yaml', REGISTRY_DB)
+    return False
+
+def _write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f'{path}.restore.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def _merge_document_metadata(path: str, data: bytes, document: str):
+    archived = (yaml.safe_load(data) or {}).get('documents', {})
+    if document not in archived:
+        return
+    current = {'documents': {}}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            current = yaml.safe_load(f) or {'documents': {}}
+    current.setdefault('documents', {})[document] = archived[document]
+    _write_file(path, yaml.dump(current).encode('utf-8'))
+
+def _snapshot_registry() -> bytes:
+    """A consistent copy of the registry database, taken with the SQLite backup API."""
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_path = os.path.join(tmp, REGISTRY_DB)
+        copy = sqlite3.connect(copy_path)
+        registry.connection().backup(copy)
+        copy.close()
+        with open(copy_path, 'rb') as f:
+            return f.read()
+
+def _restore_registry(path: str, data: bytes, document: str):
+    """Replaces the registry database, or with `document` copies only that document's rows into it.
+
+    The whole database is copied into the live one with the SQLite backup
+    API, so connections open in other threads and processes stay valid and
+    simply see the restored data.
+    """
+    target = registry if os.path.abspath(path) == os.path.abspath(registry.path) else DocumentRegistry(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        archived_path = os.path.join(tmp, REGISTRY_DB)
+        with open(archived_path, 'wb') as f:
+            f.write(data)
+        if document is None:
+            generation = target.generation()
+            archived = sqlite3.connect(archived_path)
+            archived.backup(target.connection())
+            archived.close()
+            meta = None
+        else:
+            archived = DocumentRegistry(archived_path, legacy_yaml=os.path.join(tmp, 'none.yaml'))
+            meta = archived.get_document(document)
+            archived.close()
+
+    if document is None:
+        # Past both the old and the restored generation: cached permissions and sessions are re-checked
+        with target.transaction() as db:
+            db.execute("UPDATE registry_meta SET value = MAX(CAST(value AS INTEGER), ?) WHERE key = 'generation'", (generation,))
+    elif meta:
+        target.put_documents({document: meta})
+    if target is not registry:
+        target.close()
+
+def _read_document_consistently(path: str, tries: int = 5) -> bytes:
+    """Reads a document, retrying while it looks half written."""
+    for _ in range(tries):
+        with open(path, 'rb') as f:
+            data = f.read()
+        valid, _ = validate_markdown_syntax(data.decode('utf-8', errors='replace'))
+        if valid:
+            break
+        time.sleep(0.1)
+    return data
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+def _load_state() -> dict:
+    try:
+        return read_yaml(BACKUP_STATE) or {}
+    except FileNotFoundError:
+        return {}
+
+def _save_state(state: dict):
+    write_yaml(BACKUP_STATE, state)
@@ -0,0 +1,65 @@
+import os
+import json
+import difflib
+from bisect import bisect_right
+
+import src.core as scraibe
+from src.core.versioning import VERSION_DIR, get_version_index, read_version
+
+BLAME_DIR = '.blame'
+
+def blame(filename: str, section_id: str) -> list:
+    """Attributes each line of a section to the version and user that introduced it.
+
+    Returns [{'line', 'timestamp', 'user'}, ...] for the current text of the
+    section. The text before the first save is not stored, so every line of
+    the first recorded version is credited to its author. Lines of the
+    current text that no recorded version contains (the document file was
+    edited by hand) have timestamp and user set to None.
+
+    The attribution of the latest processed version is cached next to the
+    versions, so a new save only costs the diff against the newest version.
+    """
+    filename = os.path.basename(filename)
+    state = _update_blame_state(filename, section_id)
+    current = scraibe.load_section(filename, section_id).strip().splitlines()
+    return _carry_attribution(state['lines'], current, None)
+
+def _update_blame_state(filename: str, section_id: str) -> dict:
+    """Loads the cached attribution and replays only the versions saved after it."""
+    section_versions = get_version_index(filename).get(section_id, [])
+    cache_file = os.path.join(VERSION_DIR, filename, BLAME_DIR, f'{section_id}.json')
+
+    state = {'last': None, 'lines': []}
+    if os.path.exists(cache_file):
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+
+    start = bisect_right(section_versions, tuple(state['last'])) if state['last'] else 0
+    if start == len(section_versions):
+        return state
+
+    lines = state['lines']
+    for timestamp, user in section_versions[start:]:
+        content = read_version(filename, section_id, timestamp, user)
+        lines = _carry_attribution(lines, content.strip().splitlines(), (timestamp, user))
+    state = {'last': list(section_versions[-1]), 'lines': lines}
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(temp_file, cache_file)
+    return state
+
+def _carry_attribution(previous: list, new_lines: list, author) -> list:
+    """Keeps the attribution of unchanged lines; changed ones go to `author` (timestamp, user)."""
+    timestamp, user = author if author else (None, None)
+    matcher = difflib.SequenceMatcher(None, [entry['line'] for entry in previous], new_lines, autojunk=False)
+    result = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            result.extend(dict(entry) for entry in previous[i1:i2])
+        else:
+            result.extend({'line': line, 'timestamp': timestamp, 'user': user} for line in new_lines[j1:j2])
+    return result
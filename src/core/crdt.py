@@ -0,0 +1,258 @@
+import difflib
+import threading
+
+import src.core as scraibe
+from src.core.versioning import content_hash
+
+# Elements per block of the sequence; blocks split in two when they grow past it
+BLOCK_SIZE = 512
+
+class _Element:
+    __slots__ = ('id', 'char', 'deleted', 'block')
+
+    def __init__(self, id, char, block=None):
+        self.id = id
+        self.char = char
+        self.deleted = False
+        self.block = block
+
+class _Block:
+    __slots__ = ('elements', 'visible')
+
+    def __init__(self, elements):
+        self.elements = elements
+        self.visible = sum(1 for element in elements if not element.deleted)
+        for element in elements:
+            element.block = self
+
+class RGAText:
+    """Replicated text of a section (RGA: replicated growable array).
+
+    Every character has a unique id (lamport counter, site) and remembers the
+    id of the character it was typed after. Replicas that applied the same
+    operations, in any order that keeps each insert after its origin, hold
+    the same text. Deleted characters stay as tombstones.
+
+    The sequence is kept in blocks of at most BLOCK_SIZE characters with an
+    id -> character index, so applying an operation costs a scan of a couple
+    of blocks instead of the whole section.
+
+    A replica may be edited from one thread while the relay applies other
+    replicas' operations from another: every change holds the replica's
+    lock, and operations are published after releasing it.
+
+    Operations are dicts:
+      {'type': 'insert', 'id': (counter, site), 'origin': id or None, 'char': str}
+      {'type': 'delete', 'id': (counter, site)}
+    """
+
+    def __init__(self, site: str, text: str = ""):
+        self.site = site
+        self.relay = None
+        # Replicas seeded with the same text give its characters the same ids
+        elements = [_Element((i + 1, ''), char) for i, char in enumerate(text)]
+        half = BLOCK_SIZE // 2
+        self._blocks = [_Block(elements[i:i + half]) for i in range(0, len(elements), half)] or [_Block([])]
+        self._index = {element.id: element for element in elements}
+        self._clock = len(text)
+        self._pending = []  # Remote operations waiting for their origin
+        self._lock = threading.RLock()
+
+    def text(self) -> str:
+        with self._lock:
+            return ''.join(element.char for block in self._blocks for element in block.elements if not element.deleted)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(block.visible for block in self._blocks)
+
+    def insert(self, index: int, text: str) -> list:
+        """Inserts `text` before the visible character at `index`. Returns the operations."""
+        with self._lock:
+            origin = self._visible_element(index - 1).id if index > 0 else None
+            ops = []
+            for char in text:
+                self._clock += 1
+                op = {'type': 'insert', 'id': (self._clock, self.site), 'origin': origin, 'char': char}
+                self._integrate(op['id'], origin, char)
+                ops.append(op)
+                origin = op['id']
+        self._publish(ops)
+        return ops
+
+    def delete(self, index: int, length: int = 1) -> list:
+        """Deletes `length` visible characters from `index`. Returns the operations."""
+        with self._lock:
+            ops = [{'type': 'delete', 'id': element.id} for element in self._visible_elements(index, length)]
+            for op in ops:
+                self._remove(op['id'])
+        self._publish(ops)
+        return ops
+
+    def apply(self, op: dict) -> bool:
+        """Applies a remote operation. Returns False if it had to wait for a missing origin."""
+        with self._lock:
+            applied = self._apply(op)
+            if not applied:
+                self._pending.append(op)
+            elif self._pending:
+                self._retry_pending()
+            return applied
+
+    def _apply(self, op: dict) -> bool:
+        id = tuple(op['id'])
+        if op['type'] == 'delete':
+            if id not in self._index:
+                return False
+            self._remove(id)
+            return True
+        if id in self._index:
+            return True  # Already applied
+        origin = tuple(op['origin']) if op['origin'] else None
+        if origin and origin not in self._index:
+            return False
+        self._clock = max(self._clock, id[0])
+        self._integrate(id, origin, op['char'])
+        return True
+
+    def _retry_pending(self):
+        progress = True
+        while progress and self._pending:
+            progress = False
+            for op in list(self._pending):
+                if self._apply(op):
+                    self._pending.remove(op)
+                    progress = True
+
+    def _integrate(self, id, origin, char):
+        if origin is None:
+            block_index, position = 0, 0
+        else:
+            element = self._index[origin]
+            block_index = self._blocks.index(element.block)
+            position = element.block.elements.index(element) + 1
+
+        # Skip the characters inserted after the same origin by later operations
+        while True:
+            block = self._blocks[block_index]
+            if position == len(block.elements):
+                if block_index + 1 == len(self._blocks):
+                    break
+                block_index, position = block_index + 1, 0
+                continue
+            if block.elements[position].id > id:
+                position += 1
+            else:
+                break
+
+        block = self._blocks[block_index]
+        element = _Element(id, char, block)
+        block.elements.insert(position, element)
+        block.visible += 1
+        self._index[id] = element
+        if len(block.elements) > BLOCK_SIZE:
+            half = len(block.elements) // 2
+            tail = _Block(block.elements[half:])
+            del block.elements[half:]
+            block.visible -= tail.visible
+            self._blocks.insert(block_index + 1, tail)
+
+    def _remove(self, id):
+        element = self._index[id]
+        if not element.deleted:
+            element.deleted = True
+            element.block.visible -= 1
+
+    def _visible_element(self, index: int) -> _Element:
+        elements = self._visible_elements(index, 1)
+        if not elements:
+            raise IndexError(f'Position {index} is outside the text')
+        return elements[0]
+
+    def _visible_elements(self, index: int, length: int) -> list:
+        result = []
+        for block in self._blocks:
+            if index >= block.visible:
+                index -= block.visible
+                continue
+            for element in block.elements:
+                if element.deleted:
+                    continue
+                if index > 0:
+                    index -= 1
+                    continue
+                result.append(element)
+                if len(result) == length:
+                    return result
+        return result
+
+    def _publish(self, ops: list):
+        if self.relay and ops:
+            self.relay.publish(self, ops)
+
+class LocalRelay:
+    """In-process relay for co-editing one section: every replica's operations reach the others.
+
+    save() persists the converged text as a normal version with an
+    optimistic save_section, so edits saved outside the session meanwhile
+    are merged in, and fed back to the replicas.
+
+    Replicas may publish from several threads: the relay's lock keeps the
+    log, the delivery and the replica list consistent, and holds back
+    publishing while save() reconciles the text.
+    """
+
+    def __init__(self, filename: str = None, section_id: str = None):
+        self.filename = filename
+        self.section_id = section_id
+        text = scraibe.load_section(filename, section_id) if filename else ""
+        self.base_hash = content_hash(text)
+        self.replicas = []
+        self.log = []  # Every operation, for replicas joining late
+        self._base_text = text
+        self._lock = threading.RLock()
+        self._own = self.join('relay')
+
+    def join(self, site: str) -> RGAText:
+        replica = RGAText(site, self._base_text)
+        with self._lock:
+            for op in self.log:
+                replica.apply(op)
+            replica.relay = self
+            self.replicas.append(replica)
+        return replica
+
+    def leave(self, replica: RGAText):
+        with self._lock:
+            self.replicas.remove(replica)
+            replica.relay = None
+
+    def publish(self, sender: RGAText, ops: list):
+        with self._lock:
+            self.log.extend(ops)
+            for replica in self.replicas:
+                if replica is not sender:
+                    for op in ops:
+                        replica.apply(op)
+
+    def text(self) -> str:
+        return self._own.text()
+
+    def save(self, user: str, coalesce: bool = True) -> str:
+        """Saves the current text as a version of the section by `user`."""
+        with self._lock:
+            text = self.text()
+            version = scraibe.save_section(self.filename, self.section_id, user, text, coalesce=coalesce, base_hash=self.base_hash)
+            saved = scraibe.load_section(self.filename, self.section_id)
+            if saved.strip() != text.strip():
+                self._replace_text(text, saved)  # Bring in what was merged from outside
+            self.base_hash = content_hash(saved)
+            return version
+
+    def _replace_text(self, old: str, new: str):
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag in ('replace', 'delete'):
+                self._own.delete(i1, i2 - i1)
+            if tag in ('replace', 'insert'):
+                self._own.insert(i1, new[j1:j2])
@@ -0,0 +1,84 @@
+import os
+import yaml
+import datetime
+
+from settings import settings
+from src.core.yaml_store import read_yaml, write_yaml
+
+DRAFTS_DIR = 'drafts'
+
+def draft_path(filename: str, section_id: str, user: str) -> str:
+    """Path of the single draft slot of a user for a section."""
+    filename = os.path.basename(filename)
+    return f'{DRAFTS_DIR}/{filename}/{filename}.section_{section_id}.{user}.draft'
+
+def save_draft(filename: str, section_id: str, user: str, content: str, base_hash: str = None, base_text: str = None) -> bool:
+    """Overwrites the user's draft of a section. Drafts are not versions.
+
+    `base_hash` is the hash of the section text the draft started from, so a
+    restored draft can tell whether the section changed meanwhile; with
+    `base_text`, that text itself, it can still be merged when its version
+    is gone. Returns False when the stored draft already has this content.
+    """
+    path = draft_path(filename, section_id, user)
+    previous = _read_draft(path)
+    if previous and previous['content'] == content:
+        return False
+
+    draft = {
+        'content': content,
+        'base_hash': base_hash,
+        'base_text': base_text,
+        'saved_at': datetime.datetime.now().strftime('%Y%m%d%H%M%S'),
+    }
+    write_yaml(path, draft)
+    return True
+
+def load_draft(filename: str, section_id: str, user: str, ttl_hours: int = None):
+    """Returns the draft {'content', 'base_hash', 'base_text', 'saved_at'} or None if missing or expired."""
+    path = draft_path(filename, section_id, user)
+    draft = _read_draft(path)
+    if draft and _is_expired(draft, ttl_hours):
+        discard_draft(filename, section_id, user)
+        return None
+    return draft
+
+def discard_draft(filename: str, section_id: str, user: str) -> bool:
+    """Removes the draft, e.g. once it was saved as a version or the edit was cancelled."""
+    try:
+        os.remove(draft_path(filename, section_id, user))
+        return True
+    except FileNotFoundError:
+        return False
+
+def purge_expired_drafts(ttl_hours: int = None) -> int:
+    """Deletes every draft older than the TTL. Returns how many were removed."""
+    removed = 0
+    if not os.path.isdir(DRAFTS_DIR):
+        return removed
+    for dirpath, _, filenames in os.walk(DRAFTS_DIR):
+        for name in filenames:
+            if not name.endswith('.draft'):
+                continue
+            path = os.path.join(dirpath, name)
+            draft = _read_draft(path)
+            if draft is None or _is_expired(draft, ttl_hours):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+    return removed
+
+def _read_draft(path: str):
+    try:
+        return read_yaml(path)
+    except FileNotFoundError:
+        return None
+    except yaml.YAMLError:
+        return None
+
+def _is_expired(draft: dict, ttl_hours: int = None) -> bool:
+    ttl_hours = settings.draft_ttl_hours if ttl_hours is None else ttl_hours
+    saved_at = datetime.datetime.strptime(str(draft.get('saved_at', '19700101000000')), '%Y%m%d%H%M%S')
+    return datetime.datetime.now() - saved_at > datetime.timedelta(hours=ttl_hours)
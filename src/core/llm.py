@@ -10,10 +10,14 @@ All inputs are assumed to be in markdown format.
 import re
 import os
 import json
+import asyncio
+import threading
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI, AzureChatOpenAI
 from settings import settings
+from src.core.llm_cache import llm_cache, llm_cache_key
+from src.core.rate_limit import rate_limiter
 
 # Initialize the appropriate LLM based on configuration
 # https://python.langchain.com/docs/introduction/
@@ -40,6 +44,23 @@ import json
 import re
 
 
+_loop = None
+_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """The event loop of every analyse_sections() call, run forever by a daemon thread.
+
+    The provider's async client keeps its connection pool bound to the loop
+    it first ran on, so the sections are never run on a fresh loop.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="scraibe-llm-loop", daemon=True).start()
+        return _loop
+
+
 def recover_json(input_string):
     # Attempt to extract JSON content (either array or object)
     match = re.search(r'(\[.*\]|\{.*\})', input_string, re.DOTALL)
@@ -53,7 +74,61 @@ def recover_json(input_string):
     return None  # No valid JSON found
 
 
+# Prompts of the section tools, also run for many sections at once by analyse_sections()
+ANALYSE_SECTION_PROMPT = PromptTemplate(
+    input_variables=["document", "section", "lang", "role", "purpose"],
+    template="""
+You are a smart reviewer with a deep understanding of the document's purpose and structure. Also you were designated with the role of "{role}" in the review of this document, written in "{lang}". The document has the declared purpose of "{purpose}".
+
+For section written below, you will evaluate the following criteria:
+
+- **Extension**: Is the section comparable in length to other sections?
+- **Clarity**: Is the section clear and easy to understand?
+- **Consistency**: Is the section consistent with the rest of the document?
+- **Correctness**: Is the section correct and free of errors, does it has all the needed information expected for this kind of document?
+- **Style and tone**: Is the section in the correct style and tone for the document?
+
+For each criteria, if it is ok just write "Ok", otherwise provide a one line with problems or improvements needed.
+
+==== Document ====
+{document}
+==== EOF Document ====
+
+==== Section to analyze ====
+{section}
+==== EOF Section ====
+
+The evaluation is:
+"""
+)
+
+SUGGEST_SECTION_PROMPT = PromptTemplate(
+    input_variables=["document", "section", "lang", "role", "purpose"],
+    template="""
+Your role in the review of this document is: {role} in native {lang} language.
+Document purpose: {purpose}
+
+You will be provided with a specific section to rewrite in the context of a whole document in process of creation. For this,
 
+1. Asses the content of the section in extension, tone, and style.
+2. Rewrite the content of the section to match the style of the whole document, infer from the whole document if needed.
+3. Add new content if needed to improve the section. If you don't have the information, insert [placeholders] to guide the author.
+4. Keep the same style and tone in the corrections, ignore literals in case of programming examples.
+5. Do not add new sections, just improve the content of the section.
+
+==== Document ====
+{document}
+==== EOF Document ====
+
+==== Section to rewrite ====
+{section}
+==== EOF Section ====
+
+The suggested new section content is:
+"""
+)
+
+SECTION_PROMPTS = {'analyse': ANALYSE_SECTION_PROMPT, 'suggest': SUGGEST_SECTION_PROMPT}
 
 
 class LLMDocumentAgent:
@@ -82,6 +157,33 @@ class LLMDocumentAgent:
 
 
 
+    def _run(self, prompt_template: PromptTemplate, refresh: bool = False, **inputs) -> str:
+        """Runs the prompt through the LLM, answered from llm_cache when the same prompt was sent before.
+
+        `refresh` asks the LLM again even if a response is cached, for explicit re-runs.
+        """
+        chain = LLMChain(llm=self.llm, prompt=prompt_template)
+        def call():
+            rate_limiter(settings.llm_provider).wait()
+            return chain.run(**inputs)
+        return llm_cache.get_or_call(self._cache_key(prompt_template, inputs), call, refresh=refresh)
+
+    async def _arun(self, prompt_template: PromptTemplate, **inputs) -> str:
+        """_run() with the provider's async API (ainvoke), for many prompts at once."""
+        chain = LLMChain(llm=self.llm, prompt=prompt_template)
+        async def call():
+            await rate_limiter(settings.llm_provider).acquire()
+            return (await chain.ainvoke(inputs))[chain.output_key]
+        return await llm_cache.aget_or_call(self._cache_key(prompt_template, inputs), call)
+
+    def _cache_key(self, prompt_template: PromptTemplate, inputs: dict) -> str:
+        llm = self.llm
+        model = getattr(llm, 'model_name', None) or getattr(llm, 'deployment_name', None) or type(llm).__name__
+        return llm_cache_key(settings.llm_provider, model, getattr(llm, 'temperature', None), prompt_template.format(**inputs))
+
+    def _section_inputs(self, document: str, section: str) -> dict:
+        return {'document': document, 'section': section, 'lang': self.lang, 'role': self.role, 'purpose': self.purpose}
+
     def remember(self, AI_task: str, section_id: str, document_filename: str, text: str = False):
         """
         Remember the AI task for a specific section of the document.
@@ -116,76 +218,69 @@ Perform an overall analysis of the following markdown document:
             input_variables=["document"],
             template=prompt
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
-        result = chain.run(document=markdown_text)
+        result = self._run(prompt_template, document=markdown_text)
         return result
 
 
 
-    def analyse_section_in_context(self, document: str, section: str) -> str:
+    def analyse_section_in_context(self, document: str, section: str, refresh: bool = False) -> str:
         # Analyze the section in the context of the whole document
-        prompt = """
-You are a smart reviewer with a deep understanding of the document's purpose and structure. Also you were designated with the role of "{role}" in the review of this document, written in "{lang}". The document has the declared purpose of "{purpose}".
+        return self._run(SECTION_PROMPTS['analyse'], refresh=refresh, **self._section_inputs(document, section))
 
-For section written below, you will evaluate the following criteria:
 
-- **Extension**: Is the section comparable in length to other sections?
-- **Clarity**: Is the section clear and easy to understand?
-- **Consistency**: Is the section consistent with the rest of the document?
-- **Correctness**: Is the section correct and free of errors, does it has all the needed information expected for this kind of document?
-- **Style and tone**: Is the section in the correct style and tone for the document?
+    def suggest_section_content(self, document: str, section: str, refresh: bool = False) -> str:
+        return self._run(SECTION_PROMPTS['suggest'], refresh=refresh, **self._section_inputs(document, section))
 
-For each criteria, if it is ok just write "Ok", otherwise provide a one line with problems or improvements needed.
 
-==== Document ====
-{document}
-==== EOF Document ====
-
-==== Section to analyze ====
-{section}
-==== EOF Section ====
+    async def aanalyse_sections(self, document: str, sections: dict, task: str = 'analyse', concurrency: int = None):
+        """
+        Runs a section tool ('analyse' or 'suggest') on many sections concurrently.
 
-The evaluation is:
-"""
-        prompt_template = PromptTemplate(
-            input_variables=["document", "section", "lang", "role", "purpose"],
-            template=prompt
-        )
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
-        result = chain.run(document=document, section=section, lang=self.lang, role=self.role, purpose=self.purpose)
-        return result
+        :param sections: {section_id: section content}.
+        :param concurrency: Requests in flight at once, settings.llm_concurrency by default.
+        :return: Async generator of (section_id, result) in completion order; result is the exception if the call failed.
+        """
+        prompt_template = SECTION_PROMPTS[task]
+        semaphore = asyncio.Semaphore(concurrency or settings.llm_concurrency)
 
+        async def run(section_id, section):
+            async with semaphore:
+                try:
+                    return section_id, await self._arun(prompt_template, **self._section_inputs(document, section))
+                except Exception as e:
+                    return section_id, e
 
-    def suggest_section_content(self, document: str, section: str) -> str:
-        prompt = """
-Your role in the review of this document is: {role} in native {lang} language.
-Document purpose: {purpose}
-
-You will be provided with a specific section to rewrite in the context of a whole document in process of creation. For this,
+        tasks = [asyncio.ensure_future(run(section_id, section)) for section_id, section in sections.items()]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for pending in tasks:
+                pending.cancel()  # The caller stopped early
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-1. Asses the content of the section in extension, tone, and style.
-2. Rewrite the content of the section to match the style of the whole document, infer from the whole document if needed.
-3. Add new content if needed to improve the section. If you don't have the information, insert [placeholders] to guide the author.
-4. Keep the same style and tone in the corrections, ignore literals in case of programming examples.
-5. Do not add new sections, just improve the content of the section.
 
-==== Document ====
-{document}
-==== EOF Document ====
+    def analyse_sections(self, document: str, sections: dict, task: str = 'analyse', concurrency: int = None):
+        """
+        aanalyse_sections() for synchronous callers such as Streamlit: a generator of
+        (section_id, result) as each section completes.
+        """
+        loop = _background_loop()
+        results = self.aanalyse_sections(document, sections, task, concurrency)
 
-==== Section to rewrite ====
-{section}
-==== EOF Section ====
+        def run(awaitable):
+            async def wrapper():
+                return await awaitable
+            return asyncio.run_coroutine_threadsafe(wrapper(), loop).result()
 
-The suggested new section content is:
-"""
-        prompt_template = PromptTemplate(
-            input_variables=["document", "section", "lang", "role", "purpose"],
-            template=prompt
-        )
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
-        result = chain.run(document=document, section=section, lang=self.lang, role=self.role, purpose=self.purpose)
-        return result
+        try:
+            while True:
+                try:
+                    yield run(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            run(results.aclose())
     
     
 
@@ -225,9 +320,8 @@ The generated JSON is:
             input_variables=["role", "purpose", "lang", "content"],
             template=prompt
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
         # result = chain.run(section=section_text)
-        result = chain.run(role=self.role, purpose=self.purpose, lang=self.lang, content=content)
+        result = self._run(prompt_template, role=self.role, purpose=self.purpose, lang=self.lang, content=content)
         return recover_json(result)
         
 
@@ -279,8 +373,7 @@ The generated JSON is:
             input_variables=["role", "purpose", "lang", "content"],
             template=prompt
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
-        result = chain.run(role=self.role, purpose=self.purpose, lang=self.lang, content=document_content)
+        result = self._run(prompt_template, role=self.role, purpose=self.purpose, lang=self.lang, content=document_content)
         return recover_json(result)    
         # return result
     
@@ -295,8 +388,7 @@ You are asked to create the barebones of a markdown document with title: "{title
             input_variables=["role", "purpose", "title", "lang"],
             template=prompt
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
-        result = chain.run(role=self.role, purpose=self.purpose, title=title, lang=self.lang)
+        result = self._run(prompt_template, role=self.role, purpose=self.purpose, title=title, lang=self.lang)
         print(result)
         return result
     
@@ -316,8 +408,7 @@ This markdown is a poorly translated PDF. Your mission is to do your best to tra
             input_variables=["role", "purpose", "lang", "pdf_content"],
             template=prompt
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
-        result = chain.run(role=self.role, purpose=self.purpose, lang=self.lang, pdf_content=pdf_content)
+        result = self._run(prompt_template, role=self.role, purpose=self.purpose, lang=self.lang, pdf_content=pdf_content)
         return result
     
 llm = LLMDocumentAgent(
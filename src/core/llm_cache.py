@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+
+from settings import settings
+
+# Responses of the LLM provider, kept apart from the registry: it is disposable
+LLM_CACHE_DB = 'llm_cache.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+-- Least recently used first, for eviction
+CREATE INDEX IF NOT EXISTS responses_by_use ON responses (used_at);
+"""
+
+def llm_cache_key(provider: str, model: str, temperature, prompt: str) -> str:
+    """Key of a response: the provider, model and temperature, and the hash of the rendered prompt."""
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return hashlib.sha256(json.dumps([provider, model, temperature, prompt_hash]).encode('utf-8')).hexdigest()
+
+class LLMCache:
+    """LLM responses on disk, expiring after `ttl_hours` and evicted least recently used past `max_entries`.
+
+    get_or_call() also coalesces identical requests in flight: while one
+    session waits for the provider, the others wait for the same answer
+    instead of sending the prompt again. aget_or_call() is the same for
+    coroutines and shares the requests in flight with the threads. The
+    `stats` counters are updated under the lock.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_DB, ttl_hours: float = None, max_entries: int = None):
+        self.path = path
+        self.ttl_hours = ttl_hours
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> Future of the response
+
+    def connection(self) -> sqlite3.Connection:
+        path = os.path.abspath(self.path)
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        db = connections.get(path)
+        if db is None:
+            db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            connections[path] = db
+        return db
+
+    def enabled(self) -> bool:
+        return self._ttl_seconds() > 0 and self._max_entries() > 0
+
+    def get(self, key: str):
+        """The cached response, or None if missing or expired."""
+        db = self.connection()
+        now = time.time()
+        row = db.execute("SELECT response FROM responses WHERE key = ? AND created_at > ?",
+                         (key, now - self._ttl_seconds())).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, response: str):
+        db = self.connection()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO responses (key, response, created_at, used_at) VALUES (?, ?, ?, ?)",
+                       (key, response, now, now))
+            db.execute("DELETE FROM responses WHERE created_at <= ?", (now - self._ttl_seconds(),))
+            excess = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self._max_entries()
+            if excess > 0:
+                db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used_at LIMIT ?)", (excess,))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def get_or_call(self, key: str, call, refresh: bool = False):
+        """The cached response for `key`, or the one of call(), shared with identical calls in flight.
+
+        With `refresh` (an explicit re-run) the cached response is ignored and
+        replaced by the new one; calls already in flight are still shared.
+        """
+        if not self.enabled():
+            return call()
+        state, value = self._lookup(key, refresh)
+        if state == 'hit':
+            return value
+        if state == 'wait':
+            return value.result()
+        try:
+            response = call()
+        except BaseException as e:
+            self._fail(key, value, e)
+            raise
+        return self._succeed(key, value, response)
+
+    async def aget_or_call(self, key: str, acall, refresh: bool = False):
+        """get_or_call() for a coroutine function `acall`, awaiting identical calls in flight instead of blocking."""
+        if not self.enabled():
+            return await acall()
+        state, value = self._lookup(key, refresh)
+        if state == 'hit':
+            return value
+        if state == 'wait':
+            return await asyncio.wrap_future(value)
+        try:
+            response = await acall()
+        except BaseException as e:
+            self._fail(key, value, e)
+            raise
+        return self._succeed(key, value, response)
+
+    def _lookup(self, key: str, refresh: bool) -> tuple:
+        """('hit', response), ('wait', future of the call in flight) or ('call', future to settle)."""
+        if not refresh:
+            response = self.get(key)
+            if response is not None:
+                with self._lock:
+                    self.stats['hits'] += 1
+                return 'hit', response
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return 'wait', future
+            if not refresh:
+                # Answered and stored by a call that ended since the lookup above
+                response = self.get(key)
+                if response is not None:
+                    self.stats['hits'] += 1
+                    return 'hit', response
+            future = self._in_flight[key] = Future()
+            self.stats['misses'] += 1
+            return 'call', future
+
+    def _succeed(self, key: str, future: Future, response):
+        # Stored before leaving the in-flight map, so later lookups find it in one place or the other
+        try:
+            if isinstance(response, str):
+                self.put(key, response)
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        with self._lock:
+            self._in_flight.pop(key, None)
+        future.set_result(response)
+        return response
+
+    def _fail(self, key: str, future: Future, error: BaseException):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        future.set_exception(error)
+
+    def clear(self):
+        self.connection().execute("DELETE FROM responses")
+
+    def _ttl_seconds(self) -> float:
+        return (settings.llm_cache_ttl_hours if self.ttl_hours is None else self.ttl_hours) * 3600
+
+    def _max_entries(self) -> int:
+        return settings.llm_cache_max_entries if self.max_entries is None else self.max_entries
+
+llm_cache = LLMCache()
@@ -1,73 +1,490 @@
-
 import os
-import yaml
+import json
+import atexit
 import datetime
+import time
+import threading
+from contextlib import contextmanager
+
+from src.core.yaml_store import read_yaml, write_yaml
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process exclusion
+    fcntl = None
+
+from settings import settings
 
 LOCKS_DIR = 'locks'
 
-def lock_section(filename: str, section_id: str, user: str) -> bool:
-    """Locks a section for editing by a user."""
-    
-    filename = os.path.basename(filename)
-    os.makedirs(f"{LOCKS_DIR}/{filename}", exist_ok=True)
-    lock_file = f'{LOCKS_DIR}/{filename}/{filename}.section_{section_id}.lock'
-
-    if os.path.exists(lock_file):
-        with open(lock_file, 'r', encoding='utf-8') as f:
-            lock_data = yaml.safe_load(f)
-            if lock_data['user'] != user:
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Releases from other processes (the CLI) cannot signal the condition of this
+# one: waiters also re-check the lock directory this often.
+CROSS_PROCESS_POLL = 0.25
+
+# Lookups trust the in-process lock table this long before reading the
+# generation written by other processes; this process' own writes update it at once
+LOCK_TABLE_RECHECK = 0.25
+
+# Upper bounds (seconds) of the wait and hold time histogram buckets, plus one overflow bucket
+HISTOGRAM_BUCKETS = [0.01, 0.1, 0.5, 1, 5, 30, 60, 300, 900, 3600]
+
+class LockStats:
+    """Lock contention metrics per document: counters and duration histograms.
+
+    Events are counted in memory and merged by flush() into
+    `locks/<doc>.stats.json`, so the totals add up across processes (the app
+    and the CLI) and survive restarts. The file sits next to the lock
+    directory, not in it: writing it must not look like a lock table change.
+    """
+
+    COUNTERS = ['acquisitions', 'conflicts', 'reclaims', 'wait_timeouts']
+    HISTOGRAMS = ['wait_seconds', 'hold_seconds']
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._pending = {}  # filename -> stats not yet flushed
+        self._lock = threading.Lock()
+
+    def count(self, filename: str, name: str, n: int = 1):
+        with self._lock:
+            self._entry(self._pending, filename)[name] += n
+
+    def observe(self, filename: str, name: str, seconds: float):
+        with self._lock:
+            _add_to_histogram(self._entry(self._pending, filename)[name], seconds)
+
+    def flush(self):
+        """Adds the pending events to the stats files. Writes nothing if no event was recorded."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for lock_dir, delta in pending.items():
+            path = f'{lock_dir}.stats.json'
+            with self.manager._exclusive(lock_dir):
+                totals = _read_json(path) or self._empty()
+                for name in self.COUNTERS:
+                    totals[name] += delta[name]
+                for name in self.HISTOGRAMS:
+                    _merge_histogram(totals[name], delta[name])
+                temp_path = f'{path}.{os.getpid()}.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(totals, f)
+                os.replace(temp_path, path)
+
+    def snapshot(self, filename: str = None) -> dict:
+        """{document: stats} for one document or all of them, including this process' pending events."""
+        self.flush()
+        root = self.manager.root
+        if filename:
+            documents = [os.path.basename(filename)]
+        else:
+            documents = sorted(name[:-len('.stats.json')] for name in os.listdir(root) if name.endswith('.stats.json')) if os.path.isdir(root) else []
+        snapshot = {}
+        for document in documents:
+            stats = _read_json(self._stats_file(document))
+            if stats:
+                for name in self.HISTOGRAMS:
+                    stats[name]['p50'] = _histogram_percentile(stats[name], 0.5)
+                    stats[name]['p95'] = _histogram_percentile(stats[name], 0.95)
+                snapshot[document] = stats
+        return snapshot
+
+    def _entry(self, stats: dict, filename: str) -> dict:
+        # Keyed by the absolute lock directory, the working directory may change before a flush
+        return stats.setdefault(self.manager._lock_dir(filename), self._empty())
+
+    def _empty(self) -> dict:
+        stats = {name: 0 for name in self.COUNTERS}
+        for name in self.HISTOGRAMS:
+            stats[name] = {'buckets': HISTOGRAM_BUCKETS, 'counts': [0] * (len(HISTOGRAM_BUCKETS) + 1), 'count': 0, 'sum': 0.0, 'max': 0.0}
+        return stats
+
+    def _stats_file(self, filename: str) -> str:
+        return f'{self.manager._lock_dir(filename)}.stats.json'
+
+def _add_to_histogram(histogram: dict, value: float):
+    index = next((i for i, bound in enumerate(histogram['buckets']) if value <= bound), len(histogram['buckets']))
+    histogram['counts'][index] += 1
+    histogram['count'] += 1
+    histogram['sum'] += value
+    histogram['max'] = max(histogram['max'], value)
+
+def _merge_histogram(total: dict, delta: dict):
+    total['counts'] = [a + b for a, b in zip(total['counts'], delta['counts'])]
+    total['count'] += delta['count']
+    total['sum'] += delta['sum']
+    total['max'] = max(total['max'], delta['max'])
+
+def _histogram_percentile(histogram: dict, q: float):
+    """Upper bound of the bucket holding the q-th quantile (the max for the overflow bucket)."""
+    if not histogram['count']:
+        return None
+    seen = 0
+    for index, count in enumerate(histogram['counts']):
+        seen += count
+        if seen >= q * histogram['count']:
+            return histogram['buckets'][index] if index < len(histogram['buckets']) else histogram['max']
+    return histogram['max']
+
+def _read_json(path: str):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+class LockManager:
+    """Section locks as leases: an owner and an expiry, extended by heartbeats.
+
+    The leases of a document are one small table, `locks/<doc>/<doc>.locks.yaml`
+    ({section_id: lease}), kept in memory and written whole with a rename
+    while holding an exclusive flock on the lock directory. Every write also
+    replaces `<doc>.generation` with a new random token, under the same
+    flock. Lookups answer from memory: this process' writes update the table
+    directly, and every LOCK_TABLE_RECHECK seconds the generation is read to
+    notice writes of other processes (the CLI). Acquiring and releasing
+    always re-read the table under the flock, so a stale lookup never grants
+    a lease.
+
+    An expired lease is as good as released: a crashed tab or a closed
+    session no longer keeps a section locked forever.
+    """
+
+    def __init__(self, root: str = LOCKS_DIR, ttl: int = None):
+        self.root = root
+        self.ttl = ttl
+        self._tables = {}  # lock directory -> (generation, checked at, {section_id: lease})
+        self._lock = threading.RLock()
+        self._released = threading.Condition(self._lock)
+        self.stats = LockStats(self)
+
+    def acquire(self, filename: str, section_id: str, user: str, ttl: int = None, session_id: str = None) -> bool:
+        """Takes the lease of a section, or renews it if `user` already holds it.
+
+        `session_id` ties the lease to a UI session, so the sweeper can
+        release it when the session ends.
+        """
+        def take(table):
+            lease = self._live(table.get(section_id))
+            if lease and lease['user'] != user:
+                self.stats.count(filename, 'conflicts')
                 return False  # Section already locked by another user
+            now = datetime.datetime.now()
+            if not lease:
+                self.stats.count(filename, 'acquisitions')
+            table[section_id] = {
+                'section': section_id,
+                'user': user,
+                'locked_at': lease['locked_at'] if lease else now.strftime(TIME_FORMAT),
+                'renewed_at': now.strftime(TIME_FORMAT),
+                'expires_at': self._expiry(now, ttl),
+                'session_id': session_id or (lease.get('session_id') if lease else None),
+            }
+            return True
+        return self._modify(filename, take)
+
+    def renew(self, filename: str, section_id: str, user: str, ttl: int = None, session_id: str = None) -> bool:
+        """Heartbeat: extends the lease if `user` still holds it."""
+        with self._lock:
+            lease = self.lease(filename, section_id)
+            if not lease or lease['user'] != user:
+                return False
+            return self.acquire(filename, section_id, user, ttl, session_id)
+
+    def release(self, filename: str, section_id: str, user: str) -> bool:
+        """Drops the lease if `user` holds it."""
+        def drop(table):
+            lease = self._live(table.get(section_id))
+            if not lease or lease['user'] != user:
+                return False  # No lock found, or only the locking user can unlock
+            del table[section_id]
+            self.stats.observe(filename, 'hold_seconds', _seconds_since(lease['locked_at']))
+            return True
+        with self._lock:
+            released = self._modify(filename, drop)
+            if released:
+                self._released.notify_all()
+            return released
+
+    def wait(self, filename: str, section_id: str, user: str, timeout: float = None):
+        """Blocks until no other user holds the section, at most `timeout` seconds.
+
+        Waiters wake as soon as the lock is released in this process, when
+        the lease expires, or on the next check for releases made by other
+        processes. Nothing is granted: every waiter sees the section free at
+        once, and whoever acquires it first gets it. Returns False once the
+        section is free (or held by `user`), otherwise the user still holding
+        it when the timeout ran out.
+        """
+        timeout = settings.lock_wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        started = time.monotonic()
+        waited = timed_out = False
+        with self._lock:
+            try:
+                while True:
+                    lease = self.lease(filename, section_id)
+                    if not lease or lease['user'] == user:
+                        return False  # Free, or held by `user`: nothing to wait for
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        timed_out = True
+                        return lease['user']
+                    waited = True
+                    expires_in = (datetime.datetime.strptime(lease['expires_at'], TIME_FORMAT) - datetime.datetime.now()).total_seconds()
+                    wake_in = min(remaining, CROSS_PROCESS_POLL, max(expires_in, 0.01))
+                    self._released.wait(wake_in)
+            finally:
+                if waited:
+                    self.stats.observe(filename, 'wait_seconds', time.monotonic() - started)
+                if timed_out:
+                    self.stats.count(filename, 'wait_timeouts')
+
+    def sweep(self, idle_seconds: int = None, is_session_active=None) -> list:
+        """Releases abandoned leases of every document.
 
-    lock_data = {
-        'section': section_id,
-        'user': user,
-        'locked_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
+        A lease is reclaimed when its session is known to have ended
+        (`is_session_active(session_id)` is False), or when it was not renewed
+        for `idle_seconds` and is not held by a live session. Expired leases
+        are dropped from the tables too. Returns the reclaimed leases as
+        {'document', 'section', 'user', 'reason'}.
+        """
+        idle_seconds = settings.lock_idle_seconds if idle_seconds is None else idle_seconds
+        idle_since = (datetime.datetime.now() - datetime.timedelta(seconds=idle_seconds)).strftime(TIME_FORMAT)
+        reclaimed = []
+        if not os.path.isdir(self.root):
+            return reclaimed
 
-    with open(lock_file, 'w', encoding='utf-8') as f:
-        yaml.dump(lock_data, f)
+        for filename in sorted(os.listdir(self.root)):
+            if not os.path.isdir(os.path.join(self.root, filename)):
+                continue
 
-    return True
+            def drop_stale(table):
+                changed = False
+                for section_id, lease in list(table.items()):
+                    session_id = lease.get('session_id')
+                    live_session = bool(session_id and is_session_active and is_session_active(session_id))
+                    if not self._live(lease):
+                        reason = 'expired'
+                    elif session_id and is_session_active and not live_session:
+                        reason = 'session ended'
+                    elif lease.get('renewed_at', lease['locked_at']) < idle_since and not live_session:
+                        reason = 'idle'
+                    else:
+                        continue
+                    del table[section_id]
+                    changed = True
+                    if reason != 'expired':
+                        self.stats.count(filename, 'reclaims')
+                        reclaimed.append({'document': filename, 'section': section_id, 'user': lease['user'], 'reason': reason})
+                return changed
+
+            with self._lock:
+                if self._modify(filename, drop_stale):
+                    self._released.notify_all()
+        return reclaimed
+
+    def release_session(self, session_id: str) -> int:
+        """Releases every lease held by a UI session. Returns how many."""
+        reclaimed = self.sweep(idle_seconds=10**9, is_session_active=lambda sid: sid != session_id)
+        return len(reclaimed)
+
+    def lease(self, filename: str, section_id: str):
+        """The live lease of a section, or None if unlocked or expired."""
+        return self._live(self._table(filename).get(section_id))
+
+    def owner(self, filename: str, section_id: str):
+        lease = self.lease(filename, section_id)
+        return lease['user'] if lease else False
+
+    def document_locks(self, filename: str) -> dict:
+        """{section_id: lease} of the live leases of a document, in one read."""
+        now = datetime.datetime.now().strftime(TIME_FORMAT)
+        return {section_id: dict(lease) for section_id, lease in self._table(filename).items()
+                if lease['expires_at'] > now}
+
+    def locks(self, filename: str) -> dict:
+        """{section_id: user} of the live leases of a document."""
+        return {section_id: lease['user'] for section_id, lease in self.document_locks(filename).items()}
+
+    def _live(self, lease):
+        if lease and lease['expires_at'] > datetime.datetime.now().strftime(TIME_FORMAT):
+            return lease
+        return None
+
+    def _table(self, filename: str) -> dict:
+        lock_dir = self._lock_dir(filename)
+        now = time.monotonic()
+        cached = self._tables.get(lock_dir)
+        if cached and now - cached[1] < LOCK_TABLE_RECHECK:
+            return cached[2]
+        generation = self._read_generation(filename)
+        if cached and cached[0] == generation:
+            table = cached[2]
+        else:
+            table = self._load(filename)
+        self._tables[lock_dir] = (generation, now, table)
+        return table
+
+    def _read_generation(self, filename: str):
+        try:
+            with open(self._generation_file(filename), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _load(self, filename: str) -> dict:
+        """Reads the lock table, merging lock files of the older one-file-per-section layout."""
+        lock_dir = self._lock_dir(filename)
+        table = {}
+        try:
+            table = read_yaml(self._table_file(filename)) or {}
+        except FileNotFoundError:
+            pass
+
+        for name in self._legacy_files(filename):
+            try:
+                lease = read_yaml(os.path.join(lock_dir, name))
+            except FileNotFoundError:
+                continue  # Released meanwhile
+            if lease and 'expires_at' not in lease:
+                locked_at = datetime.datetime.strptime(lease['locked_at'], TIME_FORMAT)
+                lease['expires_at'] = self._expiry(locked_at)
+            if lease:
+                table.setdefault(str(lease['section']), lease)
+        return table
+
+    def _modify(self, filename: str, change):
+        """Applies change(table) to a fresh copy of the lock table and writes it if it returns True."""
+        with self._lock, self._exclusive(self._lock_dir(filename)):
+            table = self._load(filename)
+            changed = change(table)
+            if changed:
+                self._write(filename, table)
+            return changed
+
+    @contextmanager
+    def _exclusive(self, lock_dir: str):
+        """Holds an exclusive flock on a document's lock directory."""
+        os.makedirs(lock_dir, exist_ok=True)
+        fd = os.open(lock_dir, os.O_RDONLY) if fcntl else None
+        try:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)  # Also releases the flock
+
+    def _write(self, filename: str, table: dict):
+        table = {section_id: lease for section_id, lease in table.items() if self._live(lease)}
+        table_file = self._table_file(filename)
+        if table:
+            write_yaml(table_file, table)
+        elif os.path.exists(table_file):
+            os.remove(table_file)
+        for name in self._legacy_files(filename):
+            os.remove(os.path.join(self._lock_dir(filename), name))  # Now in the table
+
+        # Announces the change to other processes, once the table they will re-read is written
+        generation = os.urandom(8).hex()
+        generation_file = self._generation_file(filename)
+        temp_path = f'{generation_file}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(generation)
+        os.replace(temp_path, generation_file)
+        self._tables[self._lock_dir(filename)] = (generation, time.monotonic(), table)
+
+    def _legacy_files(self, filename: str) -> list:
+        prefix = f'{os.path.basename(filename)}.section_'
+        try:
+            return [name for name in os.listdir(self._lock_dir(filename))
+                    if name.startswith(prefix) and name.endswith('.lock')]
+        except FileNotFoundError:
+            return []
+
+    def _expiry(self, start: datetime.datetime, ttl: int = None) -> str:
+        ttl = ttl or self.ttl or settings.lock_ttl_seconds
+        return (start + datetime.timedelta(seconds=ttl)).strftime(TIME_FORMAT)
+
+    def _lock_dir(self, filename: str) -> str:
+        return os.path.abspath(os.path.join(self.root, os.path.basename(filename)))
+
+    def _table_file(self, filename: str) -> str:
+        filename = os.path.basename(filename)
+        return os.path.join(self._lock_dir(filename), f'{filename}.locks.yaml')
+
+    def _generation_file(self, filename: str) -> str:
+        filename = os.path.basename(filename)
+        return os.path.join(self._lock_dir(filename), f'{filename}.generation')
+
+
+def _seconds_since(timestamp: str) -> float:
+    return (datetime.datetime.now() - datetime.datetime.strptime(timestamp, TIME_FORMAT)).total_seconds()
+
+
+lock_manager = LockManager()
+atexit.register(lock_manager.stats.flush)
+
+def lock_section(filename: str, section_id: str, user: str, session_id: str = None) -> bool:
+    """Locks a section for editing by a user."""
+    return lock_manager.acquire(filename, section_id, user, session_id=session_id)
+
+def renew_lock(filename: str, section_id: str, user: str, session_id: str = None) -> bool:
+    """Extends the lease of a section locked by `user`."""
+    return lock_manager.renew(filename, section_id, user, session_id=session_id)
 
 def is_section_locked(filename: str, section_id: str) -> str:
     """Checks if a section is locked and returns the locking user."""
-    filename = os.path.basename(filename)
-    lock_file = f'{LOCKS_DIR}/{filename}/{filename}.section_{section_id}.lock'
-
-    if os.path.exists(lock_file):
-        with open(lock_file, 'r', encoding='utf-8') as f:
-            lock_data = yaml.safe_load(f)
-            return lock_data['user']
+    return lock_manager.owner(filename, section_id)
 
-    return False
+def wait_for_unlock(filename: str, section_id: str, user: str, timeout: float = None):
+    """Waits for another user's lock on a section to go away; returns that user if it did not."""
+    return lock_manager.wait(filename, section_id, user, timeout)
 
 def unlock_section(filename: str, section_id: str, user: str) -> bool:
-    filename = os.path.basename(filename)
     """Unlocks a section if the user owns the lock."""
-    lock_file = f'{LOCKS_DIR}/{filename}/{filename}.section_{section_id}.lock'
+    return lock_manager.release(filename, section_id, user)
+
+def check_all_locks(filename: str) -> dict:
+    """Verify if any user has locked sections of this document."""
+    return lock_manager.locks(filename)
 
-    if not os.path.exists(lock_file):
-        return False  # No lock found
+def get_document_locks(filename: str) -> dict:
+    """All live section locks of a document, {section_id: {'user', 'locked_at', 'expires_at', ...}}."""
+    return lock_manager.document_locks(filename)
 
-    with open(lock_file, 'r', encoding='utf-8') as f:
-        lock_data = yaml.safe_load(f)
+def lock_stats(filename: str = None) -> dict:
+    """Lock contention metrics, {document: {counters..., 'wait_seconds': histogram, 'hold_seconds': histogram}}."""
+    return lock_manager.stats.snapshot(filename)
 
-    if lock_data['user'] != user:
-        return False  # Only the locking user can unlock
+def sweep_locks(idle_seconds: int = None, is_session_active=None) -> list:
+    """Releases locks of ended sessions and locks idle for too long."""
+    return lock_manager.sweep(idle_seconds, is_session_active)
 
-    os.remove(lock_file)
-    return True
+def release_session_locks(session_id: str) -> int:
+    """Releases all locks taken from a UI session."""
+    return lock_manager.release_session(session_id)
 
-def check_all_locks(filename: str) -> dict:
-    """Verify if any user has locked sections of this document."""
-    locks = {}
+_sweeper_thread = None
+
+def start_lock_sweeper(interval: int = None, is_session_active=None):
+    """Starts (once per process) a daemon thread running sweep_locks every `interval` seconds."""
+    global _sweeper_thread
+    interval = settings.lock_sweep_interval if interval is None else interval
+    if interval <= 0 or (_sweeper_thread and _sweeper_thread.is_alive()):
+        return _sweeper_thread
 
-    for lock_file in os.listdir(f"{LOCKS_DIR}/{filename}/"):
-        if lock_file.startswith(filename) and lock_file.endswith('.lock'):
-            section_id = lock_file.split('.section_')[1].split('.lock')[0]
-            with open(f'{LOCKS_DIR}/{filename}/{lock_file}', 'r', encoding='utf-8') as f:
-                lock_data = yaml.safe_load(f)
-                locks[section_id] = lock_data['user']
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                sweep_locks(is_session_active=is_session_active)
+                lock_manager.stats.flush()
+            except Exception as e:
+                print(f"Lock sweep failed: {e}")
 
-    return locks
-    
\ No newline at end of file
+    _sweeper_thread = threading.Thread(target=run, name="scraibe-lock-sweeper", daemon=True)
+    _sweeper_thread.start()
+    return _sweeper_thread
@@ -1,13 +1,24 @@
-import time
 import os
 import shutil
 import re
 import datetime
-from src.core.locks import is_section_locked, LOCKS_DIR
-from src.core.versioning import save_section_version, VERSION_DIR
+import threading
+from src.core.locks import wait_for_unlock, LOCKS_DIR
+from src.core.versioning import save_section_version, flush_versions, content_hash, find_version_by_hash, VERSION_DIR
+from src.core.merge import merge3, SectionConflictError
+from src.core.drafts import DRAFTS_DIR
 
 DOCUMENT_PATH = "documents"
 
+# Serializes the read-modify-write of a document file within this process
+_document_locks = {}
+_document_locks_guard = threading.Lock()
+
+def document_lock(filename: str) -> threading.Lock:
+    filename = os.path.basename(filename)
+    with _document_locks_guard:
+        return _document_locks.setdefault(filename, threading.Lock())
+
 def get_filename_path(filename: str, check_path=True):
     normalized = os.path.join(DOCUMENT_PATH, os.path.basename(filename))
     if check_path and not os.path.exists(normalized):
@@ -17,8 +28,11 @@ def get_filename_path(filename: str, check_path=True):
 def load_document_nolabels(filename: str) -> str:
     # sanitize filename
     content = load_document(filename)
-    cleaned = re.sub(r'>>>>>ID#\d+_\d+|\n<<<<<ID#\d+_\d+', '', content)
-    return cleaned
+    return remove_section_markers(content)
+
+def remove_section_markers(content: str) -> str:
+    """Removes the section ID labels from a Markdown document."""
+    return re.sub(r'>>>>>ID#\d+_\d+|\n<<<<<ID#\d+_\d+', '', content)
 
 def load_document(filename: str) -> str:
     """Loads the content of a Markdown document."""
@@ -92,11 +106,15 @@ def save_document(filename: str, content: str, verbose = False):
 #     return True
 
 def delete_document(filename: str):
-    """Deletes a Markdown document along with its locks and versions."""
+    """Deletes a Markdown document along with its locks, versions and drafts."""
     # Work only with the base name of the file
     basename = os.path.basename(filename)
     filename_path = get_filename_path(basename, check_path=False)
 
+    # Queued versions would recreate the versions directory afterwards
+    if not flush_versions():
+        raise TimeoutError(f"Error: Versions of {basename} are still being written, document not deleted.")
+
     errors = []
 
     # Delete the document file
@@ -120,6 +138,20 @@ def delete_document(filename: str):
             shutil.rmtree(locks_path)
         except Exception as e:
             errors.append(f"Error deleting locks directory: {str(e)}")
+    stats_path = f'{locks_path}.stats.json'
+    if os.path.exists(stats_path):
+        try:
+            os.remove(stats_path)
+        except Exception as e:
+            errors.append(f"Error deleting lock statistics: {str(e)}")
+
+    # Delete the unsaved drafts of this document, if any
+    drafts_path = os.path.join(DRAFTS_DIR, basename)
+    if os.path.exists(drafts_path):
+        try:
+            shutil.rmtree(drafts_path)
+        except Exception as e:
+            errors.append(f"Error deleting drafts directory: {str(e)}")
 
     if errors:
         raise FileNotFoundError("Deletion encountered errors: " + " ".join(errors))
@@ -170,26 +202,23 @@ def delete_section(filename: str, section_id: str, user: str):
     """Delete a complete section of the file, check locks before"""
     filename = os.path.basename(filename)
     # Check if section is locked and by whom
-    # Wait at most 1s to unlock
-    locking_user = is_section_locked(filename, section_id)
-    TRIES = 10
-    while TRIES > 0 and locking_user and locking_user != user:
-        TRIES -= 1
-        time.sleep(0.1)
-        print(f"Waiting for {locking_user} unlocking {filename} ... {TRIES}")
-        locking_user = is_section_locked(filename, section_id)
-    
-    locking_user = is_section_locked(filename, section_id)
-    if locking_user and locking_user != user:
+    # Wait at most settings.lock_wait_timeout for it to be unlocked
+    locking_user = wait_for_unlock(filename, section_id, user)
+    if locking_user:
         raise PermissionError(f"Error: Section {section_id} is locked by {locking_user}. Cannot save changes.")
 
+    with document_lock(filename):
+        return _delete_section(filename, section_id, user)
+
+def _delete_section(filename: str, section_id: str, user: str):
+    # Read the document
+    doc_original = load_document(filename)
+
     # Check section exists
-    existing_sections = list_sections(load_document(filename))
+    existing_sections = list_sections(doc_original)
     if section_id not in existing_sections:
         raise ValueError(f"Error: Section {section_id} does not exist in the document.")
 
-    # Read the document
-    doc_original = load_document(filename)
     lines = doc_original.splitlines()
         
     # Validate the new content syntax
@@ -222,7 +251,7 @@ def delete_section(filename: str, section_id: str, user: str):
     updated_lines = previous_lines + next_lines
 
     # Save the version
-    version_filename = save_section_version(filename, section_id, user, "")
+    version_filename = save_section_version(filename, section_id, user, "", coalesce=False)
 
     # Save the modified document
     filename_complete = get_filename_path(filename)
@@ -242,31 +271,44 @@ def delete_section(filename: str, section_id: str, user: str):
 
 
 
-def save_section(filename: str, section_id: str, user: str, new_content: str):
-    """Saves a new version of a section but prevents modification if it's locked by another user."""
+def save_section(filename: str, section_id: str, user: str, new_content: str, coalesce: bool = True, base_hash: str = None,
+                 base_text: str = None):
+    """Saves a new version of a section but prevents modification if it's locked by another user.
+
+    With `base_hash`, the content_hash of the text the user started from,
+    the save is optimistic instead: it does not wait for locks, and if the
+    section was saved meanwhile the edits are merged line by line against
+    that base. Overlapping edits raise SectionConflictError.
+
+    The base is looked up in the version history. Callers that kept the
+    text they started from pass it as `base_text`, so the merge still works
+    once that version was thinned by the GC or replaced by coalescing;
+    otherwise every edit would conflict.
+    """
 
     filename = os.path.basename(filename)
-    # Check if section is locked and by whom
-    # Wait at most 1s to unlock
-    locking_user = is_section_locked(filename, section_id)
-    TRIES = 10
-    while TRIES > 0 and locking_user and locking_user != user:
-        TRIES -= 1
-        time.sleep(0.1)
-        print(f"Waiting for {locking_user} unlocking {filename} ... {TRIES}")
-        locking_user = is_section_locked(filename, section_id)
-    
-    locking_user = is_section_locked(filename, section_id)
-    if locking_user and locking_user != user:
-        raise PermissionError(f"Error: Section {section_id} is locked by {locking_user}. Cannot save changes.")
+    if base_hash is None:
+        # Check if section is locked and by whom
+        # Wait at most settings.lock_wait_timeout for it to be unlocked
+        locking_user = wait_for_unlock(filename, section_id, user)
+        if locking_user:
+            raise PermissionError(f"Error: Section {section_id} is locked by {locking_user}. Cannot save changes.")
+
+    with document_lock(filename):
+        return _save_section(filename, section_id, user, new_content, coalesce, base_hash, base_text)
+
+def _save_section(filename: str, section_id: str, user: str, new_content: str, coalesce: bool, base_hash: str, base_text: str = None):
+    # Read the document
+    doc_original = load_document(filename)
 
     # Check section exists
-    existing_sections = list_sections(load_document(filename))
+    existing_sections = list_sections(doc_original)
     if section_id not in existing_sections:
         raise ValueError(f"Error: Section {section_id} does not exist in the document.")
 
-    # Read the document
-    doc_original = load_document(filename)
+    if base_hash is not None:
+        new_content = merge_section(filename, section_id, doc_original, new_content, base_hash, base_text)
+
     lines = doc_original.splitlines()
         
     # Validate the new content syntax
@@ -298,7 +340,7 @@ def save_section(filename: str, section_id: str, user: str, new_content: str):
     updated_lines = previous_lines + new_content.strip().splitlines() + next_lines
 
     # Save the version
-    version_filename = save_section_version(filename, section_id, user, new_content)
+    version_filename = save_section_version(filename, section_id, user, new_content, coalesce=coalesce)
 
     # Save the modified document
     filename_complete = get_filename_path(filename)
@@ -317,6 +359,28 @@ def save_section(filename: str, section_id: str, user: str, new_content: str):
 
     return version_filename
 
+def merge_section(filename: str, section_id: str, document_content: str, new_content: str, base_hash: str, base_text: str = None) -> str:
+    """Rebases an edit made from the `base_hash` text (`base_text`, if given and matching) onto the current text of the section."""
+    try:
+        current = extract_section(document_content, section_id)
+    except ValueError:
+        current = ""  # Empty section
+    current_hash = content_hash(current)
+    if current_hash == base_hash:
+        return new_content  # Nobody saved meanwhile
+
+    if base_text is not None and content_hash(base_text) == base_hash:
+        base = base_text
+    else:
+        base = find_version_by_hash(filename, section_id, base_hash)
+    if base is None:
+        # The base is not in the history: everything the user wrote is contested
+        base = ""
+    merged, conflicts = merge3(base.strip().splitlines(), new_content.strip().splitlines(), current.strip().splitlines())
+    if conflicts:
+        raise SectionConflictError(section_id, "\n".join(merged), conflicts, current_hash, current)
+    return "\n".join(merged)
+
         
         
 def generate_section_id(index: int) -> str:
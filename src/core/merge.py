@@ -0,0 +1,78 @@
+import difflib
+
+# Conflict markers, longer than the >>>>>ID# / <<<<<ID# section markers
+CONFLICT_START = '<<<<<<< yours'
+CONFLICT_SEPARATOR = '======='
+CONFLICT_END = '>>>>>>> saved meanwhile'
+
+class SectionConflictError(ValueError):
+    """Concurrent edits of a section touch the same lines.
+
+    `merged` is the section text with the non-conflicting changes applied
+    and each conflict between conflict markers, `conflicts` lists them as
+    {'base', 'yours', 'theirs'} and `current_hash` is the hash of the saved
+    text the conflicts were computed against, `current` that text.
+    """
+
+    def __init__(self, section_id: str, merged: str, conflicts: list, current_hash: str, current: str = None):
+        super().__init__(f"Error: Section {section_id} was changed meanwhile, {len(conflicts)} conflicting change(s).")
+        self.section_id = section_id
+        self.merged = merged
+        self.conflicts = conflicts
+        self.current_hash = current_hash
+        self.current = current
+
+def merge3(base: list, yours: list, theirs: list):
+    """Three-way line merge of two edits of the same base.
+
+    Changes that touch different base lines are combined; changes of the
+    same (or adjacent) lines conflict unless both sides made the same change.
+    Returns (merged_lines, conflicts), with conflicts marked in merged_lines.
+    """
+    hunks = sorted(_hunks(base, yours, 'yours') + _hunks(base, theirs, 'theirs'), key=lambda h: (h[0], h[1]))
+    merged = []
+    conflicts = []
+    position = 0
+    i = 0
+    while i < len(hunks):
+        cluster = [hunks[i]]
+        start, end = hunks[i][0], hunks[i][1]
+        i += 1
+        while i < len(hunks) and hunks[i][0] <= end:
+            cluster.append(hunks[i])
+            end = max(end, hunks[i][1])
+            i += 1
+
+        merged.extend(base[position:start])
+        position = end
+        sides = {side: [h for h in cluster if h[3] == side] for side in ('yours', 'theirs')}
+        if not sides['theirs']:
+            merged.extend(_apply(base, start, end, sides['yours']))
+        elif not sides['yours']:
+            merged.extend(_apply(base, start, end, sides['theirs']))
+        else:
+            mine = _apply(base, start, end, sides['yours'])
+            other = _apply(base, start, end, sides['theirs'])
+            if mine == other:
+                merged.extend(mine)
+            else:
+                conflicts.append({'base': base[start:end], 'yours': mine, 'theirs': other})
+                merged.extend([CONFLICT_START] + mine + [CONFLICT_SEPARATOR] + other + [CONFLICT_END])
+    merged.extend(base[position:])
+    return merged, conflicts
+
+def _hunks(base: list, other: list, side: str) -> list:
+    """(base_start, base_end, replacement_lines, side) for each change from base to other."""
+    matcher = difflib.SequenceMatcher(None, base, other, autojunk=False)
+    return [(i1, i2, other[j1:j2], side) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+def _apply(base: list, start: int, end: int, hunks: list) -> list:
+    """One side's text for base[start:end]."""
+    result = []
+    position = start
+    for i1, i2, lines, _ in hunks:
+        result.extend(base[position:i1])
+        result.extend(lines)
+        position = i2
+    result.extend(base[position:end])
+    return result
@@ -0,0 +1,53 @@
+import time
+import asyncio
+import threading
+
+from settings import settings
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, in bursts of up to `capacity`.
+
+    Shared by threads and event loops: reserve() takes a token and says how
+    long to wait for it, wait() and acquire() do the waiting. A rate of 0
+    means no limit.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token. Returns the seconds to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def wait(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def rate_limiter(provider: str) -> TokenBucket:
+    """The process-wide bucket of an LLM provider, at settings.llm_requests_per_minute."""
+    rate = settings.llm_requests_per_minute / 60
+    with _buckets_lock:
+        bucket = _buckets.get(provider)
+        if bucket is None or bucket.rate != rate:
+            bucket = _buckets[provider] = TokenBucket(rate, capacity=settings.llm_concurrency)
+        return bucket
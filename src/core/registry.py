@@ -0,0 +1,394 @@
+import os
+import yaml
+import sqlite3
+import time
+import random
+import datetime
+import threading
+from copy import deepcopy
+from contextlib import contextmanager
+
+# SQLite database with the document registry, next to the data directories
+REGISTRY_DB = 'scraibe.db'
+
+# Where the registry lived before; imported once into an empty database
+LEGACY_DOCUMENTS_YAML = 'documents.yaml'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    creator TEXT,
+    created_at TEXT,
+    lang TEXT,
+    purpose TEXT,
+    role TEXT
+);
+CREATE TABLE IF NOT EXISTS document_users (
+    document TEXT NOT NULL REFERENCES documents(name) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    permission TEXT NOT NULL,
+    display_name TEXT,
+    PRIMARY KEY (document, name)
+);
+-- Inverted index user -> (document, permission): a user's documents without scanning the others
+CREATE INDEX IF NOT EXISTS document_users_by_user ON document_users (name, document, permission);
+CREATE TABLE IF NOT EXISTS registry_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+-- Bumped by every write transaction, keys the authorization cache
+INSERT OR IGNORE INTO registry_meta (key, value) VALUES ('generation', '0');
+-- User accounts, see src/core/users.py
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    role TEXT NOT NULL DEFAULT 'user',
+    last_login TEXT
+);
+-- Admin checks (at least one must remain) without scanning every account
+CREATE INDEX IF NOT EXISTS users_by_role ON users (role, name);
+-- Bumped to revoke a user's session tokens (logout, password change)
+CREATE TABLE IF NOT EXISTS user_token_epochs (
+    name TEXT PRIMARY KEY,
+    epoch INTEGER NOT NULL
+);
+"""
+
+AI_FIELDS = ['lang', 'purpose', 'role']
+
+# How often cached permissions look for changes committed by other processes;
+# changes made by this process invalidate them at once
+AUTHZ_RECHECK_SECONDS = 0.5
+
+# Attempts of update_documents() before giving up on a registry that keeps changing
+CAS_RETRIES = 20
+
+class RegistryConflictError(RuntimeError):
+    """update_documents() lost the race against other writers CAS_RETRIES times."""
+
+class _Stale(Exception):
+    pass
+
+class DocumentRegistry:
+    """Documents, their users and permissions, and their AI configuration, in SQLite.
+
+    Metadata is returned in the shape documents.yaml had:
+    {'creator', 'created_at', 'lang', 'purpose', 'role', 'users': [{'name', 'permission', 'display_name'}]}.
+    Every change runs in its own write transaction, so concurrent sessions
+    and processes never overwrite each other's updates.
+    """
+
+    def __init__(self, path: str = REGISTRY_DB, legacy_yaml: str = LEGACY_DOCUMENTS_YAML):
+        self.path = path
+        self.legacy_yaml = legacy_yaml
+        self._local = threading.local()
+        self._authz = {}  # (database, user, document) -> (generations, permission)
+        self._authz_lock = threading.Lock()
+        self._changes = 0  # Commits made by this process
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection to the database (relative paths follow the working directory)."""
+        path = os.path.abspath(self.path)
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        db = connections.get(path)
+        if db is None:
+            db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            db.executescript(SCHEMA)
+            connections[path] = db
+            self._import_legacy_yaml(db)
+        return db
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back on errors."""
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("UPDATE registry_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        self._local.generation = None  # data_version does not see this connection's own commits
+        with self._authz_lock:
+            self._changes += 1
+
+    def generation(self) -> int:
+        """Counter bumped by every committed change, from any connection or process.
+
+        Re-read only when SQLite's data_version says another connection
+        committed, so checking it costs a pragma, not a query.
+        """
+        db = self.connection()
+        data_version = db.execute("PRAGMA data_version").fetchone()[0]
+        cached = getattr(self._local, 'generation', None)
+        if cached and cached[0] == (db, data_version):
+            return cached[1]
+        generation = _read_generation(db)
+        self._local.generation = ((db, data_version), generation)
+        return generation
+
+    def close(self):
+        """Closes this thread's connections, e.g. before the database file is replaced."""
+        for db in getattr(self._local, 'connections', {}).values():
+            db.close()
+        self._local.connections = {}
+
+    #
+    # Queries
+    # -------
+    #
+
+    def get_document(self, name: str):
+        """Metadata of a document, or None."""
+        db = self.connection()
+        row = db.execute("SELECT * FROM documents WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        users = db.execute("SELECT name, permission, display_name FROM document_users WHERE document = ? ORDER BY rowid", (name,)).fetchall()
+        return _document_meta(row, users)
+
+    def all_documents(self) -> dict:
+        """{name: metadata} of every document."""
+        return self._documents("SELECT * FROM documents ORDER BY name", ())
+
+    def permission(self, document: str, username: str):
+        """The permission of a user on a document ('creator', 'editor', 'viewer'), or None."""
+        row = self.connection().execute(
+            "SELECT permission FROM document_users WHERE document = ? AND name = ?", (document, username)).fetchone()
+        return row['permission'] if row else None
+
+    def permissions_for_user(self, username: str) -> dict:
+        """{document: permission} of a user, read from the user index only."""
+        rows = self.connection().execute(
+            "SELECT document, permission FROM document_users WHERE name = ? ORDER BY document", (username,))
+        return {row['document']: row['permission'] for row in rows}
+
+    def cached_permission(self, document: str, username: str):
+        """permission(), memoized per (user, document) until the registry changes.
+
+        Shared by all sessions and threads of the process. Commits of this
+        process invalidate it immediately, other processes' commits within
+        AUTHZ_RECHECK_SECONDS.
+        """
+        local = self._local
+        now = time.monotonic()
+        if now - getattr(local, 'authz_checked_at', -AUTHZ_RECHECK_SECONDS) >= AUTHZ_RECHECK_SECONDS:
+            local.authz_generation = self.generation()
+            local.authz_checked_at = now
+        generations = (local.authz_generation, self._changes)
+        key = (os.path.abspath(self.path), username, document)
+        hit = self._authz.get(key)
+        if hit and hit[0] == generations:
+            return hit[1]
+        permission = self.permission(document, username)
+        with self._authz_lock:
+            if len(self._authz) > 100_000:
+                self._authz.clear()  # Entries of old generations pile up otherwise
+            self._authz[key] = (generations, permission)
+        return permission
+
+    def documents_for_user(self, username: str) -> dict:
+        """{name: metadata} of the documents where `username` is listed."""
+        return self._documents(
+            "SELECT d.* FROM documents d JOIN document_users u ON u.document = d.name WHERE u.name = ? ORDER BY d.name",
+            (username,))
+
+    def _documents(self, query: str, params: tuple) -> dict:
+        db = self.connection()
+        rows = db.execute(query, params).fetchall()
+        if not rows:
+            return {}
+        names = [row['name'] for row in rows]
+        users = {name: [] for name in names}
+        placeholders = ",".join("?" * len(names))
+        for user in db.execute(f"SELECT document, name, permission, display_name FROM document_users "
+                               f"WHERE document IN ({placeholders}) ORDER BY rowid", names):
+            users[user['document']].append(user)
+        return {row['name']: _document_meta(row, users[row['name']]) for row in rows}
+
+    #
+    # Updates
+    # -------
+    #
+
+    def add_document(self, name: str, creator: str, lang=None, purpose=None, role=None, created_at=None) -> bool:
+        """Registers a document with its creator as owner. Returns False if it already exists."""
+        created_at = created_at or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        added = []
+        def add(documents):
+            added.clear()
+            if name not in documents:
+                documents[name] = {'creator': creator, 'created_at': created_at, 'lang': lang, 'purpose': purpose, 'role': role,
+                                   'users': [{'name': creator, 'permission': 'creator', 'display_name': creator}]}
+                added.append(name)
+        self.update_documents(add, names=[name])
+        return bool(added)
+
+    def set_user_permission(self, document: str, username: str, permission: str, display_name: str = None):
+        """Grants or changes a user's permission. The creator's entry cannot change.
+
+        Raises KeyError if the document does not exist and PermissionError
+        for the creator.
+        """
+        def grant(meta):
+            entry = _user_entry(meta, username)
+            if entry and entry['permission'] == 'creator':
+                raise PermissionError("Cannot modify creator's permissions.")
+            if entry:
+                entry['permission'] = permission
+                entry['display_name'] = display_name or entry['display_name']
+            elif permission != 'none':
+                meta['users'].append({'name': username, 'permission': permission, 'display_name': display_name or username})
+        self.update_document(document, grant)
+        return True
+
+    def remove_user(self, document: str, username: str):
+        """Removes a user from a document. Raises KeyError / PermissionError like set_user_permission."""
+        def remove(meta):
+            entry = _user_entry(meta, username)
+            if entry and entry['permission'] == 'creator':
+                raise PermissionError("Cannot remove the creator.")
+            meta['users'] = [user for user in meta['users'] if user is not entry]
+        self.update_document(document, remove)
+        return True
+
+    def update_ai_config(self, document: str, role=None, purpose=None, lang=None):
+        def configure(meta):
+            meta.update(role=role, purpose=purpose, lang=lang)
+        self.update_document(document, configure)
+        return True
+
+    def delete_document(self, name: str) -> bool:
+        with self.transaction() as db:
+            deleted = db.execute("DELETE FROM documents WHERE name = ?", (name,)).rowcount
+        return deleted > 0
+
+    def put_documents(self, documents: dict, replace: bool = False):
+        """Writes {name: metadata} as given; with `replace`, documents not listed are dropped."""
+        with self.transaction() as db:
+            if replace:
+                db.execute("DELETE FROM documents")
+            for name, meta in documents.items():
+                _put_document(db, name, meta)
+
+    def snapshot(self, names=None) -> tuple:
+        """(generation, {name: metadata}) read consistently, of `names` or of every document."""
+        db = self.connection()
+        db.execute("BEGIN")  # One read snapshot for both
+        try:
+            generation = _read_generation(db)
+            if names is None:
+                documents = self.all_documents()
+            else:
+                documents = {name: meta for name in names if (meta := self.get_document(name)) is not None}
+        finally:
+            db.execute("COMMIT")
+        return generation, documents
+
+    def compare_and_swap(self, generation: int, documents: dict, deleted=()) -> bool:
+        """Writes {name: metadata} and drops `deleted`, only if the registry is still at `generation`."""
+        try:
+            with self.transaction() as db:
+                if _read_generation(db) != generation:
+                    raise _Stale()
+                for name, meta in documents.items():
+                    _put_document(db, name, meta)
+                for name in deleted:
+                    db.execute("DELETE FROM documents WHERE name = ?", (name,))
+        except _Stale:
+            return False
+        return True
+
+    def update_documents(self, mutate, names=None, retries: int = CAS_RETRIES) -> dict:
+        """Read-modify-write of document metadata without lost updates.
+
+        mutate({name: metadata}) changes the documents in place or returns new
+        ones. If another writer committed meanwhile, it is applied again to
+        fresh metadata. Only the documents it added, changed or removed are
+        written. Returns the documents as written; raises RegistryConflictError
+        after `retries` lost races.
+        """
+        for attempt in range(retries):
+            generation, before = self.snapshot(names)
+            documents = deepcopy(before)
+            result = mutate(documents)
+            if result is not None:
+                documents = result
+            changed = {name: meta for name, meta in documents.items() if before.get(name) != meta}
+            deleted = [name for name in before if name not in documents]
+            if not changed and not deleted:
+                return documents
+            if self.compare_and_swap(generation, changed, deleted):
+                return documents
+            time.sleep(random.uniform(0, 0.005) * (attempt + 1))  # Let the other writers through
+        raise RegistryConflictError(f"Registry changed {retries} times during the update")
+
+    def update_document(self, name: str, mutate, retries: int = CAS_RETRIES) -> dict:
+        """update_documents() for one document's metadata. Raises KeyError if it does not exist."""
+        def apply(documents):
+            if name not in documents:
+                raise KeyError(f"Document {name} not found")
+            result = mutate(documents[name])
+            if result is not None:
+                documents[name] = result
+        return self.update_documents(apply, names=[name], retries=retries)[name]
+
+    #
+    # Import
+    # ------
+    #
+
+    def import_yaml(self, path: str = None) -> int:
+        """Imports a documents.yaml into the registry. Returns the number of documents."""
+        path = path or self.legacy_yaml
+        with open(path, 'r') as f:
+            documents = (yaml.safe_load(f) or {}).get('documents') or {}
+        with self.transaction() as db:
+            for name, meta in documents.items():
+                _put_document(db, name, meta)
+            db.execute("INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('yaml_imported_at', ?)",
+                       (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+        return len(documents)
+
+    def _import_legacy_yaml(self, db: sqlite3.Connection):
+        """One-time migration: an empty registry starts from documents.yaml, if there is one."""
+        if not os.path.exists(self.legacy_yaml):
+            return
+        if db.execute("SELECT 1 FROM registry_meta WHERE key = 'yaml_imported_at'").fetchone():
+            return
+        if db.execute("SELECT 1 FROM documents LIMIT 1").fetchone():
+            return
+        self.import_yaml()
+
+def _read_generation(db: sqlite3.Connection) -> int:
+    return int(db.execute("SELECT value FROM registry_meta WHERE key = 'generation'").fetchone()[0])
+
+def _document_meta(row, users) -> dict:
+    meta = {'creator': row['creator'], 'created_at': row['created_at']}
+    for field in AI_FIELDS:
+        meta[field] = row[field]
+    meta['users'] = [{'name': user['name'], 'permission': user['permission'], 'display_name': user['display_name']} for user in users]
+    return meta
+
+def _user_entry(meta: dict, username: str):
+    return next((user for user in meta['users'] if user['name'] == username), None)
+
+def _put_document(db: sqlite3.Connection, name: str, meta: dict):
+    created_at = meta.get('created_at')
+    if isinstance(created_at, datetime.datetime):
+        created_at = created_at.strftime("%Y-%m-%d %H:%M:%S")
+    db.execute("DELETE FROM documents WHERE name = ?", (name,))
+    db.execute("INSERT INTO documents (name, creator, created_at, lang, purpose, role) VALUES (?, ?, ?, ?, ?, ?)",
+               (name, meta.get('creator'), created_at, meta.get('lang'), meta.get('purpose'), meta.get('role')))
+    for user in meta.get('users') or []:
+        db.execute("INSERT OR REPLACE INTO document_users (document, name, permission, display_name) VALUES (?, ?, ?, ?)",
+                   (name, user['name'], user.get('permission', 'viewer'), user.get('display_name', user['name'])))
+
+registry = DocumentRegistry()
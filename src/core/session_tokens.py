@@ -0,0 +1,73 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import threading
+import re
+
+from settings import settings
+
+# Key signing the session tokens, created on first use unless settings.session_secret is set
+SESSION_SECRET_FILE = '.session_secret'
+
+# '<payload>.<signature>', both base64url: anything else is rejected before signing
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+')
+
+_secrets = {}
+_secrets_lock = threading.Lock()
+
+def session_secret() -> bytes:
+    """The signing key: settings.session_secret, or a random one kept in SESSION_SECRET_FILE."""
+    if settings.session_secret:
+        return settings.session_secret.encode('utf-8')
+    path = os.path.abspath(SESSION_SECRET_FILE)
+    with _secrets_lock:
+        if path not in _secrets:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(os.urandom(32).hex().encode('ascii'))
+            except FileExistsError:
+                pass  # Created before, maybe by another process
+            with open(path, 'rb') as f:
+                _secrets[path] = f.read().strip()
+        return _secrets[path]
+
+def issue_session_token(username: str, role: str, generation: int, ttl_hours: float = None, epoch: int = 0) -> str:
+    """A signed token '<payload>.<signature>' carrying the user, role, registry generation and the user's token epoch."""
+    ttl_hours = settings.session_ttl_hours if ttl_hours is None else ttl_hours
+    claims = {'user': username, 'role': role, 'generation': generation, 'epoch': epoch,
+              'expires': int(time.time() + ttl_hours * 3600)}
+    payload = _encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return f'{payload}.{_sign(payload)}'
+
+def verify_session_token(token: str):
+    """The claims {'user', 'role', 'generation', 'epoch', 'expires'} of a valid token, or None.
+
+    Tokens with a wrong signature, malformed or expired are rejected. Only
+    the signature is checked: nothing is read from disk, the caller compares
+    the epoch with the user's when the generation is outdated.
+    """
+    if not isinstance(token, str) or not TOKEN_PATTERN.fullmatch(token):
+        return None
+    payload, signature = token.split('.')
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get('expires', 0) < time.time():
+        return None
+    return claims
+
+def _sign(payload: str) -> str:
+    return _encode(hmac.new(session_secret(), payload.encode('ascii'), hashlib.sha256).digest())
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
@@ -0,0 +1,173 @@
+import os
+import datetime
+import sqlite3
+
+from src.core.registry import registry, DocumentRegistry
+from src.core.yaml_store import read_yaml
+
+# Where the user accounts lived before; imported once into an empty directory
+LEGACY_USERS_YAML = 'users.yaml'
+
+ROLES = ['user', 'admin']
+
+# Rows per page of the admin listing
+USERS_PAGE_SIZE = 25
+
+class UserDirectory:
+    """User accounts in the registry database (table `users`), looked up by primary key.
+
+    Users are returned as {'name', 'password', 'role', 'last_login'};
+    passwords are stored as given (hashed by the caller). Changes run in the
+    registry's write transactions, so they also bump its generation.
+    """
+
+    def __init__(self, registry: DocumentRegistry = registry, legacy_yaml: str = LEGACY_USERS_YAML):
+        self.registry = registry
+        self.legacy_yaml = legacy_yaml
+        self._checked = set()  # Databases checked for the users.yaml import
+
+    def connection(self) -> sqlite3.Connection:
+        db = self.registry.connection()
+        path = os.path.abspath(self.registry.path)
+        if path not in self._checked:
+            self._import_legacy_yaml(db)
+            self._checked.add(path)
+        return db
+
+    #
+    # Queries
+    # -------
+    #
+
+    def get(self, name: str):
+        """The account of a user, or None."""
+        row = self.connection().execute("SELECT * FROM users WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def count(self, search: str = None) -> int:
+        where, params = _search(search)
+        return self.connection().execute(f"SELECT COUNT(*) FROM users {where}", params).fetchone()[0]
+
+    def page(self, page: int = 0, page_size: int = USERS_PAGE_SIZE, search: str = None) -> list:
+        """One page of [{'name', 'role', 'last_login'}] in name order, optionally filtered by a name substring."""
+        where, params = _search(search)
+        rows = self.connection().execute(
+            f"SELECT name, role, last_login FROM users {where} ORDER BY name LIMIT ? OFFSET ?",
+            params + (page_size, max(page, 0) * page_size))
+        return [dict(row) for row in rows]
+
+    def names(self, search: str = None, limit: int = None) -> list:
+        where, params = _search(search)
+        rows = self.connection().execute(f"SELECT name FROM users {where} ORDER BY name LIMIT ?", params + (limit or -1,))
+        return [row['name'] for row in rows]
+
+    def token_epoch(self, name: str) -> int:
+        """Carried by the user's session tokens; tokens of an older epoch are revoked."""
+        row = self.connection().execute("SELECT epoch FROM user_token_epochs WHERE name = ?", (name,)).fetchone()
+        return row['epoch'] if row else 0
+
+    #
+    # Updates
+    # -------
+    #
+
+    def add(self, name: str, password: str, role: str = 'user') -> bool:
+        """Creates an account. Returns False if the name is taken, raises ValueError for unknown roles."""
+        _check_role(role)
+        self.connection()
+        with self.registry.transaction() as db:
+            inserted = db.execute("INSERT OR IGNORE INTO users (name, password, role) VALUES (?, ?, ?)",
+                                  (name, password, role)).rowcount
+        return inserted > 0
+
+    def set_role(self, name: str, role: str):
+        """Changes a user's role. Raises ValueError for unknown roles, KeyError for unknown users and PermissionError for the last admin."""
+        _check_role(role)
+        self.connection()
+        with self.registry.transaction() as db:
+            current = self._role(db, name)
+            if current == 'admin' and role != 'admin':
+                self._check_other_admins(db, name, "Cannot change role. At least one admin must remain.")
+            db.execute("UPDATE users SET role = ? WHERE name = ?", (role, name))
+
+    def set_password(self, name: str, password: str):
+        """Changes a user's password and revokes their session tokens. Raises KeyError for unknown users."""
+        self.connection()
+        with self.registry.transaction() as db:
+            self._role(db, name)
+            db.execute("UPDATE users SET password = ? WHERE name = ?", (password, name))
+            self._bump_token_epoch(db, name)
+
+    def revoke_sessions(self, name: str):
+        """Invalidates every session token issued to the user so far, e.g. on logout."""
+        self.connection()
+        with self.registry.transaction() as db:
+            self._bump_token_epoch(db, name)
+
+    def record_login(self, name: str, when: datetime.datetime = None):
+        when = (when or datetime.datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+        self.connection().execute("UPDATE users SET last_login = ? WHERE name = ?", (when, name))
+
+    def delete(self, name: str):
+        """Removes an account. Raises KeyError / PermissionError like set_role."""
+        self.connection()
+        with self.registry.transaction() as db:
+            if self._role(db, name) == 'admin':
+                self._check_other_admins(db, name, "Cannot delete user. At least one admin must remain.")
+            db.execute("DELETE FROM users WHERE name = ?", (name,))
+            db.execute("DELETE FROM user_token_epochs WHERE name = ?", (name,))
+
+    def _role(self, db: sqlite3.Connection, name: str) -> str:
+        row = db.execute("SELECT role FROM users WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"User {name} not found")
+        return row['role']
+
+    def _bump_token_epoch(self, db: sqlite3.Connection, name: str):
+        db.execute("INSERT INTO user_token_epochs (name, epoch) VALUES (?, 1) "
+                   "ON CONFLICT (name) DO UPDATE SET epoch = epoch + 1", (name,))
+
+    def _check_other_admins(self, db: sqlite3.Connection, name: str, message: str):
+        if not db.execute("SELECT 1 FROM users WHERE role = 'admin' AND name != ? LIMIT 1", (name,)).fetchone():
+            raise PermissionError(message)
+
+    #
+    # Import
+    # ------
+    #
+
+    def import_yaml(self, path: str = None) -> int:
+        """Imports a users.yaml ({name: {'password', 'role', 'last_login'}}). Returns the number of users."""
+        users = read_yaml(path or self.legacy_yaml) or {}
+        with self.registry.transaction() as db:
+            for name, account in users.items():
+                last_login = account.get('last_login')
+                if isinstance(last_login, datetime.datetime):
+                    last_login = last_login.strftime("%Y-%m-%d %H:%M:%S")
+                db.execute("INSERT OR REPLACE INTO users (name, password, role, last_login) VALUES (?, ?, ?, ?)",
+                           (str(name), account['password'], account.get('role', 'user'), last_login))
+            db.execute("INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('users_yaml_imported_at', ?)",
+                       (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+        return len(users)
+
+    def _import_legacy_yaml(self, db: sqlite3.Connection):
+        """One-time migration: an empty directory starts from users.yaml, if there is one."""
+        if not os.path.exists(self.legacy_yaml):
+            return
+        if db.execute("SELECT 1 FROM registry_meta WHERE key = 'users_yaml_imported_at'").fetchone():
+            return
+        if db.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return
+        self.import_yaml()
+
+def _check_role(role: str):
+    if role not in ROLES:
+        raise ValueError(f"Unknown role {role!r}, expected one of {', '.join(ROLES)}")
+
+def _search(search: str) -> tuple:
+    if not search:
+        return "", ()
+    escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return "WHERE name LIKE ? ESCAPE '\\'", (f'%{escaped}%',)
+
+user_directory = UserDirectory()
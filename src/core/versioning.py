@@ -1,70 +1,683 @@
-
 import os
 import glob
 import datetime
 import time
 import re
+import json
+import queue
+import hashlib
+import atexit
+import threading
+from bisect import bisect_left, bisect_right
 
 import src.core as scraibe
+from src.core.yaml_store import yaml_store
+from settings import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: journals are told apart by PID only
+    fcntl = None
 
 VERSION_DIR = 'versions'
 
-def save_section_version(filename: str, section_id: str, user: str, content: str):
-    """Saves a version of an edited section. Return version"""
+# How long deleting a document or backing up waits for queued versions (seconds)
+VERSION_FLUSH_TIMEOUT = 30
+
+# Versions younger than keep_all_days are all kept. Older ones are thinned to
+# the newest version per hour, then per day, and after daily_days per week.
+# The newest min_versions of every section are always kept.
+RETENTION_POLICY = {
+    'keep_all_days': settings.version_keep_all_days,
+    'hourly_days': settings.version_hourly_days,
+    'daily_days': settings.version_daily_days,
+    'min_versions': settings.version_min_per_section,
+}
+
+VERSION_FILE_RE = re.compile(r"^(?P<filename>.+)\.section_(?P<section_id>\d+_\d+)\.(?P<timestamp>\d+)\.(?P<user>[^/]+)\.md$")
+
+# filename -> (mtime_ns of its versions directory, {section_id: [(timestamp, user), ...]})
+_version_index = {}
+
+def save_section_version(filename: str, section_id: str, user: str, content: str, wait: bool = False, coalesce: bool = True):
+    """Saves a version of an edited section. Return version
+
+    With write-behind enabled the version is queued and written by a worker
+    thread; pass wait=True to return only once it is on disk.
+
+    If the same user saved the latest version of the section and started
+    that burst of saves less than VERSION_COALESCE_SECONDS ago, the new
+    version replaces it instead of adding one. The window does not slide: it
+    runs from the first save of the burst. Versions saved with
+    coalesce=False (rollbacks) are never replaced, and only the latest
+    version is, so every earlier rollback point stays.
+    """
     filename = os.path.basename(filename)
+    replaced = _coalescible_version(filename, section_id, user) if coalesce else None
+    _count_version(filename, 'saved')
+    if replaced:
+        _count_version(filename, 'coalesced')
+
     timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    version_filename = f'{VERSION_DIR}/{filename}/{filename}.section_{section_id}.{timestamp}.{user}.md'
+    version_filename = version_path(filename, section_id, timestamp, user)
+    replaced_path = version_path(filename, section_id, replaced[0], user) if replaced else None
 
-    while os.path.exists(version_filename):
+    while version_filename != replaced_path and _version_exists(version_filename):
         time.sleep(1)
         timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        version_filename = f'{VERSION_DIR}/{filename}/{filename}.section_{section_id}.{timestamp}.{user}.md'       
-       
+        version_filename = version_path(filename, section_id, timestamp, user)
+    burst_start = (replaced[1] if replaced else timestamp) if coalesce else None
+
+    # The new version is written (or queued) before the one it replaces goes away
+    if settings.version_write_behind:
+        persisted = version_writer.submit(filename, section_id, timestamp, user, content)
+        _remove_replaced_version(replaced_path, version_filename)
+        _update_last_edited(filename, section_id, timestamp, user, content, burst_start)
+        if wait:
+            persisted.wait()
+        return timestamp
+
     os.makedirs(f'{VERSION_DIR}/{filename}', exist_ok=True)
 
     with open(version_filename, 'w', encoding='utf-8') as f:
         f.write(content)
-    
+    _remove_replaced_version(replaced_path, version_filename)
+    _version_index.pop(filename, None)
+    _update_last_edited(filename, section_id, timestamp, user, content, burst_start)
+
     return timestamp
 
+def content_hash(content: str) -> str:
+    """Short hash of a section text, insensitive to surrounding whitespace."""
+    return hashlib.sha256(content.strip().encode('utf-8')).hexdigest()[:16]
+
+def last_edited_path(filename: str) -> str:
+    filename = os.path.basename(filename)
+    return f'{VERSION_DIR}/{filename}/{filename}.latest.yaml'
+
+_last_edited_lock = threading.Lock()
+
+def get_last_edited(filename: str) -> dict:
+    """Returns {section_id: {'timestamp', 'user', 'hash'}} with the latest version of every section.
+
+    The table is a single small file kept up to date on every save, so the
+    write page can decorate all sections with one read, a stat() while it is
+    unchanged; the returned table is shared, do not modify it. Documents
+    saved before it existed get it built once from the version history.
+    """
+    filename = os.path.basename(filename)
+    path = last_edited_path(filename)
+    table = yaml_store(path).load()
+    if table is not None:
+        return table
+
+    with _last_edited_lock:
+        table = {}
+        for section_id, section_versions in get_version_index(filename).items():
+            timestamp, user = section_versions[-1]
+            content = read_version(filename, section_id, timestamp, user)
+            if content.strip():
+                table[section_id] = {'timestamp': timestamp, 'user': user, 'hash': content_hash(content)}
+        if table:
+            _write_last_edited(path, table)
+        return table
+
+def _update_last_edited(filename: str, section_id: str, timestamp: str, user: str, content: str, burst_start: str = None):
+    """Records the latest version of a section; `burst_start` is set only if the next save may replace it."""
+    with _last_edited_lock:
+        path = last_edited_path(filename)
+        table = yaml_store(path).load({}, copy=True)
+        if content.strip():
+            table[section_id] = {'timestamp': timestamp, 'user': user, 'hash': content_hash(content)}
+            if burst_start:
+                table[section_id]['burst_start'] = burst_start
+        else:
+            table.pop(section_id, None)  # Deleted section
+        _write_last_edited(path, table)
+
+def _write_last_edited(path: str, table: dict):
+    """Replaces the table atomically, readers see either the old or the new one."""
+    yaml_store(path).save(table, delay=0)
+
+def _coalescible_version(filename: str, section_id: str, user: str):
+    """(timestamp, burst_start) of the latest version of the section if a save of `user` may replace it, else None.
+
+    It must be the user's, saved to be coalesced, with its burst started
+    within the window. The last-edited table keeps the burst start; entries
+    without one (rollbacks, tables rebuilt from the history) never coalesce.
+    """
+    window = settings.version_coalesce_seconds
+    section_versions = get_version_index(filename).get(section_id)
+    if window <= 0 or not section_versions:
+        return None
+
+    timestamp, latest_user = section_versions[-1]
+    entry = get_last_edited(filename).get(section_id) or {}
+    if latest_user != user or entry.get('timestamp') != timestamp or entry.get('user') != user or not entry.get('burst_start'):
+        return None
+    age = datetime.datetime.now() - datetime.datetime.strptime(entry['burst_start'], '%Y%m%d%H%M%S')
+    if age > datetime.timedelta(seconds=window):
+        return None
+    return timestamp, entry['burst_start']
+
+def _remove_replaced_version(path: str, new_path: str):
+    if not path or path == new_path:
+        return  # Nothing replaced, or overwritten in place (same second)
+    version_writer.discard(path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    _version_index.pop(os.path.basename(os.path.dirname(path)), None)
+
+# Counters since the process started: {'saved': n, 'coalesced': n, 'documents': {filename: {...}}}
+_version_stats = {'saved': 0, 'coalesced': 0, 'documents': {}}
+_version_stats_lock = threading.Lock()
+
+def _count_version(filename: str, counter: str):
+    with _version_stats_lock:
+        _version_stats[counter] += 1
+        document_stats = _version_stats['documents'].setdefault(filename, {'saved': 0, 'coalesced': 0})
+        document_stats[counter] += 1
+
+def version_stats(filename: str = None) -> dict:
+    """Snapshot of the saved/coalesced version counters, overall or for one document."""
+    with _version_stats_lock:
+        if filename:
+            return dict(_version_stats['documents'].get(os.path.basename(filename), {'saved': 0, 'coalesced': 0}))
+        return {**_version_stats, 'documents': {k: dict(v) for k, v in _version_stats['documents'].items()}}
+
+def version_path(filename: str, section_id: str, timestamp: str, user: str) -> str:
+    """Path of the file holding one version of a section."""
+    filename = os.path.basename(filename)
+    return f'{VERSION_DIR}/{filename}/{filename}.section_{section_id}.{timestamp}.{user}.md'
+
+def read_version(filename: str, section_id: str, timestamp: str, user: str) -> str:
+    """Returns the content of one version, including versions still queued for writing."""
+    path = version_path(filename, section_id, timestamp, user)
+    pending = version_writer.pending_content(path)
+    if pending is not None:
+        return pending
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No version found for section {section_id} at {timestamp}')
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def _version_exists(path: str) -> bool:
+    return os.path.exists(path) or version_writer.pending_content(path) is not None
+
+def get_version_index(filename: str) -> dict:
+    """Returns {section_id: [(timestamp, user), ...]} with every list sorted by time.
+
+    The index is built from one directory listing and cached until the
+    versions directory of the document changes.
+    """
+    filename = os.path.basename(filename)
+    versions_path = os.path.join(VERSION_DIR, filename)
+    try:
+        mtime = os.stat(versions_path).st_mtime_ns
+    except FileNotFoundError:
+        _version_index.pop(filename, None)
+        return _with_pending(filename, {})
+
+    cached = _version_index.get(filename)
+    if cached and cached[0] == mtime:
+        return _with_pending(filename, cached[1])
+
+    index = {}
+    with os.scandir(versions_path) as entries:
+        for entry in entries:
+            match = VERSION_FILE_RE.match(entry.name)
+            if match and match.group("filename") == filename:
+                index.setdefault(match.group("section_id"), []).append((match.group("timestamp"), match.group("user")))
+    for section_versions in index.values():
+        section_versions.sort()
+
+    _version_index[filename] = (mtime, index)
+    return _with_pending(filename, index)
+
+def _with_pending(filename: str, index: dict) -> dict:
+    """Adds the versions still queued in the write-behind queue to an index."""
+    pending = version_writer.pending(filename)
+    if not pending:
+        return index
+    merged = {section_id: list(section_versions) for section_id, section_versions in index.items()}
+    for section_id, timestamp, user in pending:
+        section_versions = merged.setdefault(section_id, [])
+        if (timestamp, user) not in section_versions:
+            section_versions.append((timestamp, user))
+            section_versions.sort()
+    return merged
+
 def get_all_versions(filename: str):
     """Returns a list of all versions of a file."""
     filename = os.path.basename(filename)
-    pattern = f'{VERSION_DIR}/{filename}/{filename}.section_*.*.md'
-    version_files = sorted(glob.glob(pattern), reverse=True)
-
-    matches = []
-
-    for filename in version_files:
-        # TODO: See how remove versions from this line
-        match = re.search(r"versions/.*/(?P<filename>[^/]+)\.section_(?P<section_id>\d+_\d+)\.(?P<timestamp>\d+)\.(?P<user>[^/]+)\.md", filename)
-        if match:
-            matches.append({
-                "filename": match.group("filename"),
-                "section_id": match.group("section_id"),
-                "timestamp": match.group("timestamp"),
-                "user": match.group("user"),
-            })
-    matches.sort(key=lambda x: x['timestamp'], reverse=True)
+    matches = [
+        {"filename": filename, "section_id": section_id, "timestamp": timestamp, "user": user}
+        for section_id, section_versions in get_version_index(filename).items()
+        for timestamp, user in section_versions
+    ]
+    matches.sort(key=lambda x: (x['timestamp'], x['section_id'], x['user']), reverse=True)
     return matches
-    
-def get_version_history(filename: str, section_id: str):
-    all_versions = get_all_versions(filename)
-    return [ v for v in all_versions if v['section_id']==section_id ]
 
+def get_version_history(filename: str, section_id: str, user: str = None, since=None, until=None, limit: int = None, cursor: str = None):
+    """Returns the versions of a section, newest first, optionally filtered."""
+    return list(iter_version_history(filename, section_id, user=user, since=since, until=until, limit=limit, cursor=cursor))
+
+def iter_version_history(filename: str, section_id: str, user: str = None, since=None, until=None, limit: int = None, cursor: str = None):
+    """Yields the versions of a section newest first, without building the whole list.
+
+    `since`/`until` bound the timestamps (inclusive), `user` keeps only one
+    author and `cursor` resumes right after a version returned earlier (see
+    version_cursor).
+    """
+    section_versions = get_version_index(filename).get(section_id, [])
+    filename = os.path.basename(filename)
+
+    # Everything after `stop` is out of range
+    stop = len(section_versions)
+    if until:
+        stop = bisect_right(section_versions, (normalize_timestamp(until), '\U0010ffff'))
+    if cursor:
+        timestamp, _, cursor_user = cursor.partition('.')
+        stop = min(stop, bisect_left(section_versions, (timestamp, cursor_user)))
+    since = normalize_timestamp(since, end=False) if since else None
+
+    count = 0
+    for position in range(stop - 1, -1, -1):
+        timestamp, version_user = section_versions[position]
+        if since and timestamp < since:
+            break
+        if user and version_user != user:
+            continue
+        if limit is not None and count >= limit:
+            break
+        count += 1
+        yield {"filename": filename, "section_id": section_id, "timestamp": timestamp, "user": version_user}
+
+def get_version_history_page(filename: str, section_id: str, limit: int = 20, cursor: str = None, user: str = None, since=None, until=None):
+    """Returns (versions, next_cursor) for one page of history; next_cursor is None on the last page."""
+    page = get_version_history(filename, section_id, user=user, since=since, until=until, limit=limit + 1, cursor=cursor)
+    if len(page) > limit:
+        return page[:limit], version_cursor(page[limit - 1])
+    return page, None
+
+def version_cursor(version: dict) -> str:
+    """Opaque pagination cursor pointing at a version."""
+    return f"{version['timestamp']}.{version['user']}"
+
+def find_version_by_hash(filename: str, section_id: str, hash: str, limit: int = 200):
+    """Content of the newest version of a section whose content_hash is `hash`, or None."""
+    for version in iter_version_history(filename, section_id, limit=limit):
+        content = read_version(filename, section_id, version['timestamp'], version['user'])
+        if content_hash(content) == hash:
+            return content
+    return None
+
+def normalize_timestamp(timestamp, end: bool = True) -> str:
+    """Accepts a datetime or a timestamp string and returns it as YYYYmmddHHMMSS.
+
+    A date alone (or a partial time) means the end of that period, or its
+    start when `end` is False.
+    """
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.strftime('%Y%m%d%H%M%S')
+    digits = re.sub(r'\D', '', str(timestamp))
+    if len(digits) < 8 or len(digits) > 14:
+        raise ValueError(f'Invalid timestamp {timestamp}, expected YYYYmmddHHMMSS')
+    return digits + ('235959' if end else '000000')[len(digits) - 8:]
 
+def load_document_at(filename: str, timestamp) -> str:
+    """Rebuilds the labelled document as it stood at the given timestamp.
 
-def rollback_section(filename: str, section_id: str, timestamp: str, user: str):
-    """Restores a previous version of a section."""
+    Each section takes its latest version at or before the timestamp. Sections
+    created after it, or deleted before it, are left out. A section whose first
+    recorded version is later than the timestamp keeps its current text (or is
+    left out if it is gone), because the text before the first save is not stored.
+    """
+    timestamp = normalize_timestamp(timestamp)
+    filename = os.path.basename(filename)
+    index = get_version_index(filename)
+    current = scraibe.load_document(filename)
+    current_sections = scraibe.list_sections(current)
+
+    # Sections only known from their history were deleted since; put each
+    # one after the closest older section, which is where it was created.
+    order = list(current_sections)
+    for section_id in sorted(set(index) - set(current_sections), key=_section_sort_key):
+        preceding = [i for i, s in enumerate(order) if _section_sort_key(s) < _section_sort_key(section_id)]
+        order.insert(preceding[-1] + 1 if preceding else 0, section_id)
+
+    blocks = []
+    for section_id in order:
+        if section_id.split('_')[0] > timestamp:
+            continue  # Created later
+
+        section_versions = index.get(section_id, [])
+        position = bisect_right(section_versions, (timestamp, '\U0010ffff'))
+        if position:
+            version_timestamp, user = section_versions[position - 1]
+            content = read_version(filename, section_id, version_timestamp, user)
+            if not content.strip():
+                continue  # Deleted at that point
+        elif section_id in current_sections:
+            content = scraibe.extract_section(current, section_id)
+        else:
+            continue
+
+        blocks.append(f">>>>>ID#{section_id}\n{content.strip()}\n<<<<<ID#{section_id}")
+
+    return "\n".join(blocks) + "\n"
+
+def _section_sort_key(section_id: str):
+    timestamp, index = section_id.split('_')
+    return (timestamp, int(index))
+
+
+def versions_to_prune(section_versions: list, policy: dict = None, now: datetime.datetime = None) -> list:
+    """Returns the versions of one section that the retention policy drops.
+
+    `section_versions` is a time sorted [(timestamp, user), ...] list, as in
+    get_version_index. The newest version of every hour/day/week bucket is the
+    state of the section at the end of that bucket, so it is the one kept:
+    rolling back or reading the document at a retained point stays possible.
+    """
+    policy = {**RETENTION_POLICY, **(policy or {})}
+    now = now or datetime.datetime.now()
+
+    keep = set(section_versions[-max(policy['min_versions'], 1):])
+    buckets = {}
+    for version in section_versions:
+        timestamp = version[0]
+        age = now - datetime.datetime.strptime(timestamp, '%Y%m%d%H%M%S')
+        if age < datetime.timedelta(days=policy['keep_all_days']):
+            keep.add(version)
+            continue
+        elif age < datetime.timedelta(days=policy['hourly_days']):
+            bucket = timestamp[:10]
+        elif age < datetime.timedelta(days=policy['daily_days']):
+            bucket = timestamp[:8]
+        else:
+            year, week, _ = datetime.datetime.strptime(timestamp[:8], '%Y%m%d').isocalendar()
+            bucket = f'{year}W{week:02d}'
+        buckets[bucket] = version  # Sorted input: the last one is the newest
+    keep.update(buckets.values())
+
+    return [version for version in section_versions if version not in keep]
+
+def gc_versions(filename: str = None, policy: dict = None, dry_run: bool = False, now: datetime.datetime = None) -> dict:
+    """Applies the retention policy to one document (or all) and reports what was reclaimed."""
+    if filename:
+        filenames = [os.path.basename(filename)]
+    elif os.path.isdir(VERSION_DIR):
+        filenames = sorted(f for f in os.listdir(VERSION_DIR) if os.path.isdir(os.path.join(VERSION_DIR, f)))
+    else:
+        filenames = []
+
+    report = {'documents': {}, 'examined': 0, 'deleted': 0, 'reclaimed_bytes': 0}
+    for filename in filenames:
+        index = get_version_index(filename)
+        examined = deleted = reclaimed = 0
+        for section_id, section_versions in index.items():
+            examined += len(section_versions)
+            for timestamp, user in versions_to_prune(section_versions, policy, now):
+                path = version_path(filename, section_id, timestamp, user)
+                try:
+                    size = os.path.getsize(path)
+                    if not dry_run:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue  # Removed meanwhile
+                deleted += 1
+                reclaimed += size
+        if deleted and not dry_run:
+            _version_index.pop(filename, None)
+
+        report['documents'][filename] = {'examined': examined, 'deleted': deleted, 'reclaimed_bytes': reclaimed}
+        report['examined'] += examined
+        report['deleted'] += deleted
+        report['reclaimed_bytes'] += reclaimed
+
+    return report
+
+_gc_thread = None
+
+def start_version_gc(interval: int = None):
+    """Starts (once per process) a daemon thread running gc_versions and draft expiry every `interval` seconds."""
+    global _gc_thread
+    interval = settings.version_gc_interval if interval is None else interval
+    if interval <= 0 or (_gc_thread and _gc_thread.is_alive()):
+        return _gc_thread
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                gc_versions()
+                scraibe.purge_expired_drafts()
+            except Exception as e:
+                print(f"Version GC failed: {e}")
+
+    _gc_thread = threading.Thread(target=run, name="scraibe-version-gc", daemon=True)
+    _gc_thread.start()
+    return _gc_thread
+
+
+
+def rollback_section(filename: str, section_id: str, timestamp: str, author: str, user: str = None):
+    """Restores a previous version of a section.
+
+    The version is the one saved by `author` at `timestamp`; the rollback is
+    saved, and checked against the locks, as `user` (the author by default).
+    """
+    user = user or author
     original_content = scraibe.load_section(filename, section_id)    
-    version_filename = f'{VERSION_DIR}/{os.path.basename(filename)}/{os.path.basename(filename)}.section_{section_id}.{timestamp}.{user}.md'
-    if not os.path.exists(version_filename):
-        raise FileNotFoundError(f'No version found for section {section_id} at {timestamp}')    
-    with open(version_filename, 'r', encoding='utf-8') as f:
-        rollback_content = f.read()
+    rollback_content = read_version(filename, section_id, timestamp, author)
 
     if original_content.split() == rollback_content.split():
         # Nothing to do, same thing
         return timestamp
 
-    return scraibe.save_section(filename, section_id, user, rollback_content)
+    # A rollback is a deliberate point in history, never merged into a previous save
+    return scraibe.save_section(filename, section_id, user, rollback_content, coalesce=False)
+
+
+JOURNAL_FIELDS = ('filename', 'section_id', 'timestamp', 'user', 'content')
+
+class VersionWriter:
+    """Write-behind queue for section versions.
+
+    Versions are handed to a worker thread that persists them in batches:
+    each batch is appended to a journal with a single fsync and then written
+    as regular version files. The journal is replayed if the process died
+    before its versions reached the disk, and the queue is flushed at exit.
+
+    The writer holds an flock on its journal, so replaying tells a live
+    writer from a dead one even when the dead one's PID was reused.
+    """
+    JOURNAL_CHECKPOINT_BYTES = 1024 * 1024
+
+    def __init__(self, batch_size: int = 64, batch_delay: float = 0.05):
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._queue = queue.Queue()
+        self._pending = {}  # version path -> record, until the file is written
+        self._lock = threading.Condition()
+        self._thread = None
+        self._journal = None
+        self._nonce = os.urandom(4).hex()  # Writers of the same process keep apart journals
+
+    @property
+    def journal_path(self):
+        return os.path.join(VERSION_DIR, f'.journal.{os.getpid()}.{self._nonce}.jsonl')
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            replay_version_journals()
+            self._thread = threading.Thread(target=self._run, name="scraibe-version-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, filename: str, section_id: str, timestamp: str, user: str, content: str) -> threading.Event:
+        """Queues a version; the returned event is set once it is persisted."""
+        self.start()
+        record = {
+            'filename': filename, 'section_id': section_id, 'timestamp': timestamp,
+            'user': user, 'content': content, 'persisted': threading.Event(),
+        }
+        with self._lock:
+            self._pending[version_path(filename, section_id, timestamp, user)] = record
+        self._queue.put(record)
+        return record['persisted']
+
+    def pending(self, filename: str) -> list:
+        """Queued versions of a document as (section_id, timestamp, user)."""
+        with self._lock:
+            return [(r['section_id'], r['timestamp'], r['user']) for r in self._pending.values() if r['filename'] == filename]
+
+    def pending_content(self, path: str):
+        with self._lock:
+            record = self._pending.get(path)
+        return record['content'] if record else None
+
+    def discard(self, path: str) -> bool:
+        """Drops a queued version before it is written. False if it was not queued."""
+        with self._lock:
+            record = self._pending.pop(path, None)
+            if record is None:
+                return False
+            record['discarded'] = True
+            self._lock.notify_all()
+            return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Blocks until every queued version is persisted. False on timeout."""
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._pending, timeout)
+
+    def close(self):
+        """Flushes the queue, stops the worker and checkpoints the journal."""
+        if not self._thread:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._checkpoint()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            batch = [record]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._queue.put(None)  # Stop after this batch
+                    break
+                batch.append(record)
+            try:
+                self._persist(batch)
+            except Exception as e:
+                print(f"Version writer failed, {len(batch)} versions kept in memory: {e}")
+                time.sleep(1)
+                for record in batch:
+                    self._queue.put(record)
+
+    def _persist(self, batch: list):
+        os.makedirs(VERSION_DIR, exist_ok=True)
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+            if fcntl:
+                fcntl.flock(self._journal.fileno(), fcntl.LOCK_EX)
+        for record in batch:
+            self._journal.write(json.dumps({k: record[k] for k in JOURNAL_FIELDS}) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+        # Writing under the lock keeps discard() atomic with respect to the worker
+        with self._lock:
+            for record in batch:
+                path = version_path(record['filename'], record['section_id'], record['timestamp'], record['user'])
+                if not record.get('discarded'):
+                    _write_version_record(record)
+                if self._pending.get(path) is record:
+                    self._pending.pop(path)
+                _version_index.pop(record['filename'], None)
+                record['persisted'].set()
+            self._lock.notify_all()
+
+        if self._journal.tell() > self.JOURNAL_CHECKPOINT_BYTES:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """Makes the written version files durable, then drops the journal."""
+        if self._journal is None:
+            return
+        os.sync()
+        os.remove(self.journal_path)  # Before closing, which releases the flock
+        self._journal.close()
+        self._journal = None
+
+
+def _write_version_record(record: dict):
+    os.makedirs(f"{VERSION_DIR}/{record['filename']}", exist_ok=True)
+    with open(version_path(record['filename'], record['section_id'], record['timestamp'], record['user']), 'w', encoding='utf-8') as f:
+        f.write(record['content'])
+
+def replay_version_journals() -> int:
+    """Writes the versions left in journals of processes that are gone. Returns how many."""
+    replayed = 0
+    for journal in glob.glob(os.path.join(VERSION_DIR, '.journal.*.jsonl')):
+        try:
+            f = open(journal, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            continue  # Checkpointed meanwhile
+        with f:
+            if not _journal_abandoned(journal, f):
+                continue
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # Torn last line, that batch was never confirmed
+                path = version_path(record['filename'], record['section_id'], record['timestamp'], record['user'])
+                if not os.path.exists(path) or os.path.getsize(path) != len(record['content'].encode('utf-8')):
+                    _write_version_record(record)
+                    _version_index.pop(record['filename'], None)
+                    replayed += 1
+            os.sync()
+            os.remove(journal)
+    return replayed
+
+def _journal_abandoned(journal: str, f) -> bool:
+    """True if no live writer holds the journal: its flock is free, or without flock its process is gone."""
+    if fcntl:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return os.fstat(f.fileno()).st_nlink > 0  # Not checkpointed meanwhile
+        except BlockingIOError:
+            return False
+    pid = int(os.path.basename(journal).split('.')[2])
+    return pid == os.getpid() or not _process_alive(pid)
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def flush_versions(timeout: float = VERSION_FLUSH_TIMEOUT) -> bool:
+    """Waits until every queued version is on disk (no-op without write-behind). False on timeout."""
+    return version_writer.flush(timeout)
+
+version_writer = VersionWriter()
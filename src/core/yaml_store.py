@@ -0,0 +1,112 @@
+import os
+import yaml
+import atexit
+import threading
+from copy import deepcopy
+
+# libyaml's C loader and dumper are several times faster than the pure-Python ones
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAMLDumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
+# Saves of a store within this many seconds reach the disk as one write
+WRITE_DELAY = 0.05
+
+def read_yaml(path: str):
+    """Parses a YAML file. Raises FileNotFoundError like open()."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=YAMLLoader)
+
+def write_yaml(path: str, data):
+    """Replaces a YAML file atomically: readers see either the old or the new content."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        yaml.dump(data, f, Dumper=YAMLDumper)
+    os.replace(temp_path, path)
+
+class YAMLStore:
+    """A YAML file kept parsed in memory until it changes on disk.
+
+    load() costs one stat() while the file's (mtime_ns, size) is unchanged.
+    The object it returns is shared by every caller: change a copy
+    (load(copy=True)) and save() it. Saves in a burst are written once,
+    WRITE_DELAY seconds after the first, with write_yaml(); until then
+    load() returns the saved object.
+    """
+
+    def __init__(self, path: str, write_delay: float = WRITE_DELAY):
+        self.path = path
+        self.write_delay = write_delay
+        self._lock = threading.RLock()
+        self._key = None  # (mtime_ns, size) of the file the cached data was read from or written to
+        self._data = None
+        self._dirty = False
+        self._timer = None
+
+    def load(self, default=None, copy: bool = False):
+        """The parsed file, or `default` if it does not exist or is empty."""
+        with self._lock:
+            if not self._dirty:
+                try:
+                    stat = os.stat(self.path)
+                except FileNotFoundError:
+                    self._key = self._data = None
+                    return default
+                key = (stat.st_mtime_ns, stat.st_size)
+                if key != self._key:
+                    self._data = read_yaml(self.path)
+                    self._key = key
+            data = self._data
+        if data is None:
+            return default
+        return deepcopy(data) if copy else data
+
+    def save(self, data, delay: float = None):
+        """Stores `data`; it reaches the disk after `delay` seconds (default write_delay), 0 writes now."""
+        delay = self.write_delay if delay is None else delay
+        with self._lock:
+            self._data = data
+            self._dirty = True
+            if delay <= 0:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return True
+
+    def flush(self):
+        """Writes a pending save now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            write_yaml(self.path, self._data)
+            stat = os.stat(self.path)
+            self._key = (stat.st_mtime_ns, stat.st_size)
+            self._dirty = False
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def yaml_store(path: str) -> YAMLStore:
+    """The process-wide store of a file (relative paths follow the working directory)."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = YAMLStore(path)
+        return store
+
+def flush_yaml_stores():
+    """Writes the pending saves of every store, e.g. before the process exits."""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.flush()
+
+atexit.register(flush_yaml_stores)
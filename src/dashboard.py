@@ -50,7 +50,7 @@ if __name__ == "__main__":
     if app_users.Im_logged_in():
 
         
-        filtered_docs = list(app_docs.filter_documents_for_user(app_users.user()))
+        filtered_docs = list(app_docs.documents_of_user(app_users.user()))
         if filtered_docs:
             with st.expander("Your documents", expanded=True):
                 selected_file = st.selectbox("Choose a document to continue editing", [""] + filtered_docs)
@@ -80,7 +80,7 @@ if __name__ == "__main__":
         st.subheader("Don't have an user yet?")
         app_users.render_create_user()
 
-    # Check if no users exist in the YAML file
-    if not app_users.load_users():
+    # Check if no users exist yet
+    if not app_users.has_users():
         app_users.render_create_admin()
             
\ No newline at end of file
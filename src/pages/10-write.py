@@ -1,5 +1,6 @@
 import os 
 import time
+from datetime import datetime
 import streamlit as st
 import streamlit.components.v1 as components
 from streamlit_extras.stylable_container import stylable_container 
@@ -24,11 +25,7 @@ def document_sanity_check(document_content):
         scraibe.save_document(document_filename, document_content)
         app_utils.notify("Markdown was repaired")
 
-# @st.cache_data(ttl=2)
-def is_section_locked(document_filename, section_id):
-    return scraibe.is_section_locked(document_filename, section_id)
-
-def render_view_section(document_filename, document_content, section_id, user_current):
+def render_view_section(document_filename, document_content, section_id, user_current, last_edited=None, lock=None):
     global st_sidebar
     active_id = app_docs.editing_section_id()
     
@@ -42,13 +39,18 @@ def render_view_section(document_filename, document_content, section_id, user_cu
                 #     app_utils.scroll_to_here()
                 #     del(st.session_state['last_active_id'])
                 section_content = scraibe.extract_section(document_content, section_id)
-                st.markdown(section_content.strip())
+                if st.session_state.get("show_blame"):
+                    render_section_blame(document_filename, section_id)
+                else:
+                    st.markdown(section_content.strip())
+                if last_edited:
+                    st.caption(f"✎ Last edited by {last_edited['user']}, {app_utils.time_ago(last_edited['timestamp'])}")
             
     # Action buttons
     # ----------
     with cols[1]:
         with st.container(border=False):
-            lock_user = is_section_locked(document_filename, section_id)
+            lock_user = lock['user'] if lock else False
 
             # Display locked status or unlock if the current user is the locker.
             if lock_user:
@@ -73,6 +75,21 @@ def render_view_section(document_filename, document_content, section_id, user_cu
                     app_docs.set_selected_section_id(new_selected_id)
 
 
+def render_section_blame(document_filename, section_id):
+    """Each line of the section with the user and date of the version that wrote it."""
+    rows = []
+    for entry in scraibe.blame(document_filename, section_id):
+        when = datetime.strptime(entry["timestamp"], "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M") if entry["timestamp"] else ""
+        rows.append({"User": entry["user"] or "original", "Date": when, "Line": entry["line"]})
+    st.dataframe(rows, hide_index=True, use_container_width=True)
+
+
+@st.fragment(run_every=settings.lock_heartbeat_seconds)
+def render_lock_heartbeat(document_filename, section_id, user_current):
+    """Renews the lease on the section while its editor stays open."""
+    if not scraibe.renew_lock(document_filename, section_id, user_current, session_id=app_utils.session_id()):
+        st.warning(f"Your lock on this section expired. Locked now by: {scraibe.is_section_locked(document_filename, section_id) or 'nobody'}")
+
 def render_edit_section(document_filename, document_content, active_id, user_current, sidebar):
     if not app_users.can_edit():
         return
@@ -84,32 +101,82 @@ def render_edit_section(document_filename, document_content, active_id, user_cur
     st.session_state['last_active_id'] = active_id
 
     app_utils.scroll_to_here()
-    if not scraibe.lock_section(document_filename, active_id, user_current):
-        app_docs.set_editing_section_id(False)
-        app_utils.notify(f'Section already locked by {scraibe.is_section_locked(document_filename, active_id)}', switch=__file__)
+    if not settings.lock_free_editing:
+        if not scraibe.lock_section(document_filename, active_id, user_current, session_id=app_utils.session_id()):
+            app_docs.set_editing_section_id(False)
+            app_utils.notify(f'Section already locked by {scraibe.is_section_locked(document_filename, active_id)}', switch=__file__)
+        render_lock_heartbeat(document_filename, active_id, user_current)
 
     # The Editor
     # --------
     section_content = scraibe.extract_section(document_content, active_id)
 
+    # The editor starts from the unsaved draft, if any. Decided once per
+    # editing session, so autosaving the draft does not reset the editor.
+    start_key = f'editor_start_{document_filename}_{active_id}'
+    if start_key not in st.session_state:
+        start = {'content': section_content, 'base_hash': scraibe.content_hash(section_content), 'base_text': section_content, 'message': None}
+        draft = scraibe.load_draft(document_filename, active_id, user_current)
+        if draft and draft['content'].strip() != section_content.strip():
+            start['content'] = draft['content']
+            start['base_hash'] = draft.get('base_hash')
+            start['base_text'] = draft.get('base_text')
+            start['message'] = f"Restored your unsaved draft from {app_utils.time_ago(str(draft['saved_at']))}."
+            if start['base_hash'] != scraibe.content_hash(section_content):
+                start['message'] += " The section was changed by someone else since, review it before saving."
+        st.session_state[start_key] = start
+    start = st.session_state[start_key]
+    if start['message']:
+        st.info(start['message'], icon="📝")
+
     # document_html = mistune.markdown(section_content)
-    document_html = scraibe.to_html(section_content)
+    document_html = scraibe.to_html(start['content'])
     quill_output = st_quill(
         value=document_html,
         html=True,
         toolbar=app_utils.QUILL_MARKDOWN_TOOLBAR,
-        preserve_whitespace=False
+        preserve_whitespace=False,
+        key=f"quill_{active_id}_{start.get('revision', 0)}"
         )
     new_html = app_utils.fix_quill_nested_lists( quill_output )
     new_markdown = markdownify.markdownify(new_html, heading_style='ATX', strip=['br'], bullets="*", newline_style="<br />")
-    
+
+    # Autosave only overwrites the draft; a version is created on Save
+    if section_content.strip() != new_markdown.strip():
+        scraibe.save_draft(document_filename, active_id, user_current, new_markdown, base_hash=start['base_hash'], base_text=start.get('base_text'))
+
     # Buttons
     # ------
     cols = st.columns(2)
     with cols[0]:
         if st.button("Save"):
             if section_content.strip() != new_markdown.strip():
-                scraibe.save_section(document_filename, active_id, user_current, new_markdown)
+                try:
+                    if settings.lock_free_editing:
+                        # Merged with whatever was saved since the editor opened
+                        scraibe.save_section(document_filename, active_id, user_current, new_markdown,
+                                             base_hash=start['base_hash'], base_text=start.get('base_text'))
+                    else:
+                        # Checked against the section lock held by this editor
+                        scraibe.save_section(document_filename, active_id, user_current, new_markdown)
+                except scraibe.SectionConflictError as e:
+                    # Reopen the editor on the merged text, conflicts between markers
+                    scraibe.save_draft(document_filename, active_id, user_current, e.merged, base_hash=e.current_hash, base_text=e.current)
+                    st.session_state[start_key] = {
+                        'content': e.merged,
+                        'base_hash': e.current_hash,
+                        'base_text': e.current,
+                        'revision': start.get('revision', 0) + 1,
+                        'message': f"{len(e.conflicts)} of your changes overlap with changes saved meanwhile. "
+                                   f"Keep one side of each {scraibe.CONFLICT_START} ... {scraibe.CONFLICT_END} block and save again.",
+                    }
+                    st.rerun()
+                except PermissionError as e:
+                    # The lease ran out and another user locked the section; the draft is kept
+                    app_utils.notify(str(e))
+                    return
+            scraibe.discard_draft(document_filename, active_id, user_current)
+            st.session_state.pop(start_key, None)
             scraibe.unlock_section(document_filename, active_id, user_current)
             app_docs.set_editing_section_id(False)
             if section_content.strip() != new_markdown.strip():
@@ -120,6 +187,8 @@ def render_edit_section(document_filename, document_content, active_id, user_cur
     with cols[1]:
         if st.button("Cancel editing"):
             def cancel_editing():
+                scraibe.discard_draft(document_filename, active_id, user_current)
+                st.session_state.pop(start_key, None)
                 scraibe.unlock_section(document_filename, active_id, user_current)
                 app_docs.set_editing_section_id(False)
                 st.rerun()
@@ -204,11 +273,13 @@ def render_selected_section(document_content):
         cols = st.columns([4,1])
         AI_task = cols[0].selectbox('AI section', AI_section_toolslist, label_visibility="collapsed", key=f"AI_section_{section_id}")
         if cols[1].button("💡"):
+            # Pressed again on a shown result: ask anew instead of the cached answer
+            refresh = bool(AI_task) and bool(scraibe.llm.remember(AI_task, section_id, document_filename))
             if AI_task == 'Analyse in context':
-                result = scraibe.llm.analyse_section_in_context(document_content, section_content)
+                result = scraibe.llm.analyse_section_in_context(document_content, section_content, refresh=refresh)
                 scraibe.llm.remember(AI_task, section_id, document_filename, result)
             elif AI_task == 'Suggest content':
-                result = scraibe.llm.suggest_section_content(document_content, section_content)
+                result = scraibe.llm.suggest_section_content(document_content, section_content, refresh=refresh)
                 scraibe.llm.remember(AI_task, section_id, document_filename, result)
         
         if AI_task != '':
@@ -218,8 +289,42 @@ def render_selected_section(document_content):
                     st.write("Press 💡 to execute")
                 else:
                     st.write(result)
+
+        with st.expander("🕓 Section history"):
+            render_section_history(document_filename, section_id)
                 
     st_sidebar.markdown("---")
+
+
+def render_section_history(document_filename, section_id, page_size=10):
+    """Paginated list of the versions of a section, with an optional author filter."""
+    pages_key = f"history_pages_{document_filename}_{section_id}"
+    user_filter = st.text_input("Filter by user", key=f"history_user_{section_id}", placeholder="Any user")
+    if st.session_state.get(f"{pages_key}_filter") != user_filter:
+        st.session_state[f"{pages_key}_filter"] = user_filter
+        st.session_state[pages_key] = 1
+
+    next_cursor = None
+    for _ in range(st.session_state.get(pages_key, 1)):
+        versions, next_cursor = scraibe.get_version_history_page(
+            document_filename, section_id, limit=page_size, cursor=next_cursor, user=user_filter or None)
+        for version in versions:
+            when = datetime.strptime(version["timestamp"], "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+            cols = st.columns([4, 1])
+            cols[0].markdown(f"`{when}` {version['user']}")
+            if app_users.can_edit() and cols[1].button("↩", key=f"rollback_{section_id}_{version['timestamp']}_{version['user']}", help="Rollback to this version"):
+                try:
+                    scraibe.rollback_section(document_filename, section_id, version["timestamp"], version["user"], user_current)
+                except (PermissionError, FileNotFoundError) as e:
+                    app_utils.notify(str(e))
+                else:
+                    app_utils.notify(f"Section rolled back to {when}")
+        if not next_cursor:
+            break
+
+    if next_cursor and st.button("More", key=f"history_more_{section_id}"):
+        st.session_state[pages_key] = st.session_state.get(pages_key, 1) + 1
+        st.rerun()
     
 
 def render_AI_document_tools(*args, **kwargs):
@@ -231,6 +336,7 @@ def render_AI_document_tools(*args, **kwargs):
     tablist = {
         "Grammar": app_ai.render_review_grammar,
         "Content Assessment" : app_ai.render_content_assessment,
+        "Sections": app_ai.render_sections_analysis,
         "Questions": app_ai.render_none,
         "Configure AI": app_ai.render_configure_AI,
     }
@@ -247,6 +353,26 @@ def render_AI_document_tools(*args, **kwargs):
 
 
 
+def render_document_history(document_filename):
+    """Time slider to read the whole document as it was at a given moment."""
+    index = scraibe.get_version_index(document_filename)
+    timestamps = sorted({timestamp for versions in index.values() for timestamp, _ in versions})
+    if not timestamps:
+        st.info("No versions saved yet.")
+        return
+
+    def label(timestamp):
+        return datetime.strptime(timestamp, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+
+    selected = timestamps[-1] if len(timestamps) == 1 else st.select_slider(
+        "Document as of", options=timestamps, value=timestamps[-1], format_func=label, key=f"history_at_{document_filename}")
+    stats = scraibe.version_stats(document_filename)
+    st.caption(f"As of {label(selected)}" + (f" · {stats['coalesced']} of {stats['saved']} recent saves merged into the previous version" if stats['coalesced'] else ""))
+    content = scraibe.load_document_at(document_filename, selected)
+    with st.container(border=True):
+        st.markdown(scraibe.remove_section_markers(content))
+
+
 def render_download_options():
     import tempfile
     from markdown_pdf import MarkdownPdf, Section
@@ -318,7 +444,7 @@ if __name__ == "__main__":
 
     # All good, let's show it
     document_filename = app_docs.active_document()
-    document_meta = app_docs.filter_documents_for_user(user_current).get(document_filename)        
+    document_meta = scraibe.registry.get_document(document_filename)
     document_content = scraibe.load_document(document_filename)
     document_sections = scraibe.list_sections(document_content)
     
@@ -334,6 +460,7 @@ if __name__ == "__main__":
         document_sanity_check(document_content)
 
     editing_section_id = app_docs.editing_section_id()
+    st_sidebar.toggle("👤 Show who wrote each line", key="show_blame")
     
     scraibe.llm.role = document_meta.get("role", scraibe.llm.role)
 
@@ -435,17 +562,22 @@ if __name__ == "__main__":
         """ ):
         with st.expander(document_filename, expanded=True):
 
+            last_edited = scraibe.get_last_edited(document_filename)
+            document_locks = scraibe.get_document_locks(document_filename)
             for section_id in document_sections:
                 st.markdown(f'<div id="section{section_id}"></div>', unsafe_allow_html=True)
                 if editing_section_id == section_id:
                     render_edit_section(document_filename, document_content, section_id, user_current, st_sidebar)
                 else:
-                    render_view_section(document_filename, document_content, section_id, user_current)
+                    render_view_section(document_filename, document_content, section_id, user_current, last_edited.get(section_id), document_locks.get(section_id))
 
     with st.expander("💡 AI Writting Tools"):
         render_AI_document_tools(document_content=document_content)
 
     
+    with st.expander("🕓 Document history"):
+        render_document_history(document_filename)
+
     with st.expander("Download formats"):
         render_download_options()
 
@@ -26,12 +26,6 @@ def infer_section_id(content, original):
     
     return None  # Return None if no match is found
 
-@st.cache_data(ttl=3600)
-def llm_grammar(content):
-    result = scraibe.llm.review_grammar(content)
-    return result
-
-
 #
 # Renders for Streamlit
 # ---------------------
@@ -68,21 +62,49 @@ def render_configure_AI(*args, **kwargs) -> None:
         
         if st.form_submit_button("Submit"):
             filename = app_docs.active_document()
-            docs = app_docs.load_documents()
-            docs["documents"][filename]["role"] = scraibe.llm.role
-            docs["documents"][filename]["purpose"] = scraibe.llm.purpose
-            docs["documents"][filename]["lang"] = scraibe.llm.lang
-            # st.write(docs["documents"][filename])
-            app_docs.save_documents(docs)
+            scraibe.registry.update_ai_config(filename, role=scraibe.llm.role, purpose=scraibe.llm.purpose, lang=scraibe.llm.lang)
             st.info("Configuration saved")
         
 
+def render_sections_analysis(*args, **kwargs) -> None:
+    """Runs a section tool on every section at once, showing each result as it arrives."""
+    filename = app_docs.active_document()
+    document_content = kwargs['document_content']
+    tasks = {'Analyse in context': 'analyse', 'Suggest content': 'suggest'}
+
+    cols = st.columns([4, 1])
+    AI_task = cols[0].selectbox("Section tool", list(tasks), label_visibility="collapsed", key="AI_all_sections")
+    run = cols[1].button("💡 All sections")
+
+    section_ids = scraibe.list_sections(document_content)
+    placeholders = {}
+    for section_id in section_ids:
+        section_content = scraibe.extract_section(document_content, section_id)
+        title = section_content.replace("#", "").strip().splitlines()[0] if section_content.strip() else section_id
+        st.markdown(f"**{title}**")
+        placeholders[section_id] = st.empty()
+        result = scraibe.llm.remember(AI_task, section_id, filename)
+        placeholders[section_id].write(result or "...")
+
+    if run:
+        sections = {section_id: scraibe.extract_section(document_content, section_id) for section_id in section_ids}
+        progress = st.progress(0.0, text="Let AI think ...")
+        for done, (section_id, result) in enumerate(scraibe.llm.analyse_sections(document_content, sections, task=tasks[AI_task]), 1):
+            if isinstance(result, Exception):
+                placeholders[section_id].error(f"Failed: {result}")
+            else:
+                scraibe.llm.remember(AI_task, section_id, filename, result)
+                placeholders[section_id].write(result)
+            progress.progress(done / len(sections), text=f"{done} of {len(sections)} sections")
+        progress.empty()
+
+
 def render_review_grammar(*args, **kwargs) -> None:
     filename = app_docs.active_document()
     document_content = kwargs['document_content']
     if st.button("Review Grammar and Spelling"):
         with st.spinner("Let AI think ..."):
-            json_result = scraibe.llm.review_grammar(document_content)#llm_grammar(content)
+            json_result = scraibe.llm.review_grammar(document_content)  # Cached in scraibe.llm_cache
         set_ai_result('grammar', json_result)
     
     for entry in ai_result('grammar'):
@@ -124,7 +146,7 @@ def render_content_assessment(*args, **kwargs) -> None:
     document_content = kwargs['document_content']
     if st.button("Content Assessment"):
         with st.spinner("Let AI think ..."):
-            json_result = scraibe.llm.extract_content_assessment(document_content)#llm_grammar(content)
+            json_result = scraibe.llm.extract_content_assessment(document_content)
         set_ai_result('Assessment', json_result)
     
     criteria = ai_result('Assessment')
@@ -1,7 +1,5 @@
 import streamlit as st
-import yaml
 import os
-from datetime import datetime
 import pandas as pd
 from src.st_include import app_utils
 from src.st_include import app_users
@@ -12,45 +10,19 @@ import src.core as scraibe
 # TODO: Split pure docs functions and streamlit frontend functions
 
 
-# YAML file for document metadata
-DOC_DB = "documents.yaml"
-
-def load_documents():
-    """Load document metadata from YAML file."""
-    if os.path.exists(DOC_DB):
-        with open(DOC_DB, "r") as file:
-            data = yaml.safe_load(file) or {}
-            if "documents" not in data:
-                data["documents"] = {}
-            return data
-    return {"documents": {}}
-
-def save_documents(documents):
-    """Save document metadata to YAML file."""
-    with open(DOC_DB, "w") as file:
-        yaml.dump(documents, file)
-    return True
+# Document metadata lives in the SQLite registry (see src/core/registry.py),
+# imported once from the former documents.yaml
+DOC_DB = scraibe.REGISTRY_DB
 
 def add_document(filename, creator, lang=None, purpose=None, role=None, document_content=""):
     """Add a new document. The creator is stored as the owner with fixed rights."""
-    docs = load_documents()
     if not filename.endswith(".md"):
         filename += ".md"
 
-    if filename in docs["documents"]:
+    if scraibe.registry.get_document(filename):
         st.error("Document already exists!")
         return False
-    
 
-    docs["documents"][filename] = {
-        "creator": creator,
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "users": [{"name": creator, "permission": "creator", "display_name": creator}]
-    }
-    docs["documents"][filename]["lang"] = lang
-    docs["documents"][filename]["purpose"] = purpose
-    docs["documents"][filename]["role"] = role
-    
     if document_content == "":
         scraibe.llm.user_role = role
         scraibe.llm.purpose = purpose
@@ -67,72 +39,47 @@ def add_document(filename, creator, lang=None, purpose=None, role=None, document
             content = f"# {filename.replace('.md', '')}\n\n" + content
 
     content = scraibe.add_section_markers(content)
+    if not scraibe.registry.add_document(filename, creator, lang=lang, purpose=purpose, role=role):
+        st.error("Document already exists!")  # Created meanwhile by someone else
+        return False
     scraibe.save_document(filename, content)
-    save_documents(docs)
 
     return os.path.basename(scraibe.get_filename_path(filename))
 
 def update_document_permission_for_user(filename, username, permission, display_name=None):
     """Update the permission (and optionally display name) for a given user in a document."""
-    docs = load_documents()
-    if filename not in docs["documents"]:
+    try:
+        scraibe.registry.set_user_permission(filename, username, permission, display_name)
+    except KeyError:
         st.error("Document not found!")
         return False
-
-    users_list = docs["documents"][filename].get("users", [])
-    found = False
-
-    for entry in users_list:
-        if entry["name"] == username:
-            if entry["permission"] == "creator":
-                st.error("Cannot modify creator's permissions.")
-                return False
-            entry["permission"] = permission
-            if display_name:
-                entry["display_name"] = display_name
-            found = True
-            break
-
-    if not found and permission != "none":
-        new_entry = {"name": username, "permission": permission, "display_name": display_name or username}
-        users_list.append(new_entry)
-
-    docs["documents"][filename]["users"] = users_list
-    save_documents(docs)
+    except (PermissionError, scraibe.RegistryConflictError) as e:
+        st.error(str(e))
+        return False
     app_utils.notify(f"Permissions updated for {username} in document {filename}")
     return True
 
 def remove_user_permission(filename, username):
     """Remove a user from a document’s permissions (cannot remove the creator)."""
-    docs = load_documents()
-    if filename not in docs["documents"]:
+    try:
+        scraibe.registry.remove_user(filename, username)
+    except KeyError:
         st.error("Document not found!")
         return False
-
-    users_list = docs["documents"][filename].get("users", [])
-    new_list = []
-
-    for entry in users_list:
-        if entry["name"] == username:
-            if entry["permission"] == "creator":
-                st.error("Cannot remove the creator.")
-                return False
-            continue
-        new_list.append(entry)
-
-    docs["documents"][filename]["users"] = new_list
-    save_documents(docs)
+    except (PermissionError, scraibe.RegistryConflictError) as e:
+        st.error(str(e))
+        return False
     app_utils.notify(f"User {username} removed from document {filename}")
     return True
 
 # @st.cache_data(ttl=5)
 def filter_documents_for_user(username, remove_cache=False):
     """Return a dictionary of documents for which the given username is listed."""
-    all_docs = load_documents()["documents"]
-    return {
-        doc: meta for doc, meta in all_docs.items() 
-        if any(u["name"] == username for u in meta.get("users", []))
-        }
+    return scraibe.registry.documents_for_user(username)
+
+def documents_of_user(username):
+    """Return {document: permission} for the given username, without loading metadata."""
+    return scraibe.registry.permissions_for_user(username)
 
 #
 # File properties & checks
@@ -172,8 +119,7 @@ def selected_section_id():
 #
 def render_document_list():
     """Display a table with existing documents and their metadata."""
-    allowed_docs = filter_documents_for_user(app_users.user())
-    docs = load_documents()["documents"] 
+    docs = filter_documents_for_user(app_users.user())
     
     if not docs:
         st.info("No documents available.")
@@ -181,18 +127,18 @@ def render_document_list():
 
     rows = []
     for doc, meta in docs.items():
-        if doc in allowed_docs:
-            user_list_str = ", ".join([f"{u['display_name']}({u['permission']})" for u in meta.get("users", [])])
-            rows.append({"Document": doc, "Creator": meta.get("creator", ""), "Created At": meta.get("created_at", ""), "Users": user_list_str})
+        user_list_str = ", ".join([f"{u['display_name']}({u['permission']})" for u in meta.get("users", [])])
+        rows.append({"Document": doc, "Creator": meta.get("creator", ""), "Created At": meta.get("created_at", ""), "Users": user_list_str})
 
     df = pd.DataFrame(rows)
     st.dataframe(df, hide_index=True, use_container_width=True)
 
 def render_grant_permissions(doc_to_manage, doc_meta, key_prefix, button_label):
     """Render UI to grant permissions for adding a new user."""
-    all_users = app_users.load_users()
+    search = st.text_input(label="Search users", key=f"{key_prefix}_search")
     current_doc_users = [u["name"] for u in doc_meta.get("users", [])]
-    available_users = [u for u in all_users.keys() if u not in current_doc_users]
+    candidates = scraibe.user_directory.names(search, limit=200 + len(current_doc_users))
+    available_users = [u for u in candidates if u not in current_doc_users]
 
     if available_users:
         col1, col2, col3 = st.columns([3, 3, 3])
@@ -417,9 +363,7 @@ def render_document_management():
                     if current_user == filtered_docs[doc_to_delete]["creator"]:
                         if st.button(label="Delete Document"):
                             def delete_doc():
-                                docs = load_documents()
-                                del docs["documents"][doc_to_delete]
-                                save_documents(docs)
+                                scraibe.registry.delete_document(doc_to_delete)
                                 scraibe.delete_document(doc_to_delete)
                             app_utils.confirm_action("Delete this document?", delete_doc)
                     else:
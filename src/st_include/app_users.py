@@ -1,30 +1,26 @@
 import streamlit as st
-import yaml
-import os
+import streamlit.components.v1 as components
 import hashlib
 import pandas as pd
 import time
 from src.st_include import app_utils
 from src.st_include import app_docs
+import src.core as scraibe
 from datetime import datetime
+from settings import settings
 
-# Load users from YAML
-USER_DB = "users.yaml"
+# User accounts live in the registry database (see src/core/users.py),
+# imported once from the former users.yaml
+USER_DB = scraibe.REGISTRY_DB
 
 
-def load_users():
-    """Load user data from YAML file."""
-    if os.path.exists(USER_DB):
-        with open(USER_DB, "r") as file:
-            return yaml.safe_load(file) or {}
-    return {}
+def get_user(username):
+    """The account {'name', 'password', 'role', 'last_login'} of a user, or None."""
+    return scraibe.user_directory.get(username)
 
 
-def save_users(users):
-    """Save user data to YAML file."""
-    with open(USER_DB, "w") as file:
-        yaml.dump(users, file)
-    return True
+def has_users():
+    return scraibe.user_directory.count() > 0
 
 
 def hash_password(password):
@@ -33,90 +29,61 @@ def hash_password(password):
 
 def delete_user(username):
     """Delete a user from the system."""
-    users = load_users()
-    if username in users:
-
-        current_role = users[username].get("role", "user")
-        if current_role == "admin":
-            admin_users = [user for user, data in users.items() if data.get("role") == "admin"]
-            if len(admin_users) == 1:
-                app_utils.notify("Cannot delete user. At least one admin must remain.")
-                return
-
-        del users[username]
-        save_users(users)
-        return True
-        app_utils.notify(f"User {username} deleted.", switch="dashboard.py")  # TODO: move outside
-    else:
+    try:
+        scraibe.user_directory.delete(username)
+    except KeyError:
         return False
         st.error("User not found!")  # TODO: move outside
+    except PermissionError as e:
+        app_utils.notify(str(e))
+        return
+    return True
+    app_utils.notify(f"User {username} deleted.", switch="dashboard.py")  # TODO: move outside
 
 def add_user(username, password, role="user"):
     """Add a new user to the system."""
-    users = load_users()
     username = username.strip()
-    
-    if username in users:
+
+    if not scraibe.user_directory.add(username, hash_password(password), role):
         st.error("User already exists!")  # TODO: move outside
         return False
-
-    users[username] = {
-        "password": hash_password(password),
-        "role": role,
-        "last_login": None
-    }
-    
-    return save_users(users)
+    return True
     
 
 def update_role(username, new_role):
     """Update a user's role with checks in place to ensure at least one admin remains."""
-    users = load_users()
     username = username.strip()
-
-    # Check if the user exists
-    if username not in users:
+    try:
+        scraibe.user_directory.set_role(username, new_role)
+    except KeyError:
         app_utils.notify("User not found!")
         return
-
-    # Ensure at least one admin remains
-    current_role = users[username].get("role", "user")
-    if current_role == "admin":
-        admin_users = [user for user, data in users.items() if data.get("role") == "admin"]
-        if len(admin_users) == 1 and new_role != "admin":
-            app_utils.notify("Cannot change role. At least one admin must remain.")
-            return
-
-    # Update the user's role
-    users[username]["role"] = new_role
-    save_users(users)
+    except (PermissionError, ValueError) as e:
+        app_utils.notify(str(e))
+        return
     app_utils.notify(f"Role updated to {new_role} for {username}")
     return
 
 
 def update_password(username, new_password):
     """Update a user's password."""
-    users = load_users()
-    if username in users:
-        users[username]["password"] = hash_password(new_password)
-        save_users(users)
-        app_utils.notify(f"Password updated for {username}")
-    else:
+    try:
+        scraibe.user_directory.set_password(username, hash_password(new_password))
+    except KeyError:
         st.error("User not found!")  # TODO: move outside
+        return
+    app_utils.notify(f"Password updated for {username}")
 
 
 def reset_password(username):
     """Reset user password (Admin only or self)."""
-    users = load_users()
-    
-    if username not in users:
+    if get_user(username) is None:
         st.error("User does not exist!")  # TODO: move outside
         return False
     
     new_password = st.text_input("Enter new password", type="password")  # TODO: move outside
     if st.button("Confirm Reset"):  # TODO: move outside
-        users[username]["password"] = hash_password(new_password)
-        save_users(users)
+        scraibe.user_directory.set_password(username, hash_password(new_password))
         st.success("Password updated successfully!")  # TODO: move outside
         return True
 
@@ -124,24 +91,80 @@ def reset_password(username):
 
 def do_login(username, password):
     """Authenticate user and start a session."""
-    users = load_users()
+    account = get_user(username)
 
-    if username not in users or users[username]["password"] != hash_password(password):
+    if account is None or account["password"] != hash_password(password):
         st.error("Invalid username or password!") 
 
     else:
         # Store session state
-        st.session_state["logged_in"] = True  # TODO: move outside
-        st.session_state["username"] = username  # TODO: move outside
-        st.session_state["role"] = users[username]["role"]  # TODO: move outside
+        _start_session(username, account["role"])
         
-        users[username]["last_login"] = datetime.now()  # Placeholder for real timestamp
-        save_users(users)
+        scraibe.user_directory.record_login(username, datetime.now())
 
         app_utils.notify(f"Welcome, {username}!")
         return True
 
 
+#
+# Session tokens
+# --------------
+#
+# A signed token kept in the session state, and in a cookie so the login
+# survives browser refreshes. It is never put in the URL, where a copied
+# link or the browser history would hand the login to someone else.
+# Reruns only check its signature; the account is read again only when the
+# registry generation it carries is outdated. Logging out or changing the
+# password bumps the user's token epoch (and so the generation), which
+# revokes the tokens issued before.
+
+SESSION_COOKIE = "scraibe_session"
+
+def _start_session(username, role, epoch=None):
+    if epoch is None:
+        epoch = scraibe.user_directory.token_epoch(username)
+    token = scraibe.issue_session_token(username, role, scraibe.registry.generation(), epoch=epoch)
+    st.session_state["logged_in"] = True  # TODO: move outside
+    st.session_state["username"] = username  # TODO: move outside
+    st.session_state["role"] = role  # TODO: move outside
+    st.session_state["session_token"] = token
+
+def resume_session():
+    """Restores or refreshes the login of this rerun from the session token."""
+    # The cookie only counts for a new browser session, not after a logout in this one
+    token = st.session_state.get("session_token", st.context.cookies.get(SESSION_COOKIE))
+    claims = scraibe.verify_session_token(token)
+    if claims is None:
+        if token or "logged_in" in st.session_state:
+            end_session()  # Expired or forged
+    elif claims["generation"] != scraibe.registry.generation():
+        # Users or permissions changed since the token was issued: re-read the account
+        account = get_user(claims["user"])
+        epoch = scraibe.user_directory.token_epoch(claims["user"])
+        if account is None or claims.get("epoch", 0) != epoch:
+            end_session()  # Deleted, logged out or password changed
+        else:
+            _start_session(account["name"], account["role"], epoch)
+    elif st.session_state.get("session_token") != token:
+        _start_session(claims["user"], claims["role"], claims.get("epoch", 0))
+    _render_session_cookie()
+
+def end_session():
+    for key in ("logged_in", "username", "role"):
+        st.session_state.pop(key, None)
+    st.session_state["session_token"] = None
+
+def _render_session_cookie():
+    """Stores the session token in a cookie of the page, or deletes it after a logout."""
+    token = st.session_state.get("session_token")
+    if st.context.cookies.get(SESSION_COOKIE) == token:
+        return
+    max_age = int(settings.session_ttl_hours * 3600) if token else 0
+    components.html(f"""<script>
+    parent.document.cookie = "{SESSION_COOKIE}={token or ''}; path=/; max-age={max_age}; SameSite=Strict";
+    </script>""", height=0)
+
+
 #
 # Quick Information 
 # -----------------
@@ -152,16 +175,8 @@ def _can_do_X(allowed_actions):
     if not filename or not Im_logged_in():
         return False
 
-    user_current = user()
-
-    if not f"perm_for_{''.join(allowed_actions)}_{user_current}_{filename}" in st.session_state:
-        document_meta = app_docs.filter_documents_for_user(user_current).get(filename)
-        if not document_meta:
-            return False
-
-        perm = next((user["permission"] for user in document_meta["users"] if user["name"] == user_current), False)
-        st.session_state["perm_for_{''.join(allowed_actions)}_{user_current}_{filename}"] = perm in allowed_actions
-    return st.session_state["perm_for_{''.join(allowed_actions)}_{user_current}_{filename}"]
+    # Cached per (user, document) until the registry changes, shared across reruns and sessions
+    return scraibe.registry.cached_permission(filename, user()) in allowed_actions
 
 def can_edit():
     return _can_do_X(['editor', 'creator'])
@@ -186,7 +201,10 @@ def user():
 
 def render_user_loggedin():
     if st.button(f"Logout {st.session_state['username']}"):
+        scraibe.release_session_locks(app_utils.session_id())
+        scraibe.user_directory.revoke_sessions(st.session_state['username'])
         st.session_state.clear()  # TODO: move outside
+        end_session()
         app_utils.notify("Logged out successfully!")
 
 def render_user_loggedout():
@@ -245,16 +263,17 @@ def render_change_my_password():
             st.error("New passwords do not match.")
             return
 
-        users = load_users()  # Load all users
         username = st.session_state.get("username")
+        account = get_user(username)
 
         # Check old password
-        if username not in users or users[username]["password"] != hash_password(old_password):
+        if account is None or account["password"] != hash_password(old_password):
             st.error("Old password is incorrect.")  # Feedback for incorrect old password
             return
 
-        # Update password if checks pass
+        # Update password if checks pass, revoking the other sessions but not this one
         update_password(username, new_password)
+        _start_session(username, account["role"])
         app_utils.notify("Password changed successfully.", switch="dashboard.py")
 
 def render_user_management():
@@ -263,33 +282,39 @@ def render_user_management():
         st.warning("You need admin access to manage users.")
         return
     
-    users = load_users()
+    total = scraibe.user_directory.count()
 
     tab = st.tabs(["User List", "User Management", "Add User"])
     with tab[0]:
 
         
-        if not users:
+        if not total:
             st.write("No users found.")
             return
 
-        # Convert user data to a DataFrame
-        df = pd.DataFrame.from_dict(users, orient="index")
-        df.reset_index(inplace=True)
-        df.rename(columns={"index": "Username", "role": "Role", "last_login": "Last Login"}, inplace=True)
-        
-        user_list = df['Username'].to_list()
+        # One page of the (filtered) users at a time
+        col1, col2 = st.columns([6, 2])
+        with col1:
+            search = st.text_input("Search users", key="users_search")
+        matching = scraibe.user_directory.count(search)
+        pages = max(1, -(-matching // scraibe.USERS_PAGE_SIZE))
+        with col2:
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key="users_page")
+
+        df = pd.DataFrame(scraibe.user_directory.page(page - 1, search=search), columns=["name", "role", "last_login"])
+        df.rename(columns={"name": "Username", "role": "Role", "last_login": "Last Login"}, inplace=True)
 
-        st.write("Existing users")
+        st.write(f"Existing users ({matching} of {total})" if search else f"Existing users ({total})")
         st.dataframe(df, hide_index=True, column_order=["Username", "Last Login", "Role"], use_container_width=True)
         
         
     with tab[1]:
-        selected_user = st.selectbox("Selected user", [""] + user_list)
+        user_list = scraibe.user_directory.names(search, limit=scraibe.USERS_PAGE_SIZE * 4)
+        selected_user = st.selectbox("Selected user", [""] + user_list, help="Filtered by the search of the user list")
 
         if selected_user != "":
             
-            selected_user_data = users[selected_user]
+            selected_user_data = get_user(selected_user)
             # st.write(selected_user_data)
 
             col1, col2, _ = st.columns([3, 3, 3])
@@ -339,18 +364,8 @@ def render_user_management():
         
         if st.button("Add User"):
             if username and password:
-                users = load_users()
-                if username not in users:
-                    users[username] = {
-                        "password": hash_password(password),
-                        "role": role,
-                        "last_login": None
-                    }
-                    if save_users(users):
-                        app_utils.notify(f"User {username} added successfully!", switch="dashboard.py")
-                    else:
-                        st.error("Something bad happened")
-                        
+                if scraibe.user_directory.add(username, hash_password(password), role):
+                    app_utils.notify(f"User {username} added successfully!", switch="dashboard.py")
                 else:
                     st.error("User already exists.")
             else:
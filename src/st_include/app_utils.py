@@ -1,10 +1,14 @@
 import streamlit as st
 import streamlit.components.v1 as components
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from bs4 import BeautifulSoup
 import time
 import src.st_include.app_users as app_users
 import src.st_include.app_docs as app_docs
+import src.core as scraibe
 import random
+from datetime import datetime
 
 import yaml
 import os
@@ -15,6 +19,10 @@ def render_sidebar(pagefilename):
     """Sidebar for login/logout and user actions."""         
     # global ph
     st.set_page_config(layout="wide", page_title="the scrAIbe")
+    _start_background_jobs()
+
+    # Login from the session token, checked on every rerun
+    app_users.resume_session()
 
     # Show notifications with notify(msg)
     _notify_show()
@@ -33,6 +41,23 @@ def render_sidebar(pagefilename):
     # ph = st.sidebar.container()
     return st_sidebar
                     
+@st.cache_resource
+def _start_background_jobs():
+    """Housekeeping threads, started once per server process."""
+    scraibe.replay_version_journals()
+    scraibe.start_version_gc()
+    scraibe.start_lock_sweeper(is_session_active=is_session_active)
+    return True
+
+def session_id():
+    """Id of the browser session running this script, tagged on the locks it takes."""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def is_session_active(session_id):
+    """Whether a browser session is still connected to this server."""
+    return Runtime.exists() and Runtime.instance().is_active_session(session_id)
+
 def notify(msg, switch=False):
     if 'notify_channel' not in st.session_state:
         st.session_state['notify_channel'] = [msg]
@@ -54,6 +79,16 @@ def _notify_show():
         
         
 
+def time_ago(timestamp):
+    """Human readable age of a YYYYmmddHHMMSS timestamp, e.g. '3 minutes ago'."""
+    seconds = int((datetime.now() - datetime.strptime(timestamp, "%Y%m%d%H%M%S")).total_seconds())
+    for unit, size in [("day", 86400), ("hour", 3600), ("minute", 60)]:
+        if seconds >= size:
+            count = seconds // size
+            return f"{count} {unit}{'s' if count > 1 else ''} ago"
+    return "just now"
+
+
 QUILL_MARKDOWN_TOOLBAR = [
     ["bold", "italic", "strike", "code"],  # Basic formatting
     [{"header": [1, 2, 3, 4, 5, 6, False]}],  # Headers (H1, H2, H3)
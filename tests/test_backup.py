@@ -0,0 +1,126 @@
+import os
+import io
+import sys
+import time
+import tarfile
+import threading
+import pytest
+import yaml
+import src.core as scraibe
+
+TEST_DOC = 'test_document.md'
+TEST_SECTION = '20250203153000_1'
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs each test in an empty data directory with one document and one version."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('documents')
+    with open(f'documents/{TEST_DOC}', 'w', encoding='utf-8') as f:
+        f.write(f">>>>>ID#{TEST_SECTION}\n# Introduction\nOriginal.\n<<<<<ID#{TEST_SECTION}\n")
+    with open('documents.yaml', 'w') as f:
+        yaml.dump({'documents': {TEST_DOC: {'creator': 'alice', 'users': []}}}, f)
+    scraibe.save_section_version(TEST_DOC, TEST_SECTION, 'alice', 'first version')
+    time.sleep(1.1)  # Backups stop one second in the past
+    return tmp_path
+
+def test_01_backup_and_restore():
+    manifest = scraibe.backup('full.tar.gz')
+    assert manifest['counts'] == {'documents': 1, 'versions': 1, 'locks': 0, 'metadata': 1}
+
+    scraibe.delete_document(TEST_DOC)
+    os.remove('documents.yaml')
+
+    report = scraibe.restore('full.tar.gz')
+    assert report['files'] == 4  # Document, version, last edited table, documents.yaml
+    assert report['manifest']['watermark'] == manifest['watermark']
+    assert 'Original.' in scraibe.load_document(TEST_DOC)
+    assert len(scraibe.get_version_history(TEST_DOC, TEST_SECTION)) == 1
+    assert os.path.exists('documents.yaml')
+
+def test_02_incremental_backup():
+    an_hour_ago = time.time() - 3600
+    os.utime(f'documents/{TEST_DOC}', (an_hour_ago, an_hour_ago))
+    scraibe.backup('full.tar.gz')
+    time.sleep(1.1)
+    scraibe.save_section_version(TEST_DOC, TEST_SECTION, 'bob', 'second version')
+    time.sleep(1.1)
+
+    manifest = scraibe.backup('incremental.tar.gz', incremental=True)
+    assert manifest['counts']['versions'] == 1
+    assert manifest['counts']['documents'] == 0
+
+    scraibe.delete_document(TEST_DOC)
+    scraibe.restore('full.tar.gz')
+    scraibe.restore('incremental.tar.gz')
+    assert [v['user'] for v in scraibe.get_version_history(TEST_DOC, TEST_SECTION)] == ['bob', 'alice']
+
+def test_03_restore_single_document():
+    with open('documents/other.md', 'w', encoding='utf-8') as f:
+        f.write("")
+    scraibe.backup('full.tar.gz')
+    scraibe.delete_document(TEST_DOC)
+    scraibe.delete_document('other.md')
+    with open('documents.yaml', 'w') as f:
+        yaml.dump({'documents': {'new.md': {'creator': 'carol', 'users': []}}}, f)
+
+    scraibe.restore('full.tar.gz', document=TEST_DOC)
+    assert os.path.exists(f'documents/{TEST_DOC}')
+    assert not os.path.exists('documents/other.md')
+    with open('documents.yaml') as f:
+        assert set(yaml.safe_load(f)['documents']) == {'new.md', TEST_DOC}
+
+def test_04_unexpected_members_are_skipped():
+    with tarfile.open('odd.tar.gz', mode='w:gz') as tar:
+        for name in ('documents', 'versions', '../outside.md'):
+            info = tarfile.TarInfo(name)
+            info.size = 1
+            tar.addfile(info, io.BytesIO(b'x'))
+
+    report = scraibe.restore('odd.tar.gz', document=TEST_DOC)
+    assert (report['files'], report['skipped']) == (0, 3)
+    assert os.path.isdir('documents') and not os.path.exists('../outside.md')
+
+def test_05_restore_registry_in_place():
+    scraibe.registry.put_documents({'kept.md': {'creator': 'alice', 'users': []}})
+    scraibe.backup('full.tar.gz')
+    scraibe.registry.put_documents({'later.md': {'creator': 'bob', 'users': []}})
+    generation = scraibe.registry.generation()
+
+    # Another thread keeps its connection open across the restore
+    opened, restored, seen = threading.Event(), threading.Event(), {}
+    def reader():
+        scraibe.registry.connection()
+        opened.set()
+        restored.wait(5)
+        seen['kept'] = scraibe.registry.get_document('kept.md')
+        seen['later'] = scraibe.registry.get_document('later.md')
+        scraibe.registry.close()
+    thread = threading.Thread(target=reader)
+    thread.start()
+    opened.wait(5)
+
+    scraibe.restore('full.tar.gz')
+    restored.set()
+    thread.join()
+    assert seen['kept'] is not None and seen['later'] is None
+    assert scraibe.registry.get_document('later.md') is None
+    assert scraibe.registry.generation() > generation
+    scraibe.registry.close()
+
+def test_06_document_saved_during_backup_keeps_its_version(monkeypatch):
+    backup_module = sys.modules['src.core.backup']
+    read_document = backup_module._read_document_consistently
+    def save_then_read(path):
+        # A save lands after the backup started, just before the document is read
+        scraibe.save_section(TEST_DOC, TEST_SECTION, 'bob', "# Introduction\nSaved meanwhile.")
+        return read_document(path)
+    monkeypatch.setattr(backup_module, '_read_document_consistently', save_then_read)
+    scraibe.backup('full.tar.gz')
+
+    scraibe.delete_document(TEST_DOC)
+    scraibe.restore('full.tar.gz')
+    assert 'Saved meanwhile.' in scraibe.load_document(TEST_DOC)
+    latest = scraibe.get_version_history(TEST_DOC, TEST_SECTION)[0]
+    assert latest['user'] == 'bob'
+    assert 'Saved meanwhile.' in scraibe.read_version(TEST_DOC, TEST_SECTION, latest['timestamp'], 'bob')
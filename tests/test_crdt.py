@@ -0,0 +1,107 @@
+import os
+import time
+import random
+import threading
+import pytest
+import src.core as scraibe
+
+TEST_DOC = 'test_document.md'
+TEST_SECTION = '20250203153000_1'
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs a test in an empty data directory with one document."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('documents')
+    with open(f'documents/{TEST_DOC}', 'w', encoding='utf-8') as f:
+        f.write(f">>>>>ID#{TEST_SECTION}\n# Introduction\nHello world.\n<<<<<ID#{TEST_SECTION}\n")
+    return tmp_path
+
+def test_01_concurrent_edits_converge():
+    alice = scraibe.RGAText('alice', 'Hello world')
+    bob = scraibe.RGAText('bob', 'Hello world')
+
+    ops_alice = alice.insert(5, ',') + alice.insert(12, '!')
+    ops_bob = bob.insert(0, '>> ') + bob.delete(9, 5)  # '>> Hello world' -> '>> Hello '
+
+    # Delivered in different orders, and bob's operations reversed
+    for op in ops_bob[::-1]:
+        alice.apply(op)
+    for op in ops_alice:
+        bob.apply(op)
+    assert alice.text() == bob.text() == '>> Hello, !'
+
+    # Same position at the same time: both inserts are kept, in the same order everywhere
+    a = alice.insert(3, 'A')
+    b = bob.insert(3, 'B')
+    alice.apply(b[0])
+    bob.apply(a[0])
+    assert alice.text() == bob.text()
+    assert 'A' in alice.text() and 'B' in alice.text()
+
+def test_02_relay_saves_versions(workdir):
+    relay = scraibe.LocalRelay(TEST_DOC, TEST_SECTION)
+    alice = relay.join('alice')
+    bob = relay.join('bob')
+    alice.insert(len(alice.text()), '\nFrom Alice.')
+    bob.insert(len('# Introduction\n'), 'Bob was here. ')
+    assert alice.text() == bob.text() == relay.text()
+
+    relay.save('alice')
+    assert 'Bob was here.' in scraibe.load_section(TEST_DOC, TEST_SECTION)
+    assert 'From Alice.' in scraibe.load_section(TEST_DOC, TEST_SECTION)
+
+    # An edit saved outside the session is merged and reaches the replicas
+    section = scraibe.load_section(TEST_DOC, TEST_SECTION)
+    scraibe.save_section(TEST_DOC, TEST_SECTION, 'carol', section.replace('# Introduction', '# Intro'), coalesce=False)
+    alice.insert(len(alice.text()), '\nMore.')
+    relay.save('alice', coalesce=False)
+    assert bob.text().startswith('# Intro\n')
+    assert scraibe.load_section(TEST_DOC, TEST_SECTION).strip() == bob.text().strip()
+
+    # Late joiners catch up with the operation log
+    assert relay.join('dave').text() == alice.text()
+
+def test_03_operations_on_a_large_section_are_fast():
+    random.seed(1)
+    text = ''.join(random.choice('abcdefghij \n') for _ in range(100_000))
+    writer = scraibe.RGAText('writer', text)
+    reader = scraibe.RGAText('reader', text)
+
+    ops = []
+    for _ in range(500):
+        position = random.randrange(len(writer))
+        ops += writer.insert(position, 'x') if random.random() < 0.7 else writer.delete(position)
+
+    start = time.perf_counter()
+    for op in ops:
+        reader.apply(op)
+    per_op = (time.perf_counter() - start) / len(ops)
+    assert reader.text() == writer.text()
+    assert per_op < 0.001
+
+def test_04_replicas_edited_from_threads_converge():
+    relay = scraibe.LocalRelay()
+    replicas = [relay.join(f'site{i}') for i in range(4)]
+
+    def edit(replica, seed):
+        rnd = random.Random(seed)
+        for _ in range(300):
+            length = len(replica)
+            try:
+                if length and rnd.random() < 0.3:
+                    replica.delete(rnd.randrange(length))
+                else:
+                    replica.insert(rnd.randint(0, length), rnd.choice('abc'))
+            except IndexError:
+                pass  # Shortened meanwhile by another site's deletes
+
+    threads = [threading.Thread(target=edit, args=(replica, seed)) for seed, replica in enumerate(replicas)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    texts = {replica.text() for replica in replicas + [relay._own]}
+    assert len(texts) == 1
+    assert relay.join('late').text() == relay.text()
@@ -0,0 +1,60 @@
+import os
+import yaml
+import pytest
+import src.core as scraibe
+
+TEST_DOC = 'test_document.md'
+TEST_SECTION = '20250203153000_1'
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs each test in an empty data directory."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def _age_draft(user, saved_at):
+    path = scraibe.draft_path(TEST_DOC, TEST_SECTION, user)
+    with open(path, 'r') as f:
+        draft = yaml.safe_load(f)
+    draft['saved_at'] = saved_at
+    with open(path, 'w') as f:
+        yaml.dump(draft, f)
+
+def test_01_draft_overwrites_in_place():
+    assert scraibe.save_draft(TEST_DOC, TEST_SECTION, 'alice', 'first', base_hash='abc')
+    assert scraibe.save_draft(TEST_DOC, TEST_SECTION, 'alice', 'second', base_hash='abc')
+    assert not scraibe.save_draft(TEST_DOC, TEST_SECTION, 'alice', 'second', base_hash='abc')
+
+    draft = scraibe.load_draft(TEST_DOC, TEST_SECTION, 'alice')
+    assert draft['content'] == 'second'
+    assert draft['base_hash'] == 'abc'
+    assert os.listdir(f'drafts/{TEST_DOC}') == [f'{TEST_DOC}.section_{TEST_SECTION}.alice.draft']
+
+    # Drafts are per user and never become versions by themselves
+    assert scraibe.load_draft(TEST_DOC, TEST_SECTION, 'bob') is None
+    assert not os.path.exists('versions')
+
+def test_02_expired_drafts_are_dropped():
+    scraibe.save_draft(TEST_DOC, TEST_SECTION, 'alice', 'old work')
+    scraibe.save_draft(TEST_DOC, TEST_SECTION, 'bob', 'recent work')
+    _age_draft('alice', '20000101000000')
+
+    assert scraibe.purge_expired_drafts(ttl_hours=1) == 1
+    assert scraibe.load_draft(TEST_DOC, TEST_SECTION, 'alice') is None
+    assert scraibe.load_draft(TEST_DOC, TEST_SECTION, 'bob')['content'] == 'recent work'
+
+    _age_draft('bob', '20000101000000')
+    assert scraibe.load_draft(TEST_DOC, TEST_SECTION, 'bob', ttl_hours=1) is None
+    assert not os.path.exists(scraibe.draft_path(TEST_DOC, TEST_SECTION, 'bob'))
+
+def test_03_discard_and_delete_document():
+    os.makedirs('documents')
+    with open(f'documents/{TEST_DOC}', 'w', encoding='utf-8') as f:
+        f.write(f">>>>>ID#{TEST_SECTION}\n# Introduction\n<<<<<ID#{TEST_SECTION}\n")
+    scraibe.save_draft(TEST_DOC, TEST_SECTION, 'alice', 'work')
+    assert scraibe.discard_draft(TEST_DOC, TEST_SECTION, 'alice')
+    assert not scraibe.discard_draft(TEST_DOC, TEST_SECTION, 'alice')
+
+    scraibe.save_draft(TEST_DOC, TEST_SECTION, 'bob', 'work')
+    scraibe.delete_document(TEST_DOC)
+    assert not os.path.exists(f'drafts/{TEST_DOC}')
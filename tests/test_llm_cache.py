@@ -0,0 +1,103 @@
+import time
+import asyncio
+import threading
+import pytest
+import src.core as scraibe
+from langchain_core.language_models.fake import FakeListLLM
+from src.core.llm import LLMDocumentAgent
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs each test in an empty directory, so llm_cache.db starts empty."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def test_01_identical_prompts_are_answered_once():
+    agent = LLMDocumentAgent(role='Reviewer', purpose='Docs', lang='English', llm=FakeListLLM(responses=['first', 'second', 'third']))
+    assert agent.analyse_section_in_context('# Doc\nText.', 'Text.') == 'first'
+    assert agent.analyse_section_in_context('# Doc\nText.', 'Text.') == 'first'
+    assert agent.analyse_section_in_context('# Doc\nText.', 'Other text.') == 'second'
+
+    # Another prompt configuration is another key
+    agent.lang = 'Español'
+    assert agent.analyse_section_in_context('# Doc\nText.', 'Text.') == 'third'
+
+def test_02_concurrent_identical_requests_share_one_call():
+    cache = scraibe.LLMCache(ttl_hours=1, max_entries=10)
+    calls = []
+    def call():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'answer'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_call('key', call))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['answer'] * 5
+    assert len(calls) == 1
+    assert cache.get_or_call('key', call) == 'answer' and len(calls) == 1
+
+def test_03_expiry_and_eviction():
+    cache = scraibe.LLMCache(ttl_hours=1, max_entries=2)
+    cache.put('a', 'A')
+    time.sleep(0.01)
+    cache.put('b', 'B')
+    time.sleep(0.01)
+    assert cache.get('a') == 'A'  # Now used more recently than b
+    cache.put('c', 'C')
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == ('A', None, 'C')
+
+    expiring = scraibe.LLMCache(ttl_hours=0.01 / 3600, max_entries=2)
+    expiring.put('a', 'A')
+    time.sleep(0.02)
+    assert expiring.get('a') is None
+
+def test_04_async_requests_join_the_calls_in_flight():
+    cache = scraibe.LLMCache(ttl_hours=1, max_entries=10)
+    calls = []
+    def call():
+        calls.append('thread')
+        time.sleep(0.3)
+        return 'answer'
+    async def acall():
+        calls.append('coroutine')
+        await asyncio.sleep(0.3)
+        return 'answer'
+
+    # A thread is already asking: the coroutines wait for it
+    thread = threading.Thread(target=lambda: cache.get_or_call('key', call))
+    thread.start()
+    time.sleep(0.05)
+    async def main():
+        return await asyncio.gather(*[cache.aget_or_call('key', acall) for _ in range(3)])
+    assert asyncio.run(main()) == ['answer'] * 3
+    thread.join()
+    assert calls == ['thread']
+
+    # Coroutines alone share one call too
+    async def others():
+        return await asyncio.gather(*[cache.aget_or_call('other', acall) for _ in range(3)])
+    assert asyncio.run(others()) == ['answer'] * 3
+    assert calls == ['thread', 'coroutine']
+
+def test_05_refresh_bypasses_the_cached_response():
+    agent = LLMDocumentAgent(role='Reviewer', purpose='Docs', lang='English', llm=FakeListLLM(responses=['first', 'second']))
+    assert agent.suggest_section_content('# Doc\nText.', 'Text.') == 'first'
+    assert agent.suggest_section_content('# Doc\nText.', 'Text.', refresh=True) == 'second'
+    assert agent.suggest_section_content('# Doc\nText.', 'Text.') == 'second'  # The new answer is cached
+
+def test_06_a_call_ending_during_the_lookup_is_not_repeated():
+    cache = scraibe.LLMCache(ttl_hours=1, max_entries=10)
+    get = cache.get
+    def racing_get(key):
+        response = get(key)
+        if response is None and cache.stats['misses'] == 0:
+            cache.put(key, 'stored meanwhile')  # Another caller finished between the lookup and the lock
+        return response
+    cache.get = racing_get
+
+    assert cache.get_or_call('key', lambda: 'called') == 'stored meanwhile'
+    assert cache.stats == {'hits': 1, 'misses': 0, 'coalesced': 0}
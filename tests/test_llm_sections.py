@@ -0,0 +1,82 @@
+import re
+import time
+import asyncio
+import pytest
+import src.core as scraibe
+from langchain_core.language_models.llms import LLM
+from src.core.llm import LLMDocumentAgent
+from settings import settings
+
+class SlowLLM(LLM):
+    """Answers after the delay written in the section, counting the calls in flight."""
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return 'slow'
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        raise AssertionError('sections are analysed with the async API')
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        section = re.search(r'==== Section to analyze ====\n(.*?)\n', prompt).group(1)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(float(section.split()[-1]))
+        self.in_flight -= 1
+        if 'fail' in section:
+            raise RuntimeError('provider error')
+        return f'Reviewed {section.split()[0]}'
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, 'llm_requests_per_minute', 0)
+    return tmp_path
+
+def test_01_sections_are_analysed_concurrently():
+    llm = SlowLLM()
+    agent = LLMDocumentAgent(role='Reviewer', purpose='Docs', lang='English', llm=llm)
+    sections = {'s1': 'intro 0.3', 's2': 'body 0.1', 's3': 'outro 0.2', 's4': 'broken fail 0.05'}
+
+    start = time.perf_counter()
+    results = list(agent.analyse_sections('# Doc', sections, concurrency=4))
+    elapsed = time.perf_counter() - start
+
+    # In completion order, in about the time of the slowest section
+    assert [section_id for section_id, _ in results] == ['s4', 's2', 's3', 's1']
+    assert isinstance(results[0][1], RuntimeError)
+    assert dict(results[1:]) == {'s2': 'Reviewed body', 's3': 'Reviewed outro', 's1': 'Reviewed intro'}
+    assert elapsed < 0.5
+
+    # Cached: the same sections again need no provider calls
+    assert dict(agent.analyse_sections('# Doc', {'s1': 'intro 0.3'})) == {'s1': 'Reviewed intro'}
+
+def test_02_concurrency_limit():
+    llm = SlowLLM()
+    agent = LLMDocumentAgent(llm=llm)
+    sections = {f's{i}': f'part{i} 0.05' for i in range(6)}
+    assert len(list(agent.analyse_sections('# Doc', sections, concurrency=2))) == 6
+    assert llm.max_in_flight == 2
+
+def test_03_token_bucket():
+    bucket = scraibe.TokenBucket(rate=10, capacity=2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0, 0]  # The burst
+    assert waits[2] == pytest.approx(0.1, abs=0.01) and waits[3] == pytest.approx(0.2, abs=0.01)
+    assert scraibe.TokenBucket(rate=0).reserve() == 0
+
+def test_04_runs_share_one_event_loop():
+    loops = []
+    class LoopLLM(SlowLLM):
+        async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+            loops.append(asyncio.get_running_loop())
+            return await super()._acall(prompt, stop, run_manager, **kwargs)
+
+    agent = LLMDocumentAgent(llm=LoopLLM())
+    list(agent.analyse_sections('# Doc', {'s1': 'first 0.01'}))
+    list(agent.analyse_sections('# Doc', {'s1': 'second 0.01'}))
+    # The async client's connection pool stays bound to a loop that is still running
+    assert len(loops) == 2 and loops[0] is loops[1]
+    assert loops[0].is_running()
@@ -1,4 +1,6 @@
 import os
+import time
+import threading
 import pytest
 import yaml
 import src.core as scraibe
@@ -10,18 +12,30 @@ ANOTHER_SECTION = '20250203153000_2'
 TEST_USER = 'jgil'
 ANOTHER_USER = 'alice'
 
-LOCK_FILE = f'locks/{TEST_DOC}/{TEST_DOC}.section_{TEST_SECTION}.lock'
-ANOTHER_LOCK_FILE = f'locks/{TEST_DOC}/{TEST_DOC}.section_{ANOTHER_SECTION}.lock'
+@pytest.fixture(scope='module', autouse=True)
+def lock_root(tmp_path_factory):
+    """Keeps the locks of the module-level functions out of the working directory."""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(scraibe.lock_manager, 'root', str(tmp_path_factory.mktemp('locks')))
+        yield scraibe.lock_manager.root
+        scraibe.lock_manager.stats.flush()
+
+def lock_table_path():
+    return os.path.join(scraibe.lock_manager.root, TEST_DOC, f'{TEST_DOC}.locks.yaml')
+
+def read_lock_table(path=None):
+    path = path or lock_table_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
 
 ## 1 Lock the section
 def test_01_lock_section():
     """Step 1: Lock a section and verify it is locked."""
     assert scraibe.lock_section(TEST_DOC, TEST_SECTION, TEST_USER) == True
-    assert os.path.exists(LOCK_FILE)
-
-    with open(LOCK_FILE, 'r', encoding='utf-8') as f:
-        lock_data = yaml.safe_load(f)
-        assert lock_data['user'] == TEST_USER
+    assert os.path.exists(lock_table_path())
+    assert read_lock_table()[TEST_SECTION]['user'] == TEST_USER
 
 ## 2 Check if the section is locked
 def test_02_is_section_locked():
@@ -37,13 +51,13 @@ def test_03_lock_section_already_locked():
 def test_04_unlock_section_wrong_user():
     """Step 4: The wrong user should NOT be able to unlock the section."""
     assert unlock_section(TEST_DOC, TEST_SECTION, ANOTHER_USER) == False
-    assert os.path.exists(LOCK_FILE)
+    assert TEST_SECTION in read_lock_table()
 
 ## 5 Unlock the section correctly
 def test_05_unlock_section():
     """Step 5: The correct user should be able to unlock the section."""
     assert unlock_section(TEST_DOC, TEST_SECTION, TEST_USER) == True
-    assert not os.path.exists(LOCK_FILE)
+    assert TEST_SECTION not in read_lock_table()
 
 ## 6 Check all locked sections for a document
 def test_06_check_all_locks():
@@ -63,6 +77,150 @@ def test_06_check_all_locks():
     assert unlock_section(TEST_DOC, TEST_SECTION, TEST_USER) == True
     assert unlock_section(TEST_DOC, ANOTHER_SECTION, ANOTHER_USER) == True
 
+## 7 Leases expire and can be renewed
+def test_07_lease_expiry(tmp_path):
+    """Step 7: An expired lease no longer locks the section; renewing keeps it."""
+    manager = scraibe.LockManager(root=str(tmp_path), ttl=60)
+    assert manager.acquire(TEST_DOC, TEST_SECTION, TEST_USER)
+    assert manager.renew(TEST_DOC, TEST_SECTION, TEST_USER)
+    assert not manager.renew(TEST_DOC, TEST_SECTION, ANOTHER_USER)
+    assert manager.owner(TEST_DOC, TEST_SECTION) == TEST_USER
+
+    assert manager.renew(TEST_DOC, TEST_SECTION, TEST_USER, ttl=1)
+    time.sleep(2.1)
+
+    assert manager.owner(TEST_DOC, TEST_SECTION) == False
+    assert manager.locks(TEST_DOC) == {}
+    assert manager.acquire(TEST_DOC, TEST_SECTION, ANOTHER_USER)
+
+## 8 One-file-per-section locks are read and moved into the table
+def test_08_legacy_lock_files(tmp_path):
+    """Step 8: Old lock files count from their locked_at time and are migrated on the next write."""
+    manager = scraibe.LockManager(root=str(tmp_path), ttl=60)
+    os.makedirs(tmp_path / TEST_DOC)
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    (tmp_path / TEST_DOC / f'{TEST_DOC}.section_{TEST_SECTION}.lock').write_text(
+        yaml.dump({'section': TEST_SECTION, 'user': TEST_USER, 'locked_at': '2000-01-01 00:00:00'}))
+    (tmp_path / TEST_DOC / f'{TEST_DOC}.section_{ANOTHER_SECTION}.lock').write_text(
+        yaml.dump({'section': ANOTHER_SECTION, 'user': ANOTHER_USER, 'locked_at': now}))
+    assert manager.owner(TEST_DOC, TEST_SECTION) == False
+    assert manager.owner(TEST_DOC, ANOTHER_SECTION) == ANOTHER_USER
+
+    assert manager.acquire(TEST_DOC, TEST_SECTION, TEST_USER)
+    assert sorted(os.listdir(tmp_path / TEST_DOC)) == [f'{TEST_DOC}.generation', f'{TEST_DOC}.locks.yaml']
+    assert manager.locks(TEST_DOC) == {TEST_SECTION: TEST_USER, ANOTHER_SECTION: ANOTHER_USER}
+
+    # A document without any lock has an empty table
+    assert manager.locks('missing_document.md') == {}
+    assert scraibe.check_all_locks('missing_document.md') == {}
+
+## 9 Waiting for a lock wakes on release
+def test_09_wait_for_unlock(tmp_path):
+    """Step 9: Waiters wake when the lock is released and time out otherwise."""
+    manager = scraibe.LockManager(root=str(tmp_path), ttl=60)
+    assert manager.acquire(TEST_DOC, TEST_SECTION, TEST_USER)
+    assert manager.wait(TEST_DOC, TEST_SECTION, TEST_USER, timeout=5) == False
+    assert manager.wait(TEST_DOC, TEST_SECTION, ANOTHER_USER, timeout=0.1) == TEST_USER
+
+    woken = []
+    def waiter(name):
+        woken.append((name, manager.wait(TEST_DOC, TEST_SECTION, name, timeout=5)))
+    threads = [threading.Thread(target=waiter, args=(name,)) for name in ('first', 'second')]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+
+    start = time.monotonic()
+    assert manager.release(TEST_DOC, TEST_SECTION, TEST_USER)
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start < 1
+    assert sorted(woken) == [('first', False), ('second', False)]
+
+## 10 All locks of a document in one read
+def test_10_get_document_locks():
+    """Step 10: get_document_locks returns the lease of every locked section."""
+    assert scraibe.lock_section(TEST_DOC, TEST_SECTION, TEST_USER)
+    locks = scraibe.get_document_locks(TEST_DOC)
+    assert locks[TEST_SECTION]['user'] == TEST_USER
+    assert 'expires_at' in locks[TEST_SECTION]
+    assert scraibe.unlock_section(TEST_DOC, TEST_SECTION, TEST_USER)
+    assert scraibe.get_document_locks(TEST_DOC) == {}
+
+## 11 The sweeper releases locks of ended sessions and idle locks
+def test_11_sweep_locks(tmp_path):
+    """Step 11: Live sessions keep their locks, ended sessions and idle locks lose them."""
+    manager = scraibe.LockManager(root=str(tmp_path), ttl=3600)
+    assert manager.acquire(TEST_DOC, TEST_SECTION, TEST_USER, session_id='live')
+    assert manager.acquire(TEST_DOC, ANOTHER_SECTION, ANOTHER_USER, session_id='gone')
+    assert manager.acquire('other.md', TEST_SECTION, TEST_USER)  # No session, e.g. the CLI
+
+    reclaimed = manager.sweep(idle_seconds=600, is_session_active=lambda session_id: session_id == 'live')
+    assert reclaimed == [{'document': TEST_DOC, 'section': ANOTHER_SECTION, 'user': ANOTHER_USER, 'reason': 'session ended'}]
+    assert manager.locks(TEST_DOC) == {TEST_SECTION: TEST_USER}
+    assert manager.locks('other.md') == {TEST_SECTION: TEST_USER}
+
+    # Not renewed for longer than the idle period: only the live session keeps it
+    reclaimed = manager.sweep(idle_seconds=-1, is_session_active=lambda session_id: session_id == 'live')
+    assert [(entry['document'], entry['reason']) for entry in reclaimed] == [('other.md', 'idle')]
+
+    assert manager.release_session('live') == 1
+    assert manager.locks(TEST_DOC) == {}
+
+## 12 Contention metrics per document
+def test_12_lock_stats(tmp_path):
+    """Step 12: Acquisitions, conflicts, waits and holds are counted and persisted."""
+    manager = scraibe.LockManager(root=str(tmp_path), ttl=60)
+    assert manager.acquire(TEST_DOC, TEST_SECTION, TEST_USER)
+    assert manager.acquire(TEST_DOC, TEST_SECTION, TEST_USER)  # Renewal, not a new acquisition
+    assert not manager.acquire(TEST_DOC, TEST_SECTION, ANOTHER_USER)
+    assert manager.wait(TEST_DOC, TEST_SECTION, ANOTHER_USER, timeout=0.05) == TEST_USER
+    assert manager.release(TEST_DOC, TEST_SECTION, TEST_USER)
+
+    stats = manager.stats.snapshot()[TEST_DOC]
+    assert os.path.exists(tmp_path / f'{TEST_DOC}.stats.json')
+    assert os.listdir(tmp_path / TEST_DOC) == [f'{TEST_DOC}.generation']  # Not in the lock directory
+    assert stats['acquisitions'] == 1
+    assert stats['conflicts'] == 1
+    assert stats['wait_timeouts'] == 1
+    assert stats['wait_seconds']['count'] == 1
+    assert stats['hold_seconds']['count'] == 1
+    assert stats['wait_seconds']['p95'] == 0.1
+
+    # Another process (here, another manager) adds to the same totals
+    other = scraibe.LockManager(root=str(tmp_path), ttl=60)
+    assert other.acquire(TEST_DOC, ANOTHER_SECTION, ANOTHER_USER)
+    assert other.stats.snapshot(TEST_DOC)[TEST_DOC]['acquisitions'] == 2
+
+    # Nothing recorded, nothing written
+    idle = scraibe.LockManager(root=str(tmp_path / 'idle'))
+    idle.stats.flush()
+    assert not os.path.exists(tmp_path / 'idle')
+
+## 13 Lookups are served from memory and see other processes' writes
+def test_13_lock_table_generation(tmp_path, monkeypatch):
+    """Step 13: Own writes are visible at once; another process' within the recheck period, even in the same clock tick."""
+    manager = scraibe.LockManager(root=str(tmp_path), ttl=60)
+    other = scraibe.LockManager(root=str(tmp_path), ttl=60)  # Another process
+    assert manager.locks(TEST_DOC) == {}
+    assert manager.acquire(TEST_DOC, TEST_SECTION, TEST_USER)
+    assert manager.owner(TEST_DOC, TEST_SECTION) == TEST_USER
+
+    opened, real_open = [], open
+    with monkeypatch.context() as patch:
+        patch.setattr('builtins.open', lambda *args, **kwargs: opened.append(args) or real_open(*args, **kwargs))
+        patch.setattr(os, 'stat', lambda *args, **kwargs: opened.append(args))
+        for _ in range(100):
+            manager.owner(TEST_DOC, TEST_SECTION)
+    assert opened == []  # No file system access while the table is fresh
+
+    assert other.owner(TEST_DOC, TEST_SECTION) == TEST_USER
+    mtime = os.stat(tmp_path / TEST_DOC).st_mtime_ns
+    assert other.release(TEST_DOC, TEST_SECTION, TEST_USER)
+    os.utime(tmp_path / TEST_DOC, ns=(mtime, mtime))  # Same timestamp tick
+    time.sleep(scraibe.LOCK_TABLE_RECHECK + 0.05)
+    assert manager.owner(TEST_DOC, TEST_SECTION) == False
+
 # Clean up after all tests
 def teardown_module(module):
     """Cleans up any lock files after all tests."""
@@ -0,0 +1,65 @@
+import os
+import pytest
+import src.core as scraibe
+
+TEST_DOC = 'test_document.md'
+TEST_SECTION = '20250203153000_1'
+BASE = "# Introduction\nFirst line.\nSecond line.\nThird line."
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs each test in an empty data directory with one saved section."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('documents')
+    with open(f'documents/{TEST_DOC}', 'w', encoding='utf-8') as f:
+        f.write(f">>>>>ID#{TEST_SECTION}\n{BASE}\n<<<<<ID#{TEST_SECTION}\n")
+    scraibe.save_section(TEST_DOC, TEST_SECTION, 'alice', BASE)
+    return tmp_path
+
+def test_01_merge3():
+    base = ['a', 'b', 'c', 'd']
+    merged, conflicts = scraibe.merge3(base, ['A', 'b', 'c', 'd'], ['a', 'b', 'c', 'D'])
+    assert merged == ['A', 'b', 'c', 'D'] and conflicts == []
+
+    # Both sides made the same change
+    merged, conflicts = scraibe.merge3(base, ['a', 'B', 'c', 'd'], ['a', 'B', 'c', 'd'])
+    assert merged == ['a', 'B', 'c', 'd'] and conflicts == []
+
+    merged, conflicts = scraibe.merge3(base, ['a', 'mine', 'c', 'd'], ['a', 'theirs', 'c', 'd'])
+    assert conflicts == [{'base': ['b'], 'yours': ['mine'], 'theirs': ['theirs']}]
+    assert merged == ['a', scraibe.CONFLICT_START, 'mine', scraibe.CONFLICT_SEPARATOR, 'theirs', scraibe.CONFLICT_END, 'c', 'd']
+
+def test_02_concurrent_saves_are_merged():
+    base_hash = scraibe.content_hash(BASE)
+    scraibe.save_section(TEST_DOC, TEST_SECTION, 'bob', BASE.replace('First', 'Bob\'s first'), base_hash=base_hash)
+    scraibe.save_section(TEST_DOC, TEST_SECTION, 'carol', BASE.replace('Third', 'Carol\'s third'), base_hash=base_hash, coalesce=False)
+
+    section = scraibe.load_section(TEST_DOC, TEST_SECTION)
+    assert "Bob's first line." in section
+    assert "Carol's third line." in section
+
+def test_03_conflicting_saves_are_rejected():
+    base_hash = scraibe.content_hash(BASE)
+    scraibe.lock_section(TEST_DOC, TEST_SECTION, 'alice')  # Optimistic saves do not wait for locks
+    scraibe.save_section(TEST_DOC, TEST_SECTION, 'bob', BASE.replace('Second', 'Bob\'s second'), base_hash=base_hash)
+
+    with pytest.raises(scraibe.SectionConflictError) as conflict:
+        scraibe.save_section(TEST_DOC, TEST_SECTION, 'carol', BASE.replace('Second', 'Carol\'s second'), base_hash=base_hash)
+    assert len(conflict.value.conflicts) == 1
+    assert scraibe.CONFLICT_START in conflict.value.merged
+    assert conflict.value.current_hash == scraibe.content_hash(scraibe.load_section(TEST_DOC, TEST_SECTION))
+    assert "Carol" not in scraibe.load_section(TEST_DOC, TEST_SECTION)
+    scraibe.unlock_section(TEST_DOC, TEST_SECTION, 'alice')
+
+def test_04_merge_when_the_base_version_is_gone():
+    base_hash = scraibe.content_hash(BASE)
+    scraibe.save_section(TEST_DOC, TEST_SECTION, 'bob', BASE.replace('First', 'Bob\'s first'), base_hash=base_hash)
+    for version in scraibe.get_version_history(TEST_DOC, TEST_SECTION, user='alice'):
+        os.remove(scraibe.version_path(TEST_DOC, TEST_SECTION, version['timestamp'], 'alice'))  # e.g. thinned by the GC
+
+    edit = BASE.replace('Third', 'Carol\'s third')
+    with pytest.raises(scraibe.SectionConflictError):
+        scraibe.save_section(TEST_DOC, TEST_SECTION, 'carol', edit, base_hash=base_hash)
+    scraibe.save_section(TEST_DOC, TEST_SECTION, 'carol', edit, base_hash=base_hash, base_text=BASE)
+    section = scraibe.load_section(TEST_DOC, TEST_SECTION)
+    assert "Bob's first line." in section and "Carol's third line." in section
@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+import yaml
+import pytest
+import src.core as scraibe
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """A registry in an empty data directory."""
+    monkeypatch.chdir(tmp_path)
+    registry = scraibe.DocumentRegistry()
+    yield registry
+    registry.close()
+
+def test_01_import_documents_yaml(registry):
+    with open('documents.yaml', 'w') as f:
+        yaml.dump({'documents': {'intro.md': {
+            'creator': 'alice', 'created_at': '2025-02-03 15:30:00', 'lang': 'English', 'purpose': None, 'role': None,
+            'users': [{'name': 'alice', 'permission': 'creator', 'display_name': 'Alice'},
+                      {'name': 'bob', 'permission': 'viewer', 'display_name': 'bob'}]}}}, f)
+
+    meta = registry.get_document('intro.md')
+    assert meta['creator'] == 'alice'
+    assert meta['lang'] == 'English'
+    assert [u['name'] for u in meta['users']] == ['alice', 'bob']
+
+    # Only once: later changes to the YAML file are not imported again
+    registry.delete_document('intro.md')
+    registry.close()
+    assert registry.get_document('intro.md') is None
+
+def test_02_permissions(registry):
+    assert registry.add_document('intro.md', 'alice', lang='English')
+    assert not registry.add_document('intro.md', 'bob')
+
+    registry.set_user_permission('intro.md', 'bob', 'editor', 'Bob')
+    registry.set_user_permission('intro.md', 'carol', 'none')  # Nothing to revoke
+    assert registry.permission('intro.md', 'bob') == 'editor'
+    assert registry.permission('intro.md', 'carol') is None
+    assert registry.get_document('intro.md')['users'][1] == {'name': 'bob', 'permission': 'editor', 'display_name': 'Bob'}
+
+    with pytest.raises(PermissionError):
+        registry.set_user_permission('intro.md', 'alice', 'viewer')
+    with pytest.raises(PermissionError):
+        registry.remove_user('intro.md', 'alice')
+    with pytest.raises(KeyError):
+        registry.set_user_permission('missing.md', 'bob', 'viewer')
+
+    registry.update_ai_config('intro.md', role='Reviewer', purpose='Docs', lang='Español')
+    assert registry.get_document('intro.md')['role'] == 'Reviewer'
+
+    registry.remove_user('intro.md', 'bob')
+    assert registry.permission('intro.md', 'bob') is None
+
+def test_03_documents_for_user(registry):
+    registry.add_document('a.md', 'alice')
+    registry.add_document('b.md', 'bob')
+    registry.set_user_permission('b.md', 'alice', 'viewer')
+    registry.add_document('c.md', 'carol')
+
+    assert list(registry.documents_for_user('alice')) == ['a.md', 'b.md']
+    assert list(registry.documents_for_user('carol')) == ['c.md']
+    assert registry.documents_for_user('nobody') == {}
+
+    assert registry.permissions_for_user('alice') == {'a.md': 'creator', 'b.md': 'viewer'}
+
+    # The user's rows come from the user index instead of a scan of document_users
+    plan = registry.connection().execute(
+        "EXPLAIN QUERY PLAN SELECT d.* FROM documents d JOIN document_users u ON u.document = d.name WHERE u.name = ?", ('alice',)).fetchall()
+    assert any('document_users_by_user' in row['detail'] for row in plan)
+
+    assert registry.delete_document('b.md')
+    assert list(registry.documents_for_user('alice')) == ['a.md']
+    assert registry.permission('b.md', 'alice') is None
+
+def test_04_backup_and_restore_registry(registry):
+    os.makedirs('documents')
+    with open('documents/a.md', 'w', encoding='utf-8') as f:
+        f.write("")
+    scraibe.registry.add_document('a.md', 'alice')
+    scraibe.registry.add_document('b.md', 'bob')
+    scraibe.backup('full.tar.gz')
+
+    scraibe.registry.delete_document('a.md')
+    scraibe.registry.set_user_permission('b.md', 'carol', 'viewer')
+    scraibe.restore('full.tar.gz', document='a.md')
+    assert scraibe.registry.get_document('a.md')['creator'] == 'alice'
+    assert scraibe.registry.permission('b.md', 'carol') == 'viewer'
+
+    scraibe.restore('full.tar.gz')
+    assert scraibe.registry.permission('b.md', 'carol') is None
+    scraibe.registry.close()
+
+def test_05_cached_permission_follows_changes(registry):
+    registry.add_document('a.md', 'alice')
+    assert registry.cached_permission('a.md', 'bob') is None
+    generation = registry.generation()
+
+    registry.set_user_permission('a.md', 'bob', 'viewer')
+    assert registry.generation() > generation
+    assert registry.cached_permission('a.md', 'bob') == 'viewer'
+
+    # A change made through another connection, as another process would
+    other = scraibe.DocumentRegistry()
+    other.set_user_permission('a.md', 'bob', 'editor')
+    other.close()
+    time.sleep(scraibe.AUTHZ_RECHECK_SECONDS)
+    assert registry.cached_permission('a.md', 'bob') == 'editor'
+
+    # Unchanged registry: answered from the cache, without a query
+    registry.permission = None
+    assert registry.cached_permission('a.md', 'bob') == 'editor'
+
+def test_06_concurrent_updates_are_not_lost(registry):
+    registry.add_document('a.md', 'alice')
+
+    def add_reader(i):
+        def mutate(meta):
+            meta['users'].append({'name': f'user{i}', 'permission': 'viewer', 'display_name': f'user{i}'})
+        scraibe.DocumentRegistry().update_document('a.md', mutate)
+
+    threads = [threading.Thread(target=add_reader, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {f'user{i}' for i in range(8)} <= {u['name'] for u in registry.get_document('a.md')['users']}
+
+    # A change committed between the read and the write: the mutation is applied again
+    calls = []
+    def mutate(meta):
+        calls.append(1)
+        if len(calls) == 1:
+            scraibe.DocumentRegistry().update_ai_config('a.md', lang='English')
+        meta['role'] = 'Reviewer'
+    registry.update_document('a.md', mutate)
+    assert len(calls) == 2
+    meta = registry.get_document('a.md')
+    assert (meta['lang'], meta['role']) == ('English', 'Reviewer')
+
+    generation, documents = registry.snapshot()
+    assert not registry.compare_and_swap(generation - 1, documents)
+    with pytest.raises(KeyError):
+        registry.update_document('missing.md', lambda meta: None)
+
+def test_07_writers_retry_on_concurrent_changes(registry):
+    registry.add_document('a.md', 'alice')
+    calls = []
+    update_documents = registry.update_documents
+    def racing_update(mutate, names=None, retries=scraibe.CAS_RETRIES):
+        def mutate_once_raced(documents):
+            calls.append(1)
+            if len(calls) == 1:
+                # Committed by another writer after this one read the metadata
+                scraibe.DocumentRegistry().set_user_permission('a.md', 'carol', 'viewer')
+            return mutate(documents)
+        return update_documents(mutate_once_raced, names, retries)
+    registry.update_documents = racing_update
+
+    registry.set_user_permission('a.md', 'bob', 'editor')
+    assert len(calls) == 2
+    assert registry.permission('a.md', 'bob') == 'editor'
+    assert registry.permission('a.md', 'carol') == 'viewer'
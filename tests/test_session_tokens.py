@@ -0,0 +1,39 @@
+import os
+import pytest
+import src.core as scraibe
+from settings import settings
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs each test in an empty directory, with a fresh signing key."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, 'session_secret', '')
+    return tmp_path
+
+def test_01_tokens_round_trip():
+    token = scraibe.issue_session_token('alice', 'admin', 7)
+    claims = scraibe.verify_session_token(token)
+    assert (claims['user'], claims['role'], claims['generation'], claims['epoch']) == ('alice', 'admin', 7, 0)
+    assert scraibe.verify_session_token(scraibe.issue_session_token('alice', 'admin', 7, epoch=3))['epoch'] == 3
+    assert os.stat(scraibe.SESSION_SECRET_FILE).st_mode & 0o077 == 0  # Readable by the owner only
+
+def test_02_forged_and_expired_tokens_are_rejected(monkeypatch):
+    token = scraibe.issue_session_token('bob', 'user', 1)
+    payload, signature = token.split('.')
+    admin = scraibe.issue_session_token('bob', 'admin', 1).split('.')[0]
+    assert scraibe.verify_session_token(f'{admin}.{signature}') is None
+    assert scraibe.verify_session_token(f'{payload}.x{signature[1:]}') is None
+    assert scraibe.verify_session_token('garbage') is None
+    assert scraibe.verify_session_token(None) is None
+    assert scraibe.verify_session_token(scraibe.issue_session_token('bob', 'user', 1, ttl_hours=-1)) is None
+
+    # Another key, e.g. another installation, does not accept it
+    monkeypatch.setattr(settings, 'session_secret', 'another key')
+    assert scraibe.verify_session_token(token) is None
+
+def test_03_malformed_tokens_are_rejected():
+    token = scraibe.issue_session_token('carol', 'user', 1)
+    payload, signature = token.split('.')
+    for malformed in ('é.x', 'abc.déf', f'{payload}.{signature}é', f'{payload}.{signature}.x',
+                      f'{payload}=.{signature}', f' {token}', '.', f'.{signature}', f'{payload}.', ['a.b'], 42):
+        assert scraibe.verify_session_token(malformed) is None, malformed
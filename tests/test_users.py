@@ -0,0 +1,84 @@
+import yaml
+import pytest
+import src.core as scraibe
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    """A user directory in an empty data directory."""
+    monkeypatch.chdir(tmp_path)
+    registry = scraibe.DocumentRegistry()
+    yield scraibe.UserDirectory(registry)
+    registry.close()
+
+def test_01_import_users_yaml(users):
+    with open('users.yaml', 'w') as f:
+        yaml.dump({'alice': {'password': 'hash-a', 'role': 'admin', 'last_login': None},
+                   'bob': {'password': 'hash-b', 'role': 'user', 'last_login': None}}, f)
+
+    assert users.get('alice') == {'name': 'alice', 'password': 'hash-a', 'role': 'admin', 'last_login': None}
+    assert users.count() == 2
+
+    # Only once: accounts deleted later do not come back
+    users.delete('bob')
+    assert users.get('bob') is None
+    assert scraibe.UserDirectory(users.registry).get('bob') is None
+
+def test_02_accounts(users):
+    assert users.add('alice', 'hash-a', 'admin')
+    assert not users.add('alice', 'other')
+    assert users.add('bob', 'hash-b')
+
+    with pytest.raises(PermissionError):
+        users.set_role('alice', 'user')  # The last admin
+    with pytest.raises(PermissionError):
+        users.delete('alice')
+    with pytest.raises(KeyError):
+        users.set_password('carol', 'hash-c')
+
+    users.set_role('bob', 'admin')
+    users.set_role('alice', 'user')
+    users.set_password('alice', 'new-hash')
+    users.record_login('alice')
+    alice = users.get('alice')
+    assert (alice['role'], alice['password']) == ('user', 'new-hash')
+    assert alice['last_login']
+
+def test_03_pages_and_search(users):
+    db = users.connection()
+    db.executemany("INSERT INTO users (name, password) VALUES (?, 'x')", [(f'user{i:05d}',) for i in range(20_000)])
+    users.add('a_b', 'x')
+
+    assert users.count() == 20_001
+    page = users.page(2, page_size=10)
+    assert [u['name'] for u in page] == [f'user{i:05d}' for i in range(19, 29)]
+    assert users.count('user1999') == 10
+    assert users.names('_', limit=5) == ['a_b']  # Wildcards are matched literally
+
+    plan = db.execute("EXPLAIN QUERY PLAN SELECT * FROM users WHERE name = ?", ('user00001',)).fetchall()
+    assert any('USING INDEX' in row['detail'] or 'PRIMARY KEY' in row['detail'] for row in plan)
+
+def test_04_token_epochs(users):
+    assert users.add('alice', 'hash-a', 'admin')
+    assert users.token_epoch('alice') == 0
+
+    generation = users.registry.generation()
+    users.revoke_sessions('alice')
+    assert users.token_epoch('alice') == 1
+    assert users.registry.generation() > generation  # Sends old tokens through the account check
+
+    users.set_password('alice', 'new-hash')
+    assert users.token_epoch('alice') == 2
+
+    users.add('bob', 'hash-b', 'admin')
+    users.delete('alice')
+    assert users.token_epoch('alice') == 0
+
+def test_05_unknown_roles_are_rejected(users):
+    with pytest.raises(ValueError):
+        users.add('alice', 'hash-a', 'superuser')
+    assert users.get('alice') is None
+
+    assert users.add('alice', 'hash-a', 'admin')
+    with pytest.raises(ValueError):
+        users.set_role('alice', 'Admin')
+    assert users.get('alice')['role'] == 'admin'
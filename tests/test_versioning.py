@@ -3,8 +3,12 @@ import os
 import pytest
 import datetime
 import re
+import json
+import time
 from src.core.versioning import save_section_version, get_version_history, rollback_section
 import src.core as scraibe
+import src.core.versioning as versioning
+from settings import settings
 
 TEST_DOC = 'documents/test_document.md'
 TEST_SECTION = '20250203153000_1'
@@ -57,4 +61,248 @@ def test_03_rollback_section():
     _ = rollback_section(TEST_DOC, TEST_SECTION, timestamp, TEST_USER)
     
     restored_content = scraibe.load_section(TEST_DOC, TEST_SECTION)
-    assert restored_content == 'content1'
\ No newline at end of file
+    assert restored_content == 'content1'
+
+def test_04_load_document_at():
+    first = scraibe.save_section(TEST_DOC, TEST_SECTION, "user1", "# Introduction\nFirst draft.")
+    time.sleep(1)
+    scraibe.save_section(TEST_DOC, TEST_SECTION, "user2", "# Introduction\nSecond draft.")
+
+    past = scraibe.load_document_at(TEST_DOC, first)
+    assert "First draft." in past
+    assert "Second draft." not in past
+    assert "Test content here." in past  # Never edited, keeps its text
+
+    now = scraibe.load_document_at(TEST_DOC, datetime.datetime.now())
+    assert "Second draft." in now
+
+def test_05_load_document_at_skips_deleted_and_newer_sections():
+    scraibe.delete_section(TEST_DOC, '20250203153000_2', TEST_USER)
+    now = scraibe.load_document_at(TEST_DOC, datetime.datetime.now())
+    assert '20250203153000_2' not in now
+
+    before = scraibe.load_document_at(TEST_DOC, '20250203153000')
+    assert '20250203153000_1' in before
+    assert scraibe.load_document_at(TEST_DOC, '20250101') == "\n"
+
+def test_06_gc_versions_thins_old_versions():
+    now = datetime.datetime(2025, 6, 1, 12, 0, 0)
+    policy = {'keep_all_days': 1, 'hourly_days': 3, 'daily_days': 10, 'min_versions': 1}
+    timestamps = [
+        '20250601110000', '20250601100000',                    # Recent: all kept
+        '20250530101000', '20250530102000', '20250530103000',  # Same hour: newest kept
+        '20250525080000', '20250525230000',                    # Same day: newest kept
+        '20250401080000', '20250402080000',                    # Same week: newest kept
+    ]
+    os.makedirs(f'{scraibe.VERSION_DIR}/test_document.md', exist_ok=True)
+    for timestamp in timestamps:
+        with open(scraibe.version_path(TEST_DOC, TEST_SECTION, timestamp, TEST_USER), 'w', encoding='utf-8') as f:
+            f.write(f'content {timestamp}')
+
+    dry = scraibe.gc_versions(TEST_DOC, policy=policy, dry_run=True, now=now)
+    assert dry['deleted'] == 4
+    assert len(get_version_history(TEST_DOC, TEST_SECTION)) == len(timestamps)
+
+    report = scraibe.gc_versions(TEST_DOC, policy=policy, now=now)
+    assert report['deleted'] == 4
+    assert report['reclaimed_bytes'] == 4 * len('content 20250530101000')
+    kept = sorted(v['timestamp'] for v in get_version_history(TEST_DOC, TEST_SECTION))
+    assert kept == ['20250402080000', '20250525230000', '20250530103000', '20250601100000', '20250601110000']
+
+def test_07_version_history_pagination_and_filters():
+    os.makedirs(f'{scraibe.VERSION_DIR}/test_document.md', exist_ok=True)
+    for i in range(7):
+        user = 'alice' if i % 2 else 'bob'
+        with open(scraibe.version_path(TEST_DOC, TEST_SECTION, f'2025060112000{i}', user), 'w', encoding='utf-8') as f:
+            f.write(f'content {i}')
+
+    page, cursor = scraibe.get_version_history_page(TEST_DOC, TEST_SECTION, limit=3)
+    assert [v['timestamp'][-1] for v in page] == ['6', '5', '4']
+    page, cursor = scraibe.get_version_history_page(TEST_DOC, TEST_SECTION, limit=3, cursor=cursor)
+    assert [v['timestamp'][-1] for v in page] == ['3', '2', '1']
+    page, cursor = scraibe.get_version_history_page(TEST_DOC, TEST_SECTION, limit=3, cursor=cursor)
+    assert [v['timestamp'][-1] for v in page] == ['0']
+    assert cursor is None
+
+    alice = get_version_history(TEST_DOC, TEST_SECTION, user='alice')
+    assert [v['timestamp'][-1] for v in alice] == ['5', '3', '1']
+    window = get_version_history(TEST_DOC, TEST_SECTION, since='20250601120002', until='20250601120004')
+    assert [v['timestamp'][-1] for v in window] == ['4', '3', '2']
+    assert len(get_version_history(TEST_DOC, TEST_SECTION, since='20250602')) == 0
+
+def test_08_write_behind_versions(monkeypatch):
+    monkeypatch.setattr(settings, 'version_write_behind', True)
+    writer = scraibe.VersionWriter(batch_delay=0.2)
+    monkeypatch.setattr(versioning, 'version_writer', writer)
+
+    timestamp = save_section_version(TEST_DOC, TEST_SECTION, "user1", "queued content")
+    # Visible before it reaches the disk
+    assert get_version_history(TEST_DOC, TEST_SECTION)[0]['timestamp'] == timestamp
+    assert scraibe.read_version(TEST_DOC, TEST_SECTION, timestamp, "user1") == "queued content"
+
+    assert writer.flush(timeout=5)
+    with open(scraibe.version_path(TEST_DOC, TEST_SECTION, timestamp, "user1"), encoding='utf-8') as f:
+        assert f.read() == "queued content"
+
+    save_section_version(TEST_DOC, TEST_SECTION, "user2", "confirmed", wait=True)
+    assert writer.pending('test_document.md') == []
+    writer.close()
+    assert not os.path.exists(writer.journal_path)
+
+def test_09_replay_version_journals():
+    record = {'filename': 'test_document.md', 'section_id': TEST_SECTION, 'timestamp': '20250601120000', 'user': 'ghost', 'content': 'lost write'}
+    os.makedirs(scraibe.VERSION_DIR, exist_ok=True)
+    journal = os.path.join(scraibe.VERSION_DIR, '.journal.99999999.jsonl')
+    with open(journal, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(record) + "\n" + '{"filename": "torn')
+
+    assert scraibe.replay_version_journals() == 1
+    assert not os.path.exists(journal)
+    assert scraibe.read_version(TEST_DOC, TEST_SECTION, '20250601120000', 'ghost') == 'lost write'
+
+def test_10_blame_is_incremental():
+    scraibe.save_section(TEST_DOC, TEST_SECTION, "alice", "# Introduction\nAlice line.")
+    time.sleep(1)
+    scraibe.save_section(TEST_DOC, TEST_SECTION, "bob", "# Introduction\nAlice line.\nBob line.")
+
+    annotated = scraibe.blame(TEST_DOC, TEST_SECTION)
+    assert [(e['line'], e['user']) for e in annotated] == [
+        ('# Introduction', 'alice'), ('Alice line.', 'alice'), ('Bob line.', 'bob')]
+
+    # The cache remembers the processed history, only the new version is replayed
+    cache_file = f'{scraibe.VERSION_DIR}/test_document.md/{scraibe.BLAME_DIR}/{TEST_SECTION}.json'
+    with open(cache_file, encoding='utf-8') as f:
+        assert json.load(f)['last'][1] == 'bob'
+    time.sleep(1)
+    scraibe.save_section(TEST_DOC, TEST_SECTION, "carol", "# Introduction\nCarol line.\nBob line.")
+    annotated = scraibe.blame(TEST_DOC, TEST_SECTION)
+    assert [e['user'] for e in annotated] == ['alice', 'carol', 'bob']
+
+def test_11_coalesce_rapid_saves(monkeypatch):
+    monkeypatch.setattr(settings, 'version_coalesce_seconds', 60)
+    before = scraibe.version_stats(TEST_DOC)
+
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "draft 1")
+    save_section_version(TEST_DOC, TEST_SECTION, "bob", "bob's edit")
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "draft 2")
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "draft 3")
+
+    history = get_version_history(TEST_DOC, TEST_SECTION)
+    assert [v['user'] for v in history] == ['alice', 'bob', 'alice']
+    assert scraibe.read_version(TEST_DOC, TEST_SECTION, history[0]['timestamp'], 'alice') == "draft 3"
+
+    after = scraibe.version_stats(TEST_DOC)
+    assert after['saved'] - before['saved'] == 4
+    assert after['coalesced'] - before['coalesced'] == 1
+
+    # Not coalesced when asked, e.g. for rollbacks, and never replaced later
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "draft 4", coalesce=False)
+    assert len(get_version_history(TEST_DOC, TEST_SECTION)) == 4
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "draft 5")
+    history = get_version_history(TEST_DOC, TEST_SECTION)
+    assert len(history) == 5
+    assert scraibe.read_version(TEST_DOC, TEST_SECTION, history[1]['timestamp'], 'alice') == "draft 4"
+
+def test_12_last_edited_table():
+    scraibe.save_section(TEST_DOC, TEST_SECTION, "alice", "# Introduction\nEdited.")
+    table = scraibe.get_last_edited(TEST_DOC)
+    assert table[TEST_SECTION]['user'] == 'alice'
+    assert table[TEST_SECTION]['hash'] == scraibe.content_hash("# Introduction\nEdited.")
+    assert '20250203153000_2' not in table
+
+    scraibe.delete_section(TEST_DOC, TEST_SECTION, "bob")
+    assert TEST_SECTION not in scraibe.get_last_edited(TEST_DOC)
+
+def test_13_last_edited_table_is_rebuilt_from_history():
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "content")
+    os.remove(scraibe.last_edited_path(TEST_DOC))
+    assert scraibe.get_last_edited(TEST_DOC)[TEST_SECTION]['user'] == 'alice'
+    assert os.path.exists(scraibe.last_edited_path(TEST_DOC))
+
+def test_14_last_edited_table_with_write_behind(monkeypatch):
+    monkeypatch.setattr(settings, 'version_write_behind', True)
+    writer = scraibe.VersionWriter(batch_delay=0.2)
+    monkeypatch.setattr(versioning, 'version_writer', writer)
+
+    timestamp = save_section_version(TEST_DOC, TEST_SECTION, "alice", "queued content")
+    entry = scraibe.get_last_edited(TEST_DOC)[TEST_SECTION]
+    assert (entry['timestamp'], entry['user']) == (timestamp, 'alice')
+    assert entry['hash'] == scraibe.content_hash("queued content")
+    writer.close()
+
+def test_15_coalesce_window_starts_with_the_burst(monkeypatch):
+    monkeypatch.setattr(settings, 'version_coalesce_seconds', 60)
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "draft 1")
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "draft 2")
+    assert len(get_version_history(TEST_DOC, TEST_SECTION)) == 1
+
+    # The burst started long ago: the window does not slide with every save
+    table = {section_id: dict(entry) for section_id, entry in scraibe.get_last_edited(TEST_DOC).items()}
+    table[TEST_SECTION]['burst_start'] = '20000101000000'
+    versioning._write_last_edited(scraibe.last_edited_path(TEST_DOC), table)
+    save_section_version(TEST_DOC, TEST_SECTION, "alice", "draft 3")
+    history = get_version_history(TEST_DOC, TEST_SECTION)
+    assert len(history) == 2
+    assert scraibe.read_version(TEST_DOC, TEST_SECTION, history[1]['timestamp'], 'alice') == "draft 2"
+
+def test_16_replay_tells_live_writers_by_their_lock():
+    fcntl = pytest.importorskip('fcntl')
+    record = {'filename': 'test_document.md', 'section_id': TEST_SECTION, 'timestamp': '20250601120000', 'user': 'ghost', 'content': 'lost write'}
+    os.makedirs(scraibe.VERSION_DIR, exist_ok=True)
+    # PID 1 is alive, but the process that wrote the journal is not: nobody holds its lock
+    journal = os.path.join(scraibe.VERSION_DIR, '.journal.1.0000.jsonl')
+    with open(journal, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(record) + "\n")
+
+    with open(journal, 'r') as held:
+        fcntl.flock(held.fileno(), fcntl.LOCK_EX)  # A live writer
+        assert scraibe.replay_version_journals() == 0
+        assert os.path.exists(journal)
+    assert scraibe.replay_version_journals() == 1
+    assert not os.path.exists(journal)
+
+def test_17_delete_document_surfaces_a_stuck_writer(monkeypatch):
+    monkeypatch.setattr(versioning.version_writer, 'flush', lambda timeout=None: False)
+    with pytest.raises(TimeoutError):
+        scraibe.delete_document(TEST_DOC)
+    assert os.path.exists(TEST_DOC)
+
+def test_18_blame_of_lines_no_version_contains():
+    scraibe.save_section(TEST_DOC, TEST_SECTION, "alice", "# Introduction\nAlice line.")
+    with open(TEST_DOC, encoding='utf-8') as f:
+        document = f.read()
+    with open(TEST_DOC, 'w', encoding='utf-8') as f:
+        f.write(document.replace("Alice line.", "Alice line.\nHand-written line."))
+
+    annotated = scraibe.blame(TEST_DOC, TEST_SECTION)
+    assert [(e['line'], e['user']) for e in annotated] == [
+        ('# Introduction', 'alice'), ('Alice line.', 'alice'), ('Hand-written line.', None)]
+
+def test_19_delete_section_waits_for_the_document_lock():
+    import threading
+    deleted = threading.Event()
+    def delete():
+        scraibe.delete_section(TEST_DOC, '20250203153000_2', TEST_USER)
+        deleted.set()
+
+    with scraibe.document_lock(TEST_DOC):
+        thread = threading.Thread(target=delete)
+        thread.start()
+        assert not deleted.wait(0.2)  # Does not interleave with a locked save
+    thread.join(5)
+    assert deleted.is_set()
+    assert '20250203153000_2' not in scraibe.list_sections(scraibe.load_document(TEST_DOC))
+
+def test_20_rollback_is_saved_as_the_acting_user():
+    timestamp = save_section_version(TEST_DOC, TEST_SECTION, "alice", "# Introduction\nAlice wrote this.")
+    scraibe.save_section(TEST_DOC, TEST_SECTION, "bob", "# Introduction\nBob changed it.")
+    assert scraibe.lock_section(TEST_DOC, TEST_SECTION, "alice")
+
+    # Locked by the author, so the rollback is checked as carol, not as alice
+    with pytest.raises(PermissionError):
+        rollback_section(TEST_DOC, TEST_SECTION, timestamp, "alice", "carol")
+    scraibe.unlock_section(TEST_DOC, TEST_SECTION, "alice")
+
+    rollback_section(TEST_DOC, TEST_SECTION, timestamp, "alice", "carol")
+    assert scraibe.load_section(TEST_DOC, TEST_SECTION) == "# Introduction\nAlice wrote this."
+    assert scraibe.get_version_history(TEST_DOC, TEST_SECTION)[0]['user'] == 'carol'
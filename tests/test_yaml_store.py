@@ -0,0 +1,48 @@
+import os
+import time
+import importlib
+import pytest
+import src.core as scraibe
+
+yaml_store_module = importlib.import_module('src.core.yaml_store')
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A store with a long enough write delay to observe it."""
+    monkeypatch.chdir(tmp_path)
+    return scraibe.YAMLStore('users.yaml', write_delay=0.2)
+
+def test_01_load_is_cached_until_the_file_changes(store, monkeypatch):
+    assert store.load({}) == {}
+    scraibe.write_yaml('users.yaml', {'alice': {'role': 'admin'}})
+    users = store.load()
+    assert users == {'alice': {'role': 'admin'}}
+
+    # Unchanged file: the same object, nothing parsed
+    def no_parse(path):
+        raise AssertionError('parsed again')
+    with monkeypatch.context() as patch:
+        patch.setattr(yaml_store_module, 'read_yaml', no_parse)
+        assert store.load() is users
+        assert store.load(copy=True) == users and store.load(copy=True) is not users
+
+    scraibe.write_yaml('users.yaml', {'alice': {'role': 'admin'}, 'bob': {'role': 'user'}})
+    assert 'bob' in store.load()
+
+def test_02_saves_are_coalesced(store, monkeypatch):
+    writes = []
+    write_yaml = yaml_store_module.write_yaml
+    monkeypatch.setattr(yaml_store_module, 'write_yaml', lambda path, data: writes.append(path) or write_yaml(path, data))
+
+    for role in ('user', 'editor', 'admin'):
+        store.save({'alice': {'role': role}})
+    assert not os.path.exists('users.yaml')  # Not written yet...
+    assert store.load()['alice']['role'] == 'admin'  # ...but visible to this process
+
+    time.sleep(0.5)
+    assert len(writes) == 1
+    assert scraibe.read_yaml('users.yaml') == {'alice': {'role': 'admin'}}
+    assert not [name for name in os.listdir('.') if name.endswith('.tmp')]
+
+    store.save({'bob': {}}, delay=0)
+    assert scraibe.read_yaml('users.yaml') == {'bob': {}}